@@ -0,0 +1,535 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline benchmarks for `intro_multimodal_rag_utils`.
+
+Every Vertex AI model is replaced by a deterministic fake with a configurable latency, so the
+benchmarks run without credentials or network access and produce comparable numbers:
+
+- Ingestion: `get_document_metadata` over generated PDF fixtures, in several configurations.
+- Queries: latency percentiles of `get_similar_text_from_query` and
+  `get_similar_image_from_query` over synthetic embedding corpora (10k to 1M rows by default).
+
+Usage (from the retrieval-augmented-generation directory):
+
+    python utils/benchmark_intro_multimodal_rag_utils.py --output results.json
+    python utils/benchmark_intro_multimodal_rag_utils.py --baseline results.json
+
+With `--baseline`, the run is compared with an earlier results file and the script exits with a
+non-zero status if any metric regressed by more than `--tolerance`.
+
+The pipelined ingestion configurations parse PDFs in worker processes that inherit the fake
+models, so they rely on the "fork" start method (the Linux default).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import PIL.Image
+import fitz
+import numpy as np
+import pandas as pd
+
+from fake_models import (
+    FakeGenerativeModel,
+    FakeMultiModalEmbeddingModel,
+    FakeTextEmbeddingModel,
+    import_utils_with_fake_models,
+)
+
+DEFAULT_CORPUS_SIZES = [10_000, 100_000, 1_000_000]
+
+# The ingestion configurations, as keyword arguments of `get_document_metadata`
+INGESTION_CONFIGS: Dict[str, Dict[str, Any]] = {
+    "serial": {},
+    "serial_batched_descriptions": {"images_per_description_request": 4},
+    "pipelined": {"pipelined": True, "max_model_workers": 8},
+    "pipelined_triage": {"pipelined": True, "max_model_workers": 8, "triage": True},
+}
+
+# The metrics compared with `--baseline`; lower is better for all of them
+COMPARED_METRICS = {
+    "ingestion": ["elapsed_s"],
+    "queries": ["p50_ms", "p95_ms"],
+}
+
+
+# Fixtures
+
+
+def _get_image_bytes(rng: np.random.Generator, size: int) -> bytes:
+    """Returns a random gradient image with some noise, encoded as PNG."""
+
+    base = rng.integers(0, 256, size=3)
+    gradient = np.linspace(0, 1, size)[:, None, None] * rng.integers(0, 256, size=3)
+    noise = rng.integers(0, 48, size=(size, size, 3))
+    pixels = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+
+    output = io.BytesIO()
+    PIL.Image.fromarray(pixels).save(output, format="PNG")
+    return output.getvalue()
+
+
+def _get_paragraph(rng: np.random.Generator, num_words: int) -> str:
+    """Returns a random paragraph of common English words."""
+
+    words = (
+        "the revenue growth quarter model image chart cloud data report "
+        "increase customer product market total share value and of in for"
+    ).split()
+    return " ".join(rng.choice(words, size=num_words)).capitalize() + "."
+
+
+def generate_pdf_fixtures(
+    output_dir: str,
+    num_files: int = 4,
+    pages_per_file: int = 5,
+    images_per_page: int = 2,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Writes PDFs with random text and images. The first image of every page is the same logo,
+    so image triage has duplicates to skip.
+
+    Args:
+        output_dir: The directory where the PDFs are written.
+        num_files: The number of PDFs.
+        pages_per_file: The number of pages of each PDF.
+        images_per_page: The number of images of each page, including the logo.
+        seed: The random seed.
+
+    Returns:
+        The paths of the PDFs.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    logo = _get_image_bytes(rng, 64)
+
+    pdf_paths = []
+    for file_no in range(num_files):
+        doc = fitz.open()
+        for _ in range(pages_per_file):
+            page = doc.new_page()
+            page.insert_textbox(
+                fitz.Rect(50, 50, 550, 400),
+                "\n\n".join(_get_paragraph(rng, 60) for _ in range(4)),
+                fontsize=9,
+            )
+            for image_no in range(images_per_page):
+                image = logo if image_no == 0 else _get_image_bytes(rng, 256)
+                left = 50 + 170 * (image_no % 3)
+                top = 420 + 170 * (image_no // 3)
+                page.insert_image(
+                    fitz.Rect(left, top, left + 160, top + 160), stream=image
+                )
+
+        pdf_path = os.path.join(output_dir, f"benchmark_{file_no}.pdf")
+        doc.save(pdf_path)
+        doc.close()
+        pdf_paths.append(pdf_path)
+
+    return pdf_paths
+
+
+def make_synthetic_corpus(
+    num_rows: int,
+    image_dir: str,
+    text_embedding_size: int = 768,
+    image_embedding_size: int = 128,
+    chunks_per_page: int = 4,
+    pages_per_file: int = 100,
+    num_image_files: int = 16,
+    seed: int = 0,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Builds text and image metadata DataFrames with the columns produced by
+    `get_document_metadata` and `num_rows` random unit embeddings each.
+
+    Args:
+        num_rows: The number of text chunks and of images.
+        image_dir: The directory for the image files the image rows point to.
+        text_embedding_size: The dimension of the text embeddings.
+        image_embedding_size: The dimension of the multimodal image embeddings.
+        chunks_per_page: The number of text chunks of each page.
+        pages_per_file: The number of pages of each file.
+        num_image_files: The number of distinct image files shared by the image rows.
+        seed: The random seed.
+
+    Returns:
+        A tuple with the text metadata DataFrame and the image metadata DataFrame.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    def get_unit_rows(num: int, dimension: int) -> List[np.ndarray]:
+        matrix = rng.standard_normal((num, dimension), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return list(matrix)
+
+    os.makedirs(image_dir, exist_ok=True)
+    image_paths = []
+    for image_no in range(num_image_files):
+        image_path = os.path.join(image_dir, f"corpus_image_{image_no}.png")
+        with open(image_path, "wb") as image_file:
+            image_file.write(_get_image_bytes(rng, 64))
+        image_paths.append(image_path)
+
+    rows = np.arange(num_rows)
+    pages = rows // chunks_per_page
+    num_pages = int(pages[-1]) + 1 if num_rows else 0
+    file_names = np.array(
+        [f"file_{file_no}.pdf" for file_no in range(num_pages // pages_per_file + 1)]
+    )
+    page_texts = np.array([f"Text of page {page_no}." for page_no in range(num_pages)])
+    page_embeddings = get_unit_rows(num_pages, text_embedding_size)
+
+    text_metadata_df = pd.DataFrame(
+        {
+            "file_name": file_names[pages // pages_per_file],
+            "page_num": pages % pages_per_file + 1,
+            "text": page_texts[pages],
+            "text_embedding_page": [page_embeddings[page] for page in pages],
+            "chunk_number": rows % chunks_per_page + 1,
+            "chunk_text": [f"Chunk {row} of the corpus." for row in rows],
+            "text_embedding_chunk": get_unit_rows(num_rows, text_embedding_size),
+        }
+    )
+
+    image_metadata_df = pd.DataFrame(
+        {
+            "file_name": text_metadata_df["file_name"],
+            "page_num": text_metadata_df["page_num"],
+            "img_num": text_metadata_df["chunk_number"],
+            "img_path": [image_paths[row % num_image_files] for row in rows],
+            "img_desc": [f"Description of image {row}." for row in rows],
+            "mm_embedding_from_img_only": get_unit_rows(num_rows, image_embedding_size),
+            "text_embedding_from_image_description": text_metadata_df[
+                "text_embedding_chunk"
+            ],
+        }
+    )
+
+    return text_metadata_df, image_metadata_df
+
+
+# Benchmarks
+
+
+def _get_latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """Summarizes call latencies given in seconds, in milliseconds."""
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p90_ms": float(np.percentile(latencies_ms, 90)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def benchmark_ingestion(
+    utils: Any,
+    generative_model: FakeGenerativeModel,
+    pdf_dir: str,
+    image_save_dir: str,
+    configs: Dict[str, Dict[str, Any]] = INGESTION_CONFIGS,
+) -> List[Dict[str, Any]]:
+    """
+    Runs `get_document_metadata` over the PDFs of `pdf_dir` once per configuration.
+
+    Returns:
+        One result per configuration with the elapsed time, the throughput and the number of
+        model calls.
+    """
+
+    fake_models = {
+        "text_embedding_calls": utils.text_embedding_model,
+        "multimodal_embedding_calls": utils.multimodal_embedding_model,
+        "generative_calls": generative_model,
+    }
+
+    results = []
+    for config_name, config in configs.items():
+        kwargs = {key: value for key, value in config.items() if key != "triage"}
+        if config.get("triage"):
+            kwargs["image_triage"] = utils.ImageTriage()
+
+        calls_before = {key: model.calls for key, model in fake_models.items()}
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            text_metadata_df, image_metadata_df = utils.get_document_metadata(
+                generative_model,
+                pdf_dir,
+                image_save_dir,
+                "Describe the image in detail.",
+                **kwargs,
+            )
+        elapsed = time.perf_counter() - start
+
+        num_pages = len(text_metadata_df.drop_duplicates(["file_name", "page_num"]))
+        result = {
+            "name": config_name,
+            "elapsed_s": elapsed,
+            "files": int(text_metadata_df["file_name"].nunique()),
+            "pages": num_pages,
+            "images": len(image_metadata_df),
+            "pages_per_s": num_pages / elapsed,
+            "images_per_s": len(image_metadata_df) / elapsed,
+        }
+        for key, model in fake_models.items():
+            result[key] = model.calls - calls_before[key]
+
+        print(f"ingestion {config_name}: {elapsed:.2f} s")
+        results.append(result)
+
+    return results
+
+
+def _time_queries(run_query: Any, num_queries: int) -> Dict[str, float]:
+    """Times one cold query and `num_queries` warm queries."""
+
+    start = time.perf_counter()
+    run_query(0)
+    cold = time.perf_counter() - start
+
+    latencies = []
+    for query_no in range(1, num_queries + 1):
+        start = time.perf_counter()
+        run_query(query_no)
+        latencies.append(time.perf_counter() - start)
+
+    stats = {"cold_ms": cold * 1000}
+    stats.update(_get_latency_stats(latencies))
+    return stats
+
+
+def benchmark_queries(
+    utils: Any,
+    corpus_sizes: List[int],
+    query_image_paths: List[str],
+    work_dir: str,
+    num_queries: int = 100,
+    top_n: int = 3,
+    text_embedding_size: int = 768,
+    image_embedding_size: int = 128,
+) -> List[Dict[str, Any]]:
+    """
+    Measures the latency of text and image queries against synthetic corpora.
+
+    The first query against each corpus is reported separately as "cold_ms", since it also packs
+    the embedding matrix and builds the page text index. The query embedding cache is disabled,
+    so every query calls the (fake) embedding model.
+
+    Returns:
+        One result per corpus size and query type with the latency percentiles in milliseconds.
+    """
+
+    utils.set_query_embedding_cache(None)
+
+    results = []
+    for num_rows in corpus_sizes:
+        text_metadata_df, image_metadata_df = make_synthetic_corpus(
+            num_rows,
+            os.path.join(work_dir, "corpus_images"),
+            text_embedding_size,
+            image_embedding_size,
+        )
+
+        queries = {
+            "text": lambda query_no: utils.get_similar_text_from_query(
+                f"What was the revenue growth in quarter {query_no}?",
+                text_metadata_df,
+                column_name="text_embedding_chunk",
+                top_n=top_n,
+                chunk_text=True,
+            ),
+            "image": lambda query_no: utils.get_similar_image_from_query(
+                text_metadata_df,
+                image_metadata_df,
+                image_query_path=query_image_paths[query_no % len(query_image_paths)],
+                column_name="mm_embedding_from_img_only",
+                image_emb=True,
+                top_n=top_n,
+                embedding_size=image_embedding_size,
+            ),
+        }
+
+        for query_type, run_query in queries.items():
+            result = {
+                "name": f"{query_type}/{num_rows}",
+                "query_type": query_type,
+                "rows": num_rows,
+                "queries": num_queries,
+            }
+            result.update(_time_queries(run_query, num_queries))
+
+            print(
+                f"{query_type} queries, {num_rows} rows: p50 {result['p50_ms']:.2f} ms, "
+                f"p95 {result['p95_ms']:.2f} ms"
+            )
+            results.append(result)
+
+        # Release the corpus before building the next, larger one
+        queries.clear()
+        text_metadata_df = image_metadata_df = None
+
+    return results
+
+
+def compare_results(
+    baseline: Dict[str, Any], results: Dict[str, Any], tolerance: float = 0.2
+) -> List[str]:
+    """
+    Compares two benchmark results.
+
+    Args:
+        baseline: The results of an earlier run.
+        results: The results of this run.
+        tolerance: The allowed relative increase of each metric.
+
+    Returns:
+        A description of each metric that increased by more than `tolerance`.
+    """
+
+    regressions = []
+    for section, metrics in COMPARED_METRICS.items():
+        baseline_results = {
+            result["name"]: result for result in baseline.get(section, [])
+        }
+        for result in results.get(section, []):
+            baseline_result = baseline_results.get(result["name"])
+            if baseline_result is None:
+                continue
+
+            for metric in metrics:
+                before, after = baseline_result[metric], result[metric]
+                if before > 0 and after > before * (1 + tolerance):
+                    regressions.append(
+                        f"{section} {result['name']} {metric}: {before:.3f} -> {after:.3f} "
+                        f"(+{(after / before - 1) * 100:.0f}%)"
+                    )
+
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with this earlier results file.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--corpus-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_CORPUS_SIZES,
+    )
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--text-embedding-size", type=int, default=768)
+    parser.add_argument("--num-files", type=int, default=4)
+    parser.add_argument("--pages-per-file", type=int, default=5)
+    parser.add_argument("--images-per-page", type=int, default=2)
+    parser.add_argument("--text-latency", type=float, default=0.05)
+    parser.add_argument("--multimodal-latency", type=float, default=0.05)
+    parser.add_argument("--generative-latency", type=float, default=0.2)
+    parser.add_argument("--skip-ingestion", action="store_true")
+    parser.add_argument("--skip-queries", action="store_true")
+    args = parser.parse_args(argv)
+
+    text_model = FakeTextEmbeddingModel(args.text_latency, args.text_embedding_size)
+    multimodal_model = FakeMultiModalEmbeddingModel(args.multimodal_latency)
+    generative_model = FakeGenerativeModel(args.generative_latency)
+    utils = import_utils_with_fake_models(text_model, multimodal_model)
+
+    results: Dict[str, Any] = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "cpu_count": os.cpu_count(),
+            "arguments": vars(args),
+        }
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        pdf_dir = os.path.join(work_dir, "pdfs")
+        generate_pdf_fixtures(
+            pdf_dir, args.num_files, args.pages_per_file, args.images_per_page
+        )
+
+        if not args.skip_ingestion:
+            results["ingestion"] = benchmark_ingestion(
+                utils,
+                generative_model,
+                pdf_dir,
+                os.path.join(work_dir, "images"),
+            )
+
+        if not args.skip_queries:
+            # Query latencies measure the local search work only
+            text_model.latency = multimodal_model.latency = 0.0
+
+            query_image_dir = os.path.join(work_dir, "query_images")
+            rng = np.random.default_rng(1)
+            os.makedirs(query_image_dir)
+            query_image_paths = []
+            for image_no in range(8):
+                query_image_path = os.path.join(
+                    query_image_dir, f"query_{image_no}.png"
+                )
+                with open(query_image_path, "wb") as image_file:
+                    image_file.write(_get_image_bytes(rng, 64))
+                query_image_paths.append(query_image_path)
+
+            results["queries"] = benchmark_queries(
+                utils,
+                args.corpus_sizes,
+                query_image_paths,
+                work_dir,
+                args.num_queries,
+                text_embedding_size=args.text_embedding_size,
+            )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(
+                json.load(baseline_file), results, args.tolerance
+            )
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
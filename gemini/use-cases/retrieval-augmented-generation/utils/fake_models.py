@@ -0,0 +1,172 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Deterministic fakes of the Vertex AI models used by `intro_multimodal_rag_utils`.
+
+The fakes are shared by the unit tests and the offline benchmarks, so both run without
+credentials or network access.
+"""
+
+import hashlib
+import importlib
+import json
+import threading
+import time
+from typing import Any, List, Optional
+from unittest import mock
+
+import numpy as np
+from vertexai.language_models import TextEmbeddingModel
+from vertexai.vision_models import MultiModalEmbeddingModel
+
+
+def _get_seed(*parts: Any) -> int:
+    """Returns a stable random seed for the given values."""
+
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _get_unit_vector(dimension: int, *parts: Any) -> List[float]:
+    """Returns a deterministic random unit vector for the given values."""
+
+    vector = np.random.default_rng(_get_seed(*parts)).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class _FakeModel:
+    """Counts calls and sleeps for `latency` seconds per call, like a remote model."""
+
+    def __init__(self, model_name: str, latency: float = 0.0):
+        self._model_name = model_name
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self) -> None:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeTextEmbeddingModel(_FakeModel):
+    """A stand-in for `TextEmbeddingModel` returning deterministic unit vectors."""
+
+    class _Embedding:
+        def __init__(self, values: List[float]):
+            self.values = values
+
+    def __init__(self, latency: float = 0.0, dimension: int = 768):
+        super().__init__("fake-textembedding", latency)
+        self.dimension = dimension
+
+    def get_embeddings(self, texts: List[Any], **kwargs) -> List[Any]:
+        self._call()
+        return [
+            self._Embedding(
+                _get_unit_vector(self.dimension, "text", getattr(text, "text", text))
+            )
+            for text in texts
+        ]
+
+
+class FakeMultiModalEmbeddingModel(_FakeModel):
+    """A stand-in for `MultiModalEmbeddingModel` returning deterministic unit vectors."""
+
+    class _Embeddings:
+        def __init__(self, image_embedding: List[float], text_embedding: List[float]):
+            self.image_embedding = image_embedding
+            self.text_embedding = text_embedding
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__("fake-multimodalembedding", latency)
+
+    def get_embeddings(
+        self,
+        image: Any = None,
+        contextual_text: Optional[str] = None,
+        dimension: int = 1408,
+        **kwargs,
+    ) -> Any:
+        self._call()
+        image_digest = hashlib.sha256(
+            getattr(image, "_image_bytes", None) or b""
+        ).hexdigest()
+        return self._Embeddings(
+            _get_unit_vector(dimension, "image", image_digest),
+            _get_unit_vector(dimension, "text", contextual_text),
+        )
+
+
+class FakeGenerativeModel(_FakeModel):
+    """
+    A stand-in for the Gemini `GenerativeModel` describing each input image by its content hash.
+    Requests with several images are answered with a JSON array of descriptions.
+    """
+
+    class _Chunk:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__("fake-gemini", latency)
+
+    def generate_content(
+        self,
+        contents: List[Any],
+        generation_config: Any = None,
+        safety_settings: Any = None,
+        stream: bool = False,
+        **kwargs,
+    ) -> Any:
+        self._call()
+        descriptions = [
+            "An image with content "
+            + hashlib.sha256(part.data).hexdigest()[:12]
+            + ". "
+            + " ".join(["It shows a chart with labelled axes and a legend."] * 4)
+            for part in contents
+            if not isinstance(part, str)
+        ]
+
+        text = descriptions[0] if len(descriptions) == 1 else json.dumps(descriptions)
+        middle = len(text) // 2
+        chunks = [self._Chunk(text[:middle]), self._Chunk(text[middle:])]
+
+        return chunks if stream else self._Chunk(text)
+
+
+def import_utils_with_fake_models(
+    text_model: FakeTextEmbeddingModel, multimodal_model: FakeMultiModalEmbeddingModel
+) -> Any:
+    """
+    Imports `intro_multimodal_rag_utils` without loading any Vertex AI model and installs the
+    fake embedding models in it.
+
+    Returns:
+        The `intro_multimodal_rag_utils` module.
+    """
+
+    with mock.patch.object(
+        TextEmbeddingModel, "from_pretrained", return_value=text_model
+    ), mock.patch.object(
+        MultiModalEmbeddingModel, "from_pretrained", return_value=multimodal_model
+    ):
+        utils = importlib.import_module("intro_multimodal_rag_utils")
+
+    utils.text_embedding_model = text_model
+    utils.multimodal_embedding_model = multimodal_model
+    return utils
@@ -1,12 +1,41 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 import glob
+import hashlib
+import io
+import itertools
+import json
 import os
+import random
+import sqlite3
+import threading
 import time
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from IPython.display import display
-import PIL
+import PIL.Image
 from colorama import Fore, Style
 import fitz
+from google.api_core.exceptions import ResourceExhausted
 import numpy as np
 import pandas as pd
 from vertexai.generative_models import (
@@ -25,6 +54,746 @@ multimodal_embedding_model = MultiModalEmbeddingModel.from_pretrained(
 )
 
 
+# Rate-aware batched text embedding
+
+
+class TokenBucket:
+    """
+    A thread-safe token-bucket rate limiter refilled continuously at a per-minute rate.
+
+    Attributes:
+        rate_per_minute: The number of tokens added to the bucket every minute.
+        capacity: The maximum number of tokens the bucket holds (defaults to one minute of tokens).
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive.")
+
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        Blocks until `amount` tokens are available and takes them from the bucket.
+
+        Args:
+            amount: The number of tokens to take. Amounts above the capacity are clamped.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+
+        amount = min(amount, self.capacity)
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate_per_minute / 60,
+                )
+                self._updated_at = now
+
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+
+                delay = (amount - self._tokens) * 60 / self.rate_per_minute
+
+            time.sleep(delay)
+            waited += delay
+
+
+class TextEmbeddingScheduler:
+    """
+    Groups texts into batched `TextEmbeddingModel.get_embeddings` calls and paces them with
+    token buckets configured in requests and tokens per minute. Requests rejected with
+    `ResourceExhausted` are retried with exponential backoff and full jitter.
+
+    Token counts are estimated from the text length (`chars_per_token` characters per token).
+
+    Attributes:
+        model: The text embedding model. Defaults to the module level `text_embedding_model`.
+        max_instances_per_request: The maximum number of texts sent in a single request.
+        max_tokens_per_request: The maximum estimated number of tokens sent in a single request.
+        requests_per_minute: The request quota. None disables request pacing.
+        tokens_per_minute: The token quota. None disables token pacing.
+        max_retries: How many times a request rejected with `ResourceExhausted` is retried.
+        initial_backoff: The upper bound, in seconds, of the first retry delay.
+        max_backoff: The upper bound, in seconds, of any retry delay.
+        request_count: The number of requests sent so far, including retries.
+        retry_count: The number of retries performed so far.
+    """
+
+    def __init__(
+        self,
+        model: Optional[TextEmbeddingModel] = None,
+        max_instances_per_request: int = 250,
+        max_tokens_per_request: int = 20000,
+        requests_per_minute: Optional[float] = 600,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        chars_per_token: float = 4.0,
+    ):
+        self.model = model
+        self.max_instances_per_request = max_instances_per_request
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.chars_per_token = chars_per_token
+        self.request_limiter = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_limiter = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.request_count = 0
+        self.retry_count = 0
+        self._stats_lock = threading.Lock()
+
+    def estimate_token_count(self, text: str) -> int:
+        """Estimates the number of tokens in a text from its length."""
+        return max(1, int(len(text) / self.chars_per_token))
+
+    def get_batches(self, texts: List[str]) -> List[List[str]]:
+        """
+        Splits texts, in order, into batches within the per-request instance and token limits.
+
+        Args:
+            texts: The texts to embed.
+
+        Returns:
+            A list of batches of texts.
+        """
+
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        batch_tokens = 0
+
+        for text in texts:
+            tokens = self.estimate_token_count(text)
+            if batch and (
+                len(batch) >= self.max_instances_per_request
+                or batch_tokens + tokens > self.max_tokens_per_request
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def embed(self, texts: List[str]) -> List[list]:
+        """
+        Generates embeddings for a list of texts.
+
+        Args:
+            texts: The input text strings to be embedded.
+
+        Returns:
+            One embedding (as a list) per input text, in input order.
+        """
+
+        text_embeddings: List[list] = []
+
+        for batch in self.get_batches(list(texts)):
+            text_embeddings.extend(self._embed_batch(batch))
+
+        return text_embeddings
+
+    def _embed_batch(self, batch: List[str]) -> List[list]:
+        """Sends one batch to the model, honoring the quotas and retrying on ResourceExhausted."""
+
+        model = self.model or text_embedding_model
+        batch_tokens = sum(self.estimate_token_count(text) for text in batch)
+        batch_bytes = sum(len(text.encode("utf-8")) for text in batch)
+
+        attempt = 0
+
+        with _profile_stage("text_embedding", batch_bytes) as profile:
+            while True:
+                waited = 0.0
+                if self.request_limiter:
+                    waited += self.request_limiter.acquire()
+                if self.token_limiter:
+                    waited += self.token_limiter.acquire(batch_tokens)
+                if waited and ingestion_profiler is not None:
+                    ingestion_profiler.add_event(
+                        "quota_wait", time.time() - waited, waited
+                    )
+
+                with self._stats_lock:
+                    self.request_count += 1
+                try:
+                    embeddings = model.get_embeddings(batch)
+                except ResourceExhausted:
+                    if attempt >= self.max_retries:
+                        raise
+                    backoff = min(self.max_backoff, self.initial_backoff * 2**attempt)
+                    time.sleep(random.uniform(0, backoff))
+                    with self._stats_lock:
+                        self.retry_count += 1
+                    attempt += 1
+                    profile["retries"] = attempt
+                    continue
+
+                return [embedding.values for embedding in embeddings]
+
+
+text_embedding_scheduler = TextEmbeddingScheduler()
+
+
+# Persistent content-addressed cache for embeddings and image descriptions
+
+
+class IngestionCache:
+    """
+    An on-disk SQLite cache for text embeddings, multimodal image embeddings and Gemini image
+    descriptions, keyed by a hash of the content and of the parameters that shape the result
+    (model name, embedding dimension, prompt).
+
+    Entries are evicted least-recently-used first once the stored values exceed `max_size_bytes`.
+    The cache can be shared by the threads of a pipelined ingestion.
+
+    Attributes:
+        cache_dir: The directory holding the SQLite database.
+        max_size_bytes: The maximum total size of the cached values.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups that had to call a model.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int = 2 * 1024**3):
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(cache_dir, "ingestion_cache.sqlite3"),
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+        )
+        self._connection.commit()
+        self._size_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(kind: str, content: bytes, **params: Any) -> str:
+        """
+        Builds a cache key from the kind of entry, the content bytes and the result parameters.
+
+        Args:
+            kind: The kind of entry, e.g. "text_embedding" or "image_description".
+            content: The chunk text or image bytes.
+            params: The parameters that change the result, e.g. model name and dimension.
+
+        Returns:
+            A hexadecimal SHA-256 digest.
+        """
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps([kind, params], sort_keys=True, default=str).encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for a key, or None on a miss."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """Stores a JSON-serializable value and evicts old entries if the cache is too large."""
+
+        data = json.dumps(value).encode()
+
+        with self._lock:
+            previous = self._connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._size_bytes += len(data) - (previous[0] if previous else 0)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until the cache fits in `max_size_bytes`."""
+
+        while self._size_bytes > self.max_size_bytes:
+            oldest = self._connection.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not oldest:
+                self._size_bytes = 0
+                return
+
+            for key, size in oldest:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._size_bytes -= size
+                if self._size_bytes <= self.max_size_bytes:
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit and miss counters, the hit rate, the entry count and the stored size."""
+
+        with self._lock:
+            entries = self._connection.execute(
+                "SELECT COUNT(*) FROM entries"
+            ).fetchone()[0]
+            lookups = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "size_bytes": self._size_bytes,
+            }
+
+    def clear(self) -> None:
+        """Deletes every entry and resets the counters."""
+
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._connection.commit()
+            self._size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+
+        with self._lock:
+            self._connection.close()
+
+
+ingestion_cache: Optional[IngestionCache] = None
+
+
+def set_ingestion_cache(
+    cache_dir: Optional[str], max_size_bytes: int = 2 * 1024**3
+) -> Optional[IngestionCache]:
+    """
+    Enables (or, with `cache_dir=None`, disables) the persistent cache consulted by the embedding
+    helpers and the image description call.
+
+    Args:
+        cache_dir: The directory holding the cache database.
+        max_size_bytes: The maximum total size of the cached values (defaults to 2 GiB).
+
+    Returns:
+        The active IngestionCache, or None if caching is disabled.
+    """
+
+    global ingestion_cache
+
+    if ingestion_cache is not None:
+        ingestion_cache.close()
+
+    ingestion_cache = (
+        IngestionCache(cache_dir, max_size_bytes) if cache_dir is not None else None
+    )
+    return ingestion_cache
+
+
+def _get_model_name(model: Any) -> str:
+    """Returns the resource name of a Vertex AI model, used to scope cache keys."""
+
+    return (
+        getattr(model, "_model_name", None)
+        or getattr(model, "_model_id", None)
+        or type(model).__name__
+    )
+
+
+def _read_image_content(image_uri: str) -> bytes:
+    """Returns the bytes identifying an image: the file content, or the URI for GCS images."""
+
+    if image_uri.startswith("gs://"):
+        return image_uri.encode()
+
+    with open(image_uri, "rb") as image_file:
+        return image_file.read()
+
+
+# Query embedding cache
+
+
+class QueryEmbeddingCache:
+    """
+    A bounded in-memory LRU cache of user query embeddings, keyed by a hash of the normalized
+    query text (or of the query image bytes), the model name and the embedding dimension.
+
+    Repeated queries of interactive sessions and evaluation loops skip the embedding model call.
+    With a `cache_path`, the entries are loaded from that JSON file and written back by `save`.
+
+    Attributes:
+        max_entries: The maximum number of cached embeddings.
+        cache_path: The JSON file the cache is persisted to, or None.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups that had to call a model.
+    """
+
+    def __init__(self, max_entries: int = 1024, cache_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                self._entries.update(json.load(cache_file))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def make_text_key(text: str, model_name: str) -> str:
+        """Builds the key of a text query; whitespace and Unicode normalization do not change it."""
+
+        normalized_text = " ".join(unicodedata.normalize("NFC", text).split())
+        return IngestionCache.make_key(
+            "query_text_embedding",
+            normalized_text.encode("utf-8"),
+            model_name=model_name,
+        )
+
+    @staticmethod
+    def make_image_key(image_uri: str, model_name: str, dimension: int) -> str:
+        """Builds the key of an image query from the image bytes (or the URI of a GCS image)."""
+
+        return IngestionCache.make_key(
+            "query_image_embedding",
+            _read_image_content(image_uri),
+            model_name=model_name,
+            dimension=dimension,
+        )
+
+    def get(self, key: str) -> Optional[list]:
+        """Returns the cached embedding for a key, or None on a miss."""
+
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return embedding
+
+    def put(self, key: str, embedding: list) -> None:
+        """Stores an embedding and evicts the least recently used entry if the cache is full."""
+
+        with self._lock:
+            self._entries[key] = list(embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit and miss counters, the hit rate and the entry count."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def clear(self) -> None:
+        """Deletes every entry and resets the counters."""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def save(self) -> None:
+        """Writes the entries to `cache_path`, from least to most recently used."""
+
+        if self.cache_path is None:
+            return
+
+        with self._lock:
+            data = json.dumps(self._entries).encode()
+
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _write_atomically(self.cache_path, lambda file: file.write(data))
+
+
+query_embedding_cache: Optional[QueryEmbeddingCache] = QueryEmbeddingCache()
+
+
+def set_query_embedding_cache(
+    max_entries: Optional[int] = 1024, cache_path: Optional[str] = None
+) -> Optional[QueryEmbeddingCache]:
+    """
+    Replaces (or, with `max_entries=None`, disables) the cache consulted by
+    `get_user_query_text_embeddings` and `get_user_query_image_embeddings`.
+
+    Args:
+        max_entries: The maximum number of cached query embeddings.
+        cache_path: A JSON file to load the cache from; `query_embedding_cache.save()` writes it back.
+
+    Returns:
+        The active QueryEmbeddingCache, or None if caching is disabled.
+    """
+
+    global query_embedding_cache
+
+    query_embedding_cache = (
+        QueryEmbeddingCache(max_entries, cache_path)
+        if max_entries is not None
+        else None
+    )
+    return query_embedding_cache
+
+
+# Ingestion profiling
+
+
+class IngestionProfiler:
+    """
+    Records the wall time, bytes and retries of every ingestion stage call (text extraction,
+    image extraction, image triage, Gemini descriptions, image embeddings, text embeddings,
+    quota waits and page sleeps), attributed to the file and page being processed.
+
+    Enable it with `set_ingestion_profiler`, run `get_document_metadata`, then inspect `summary()`
+    or open the file written by `write_chrome_trace` in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._context = threading.local()
+
+    def set_context(self, file_name: Optional[str], page_num: Optional[int]) -> None:
+        """Attributes the stages later recorded by the calling thread to a file and page."""
+
+        self._context.file_name = file_name
+        self._context.page_num = page_num
+
+    def add_event(
+        self,
+        stage: str,
+        start: float,
+        duration: float,
+        num_bytes: int = 0,
+        retries: int = 0,
+    ) -> Dict[str, Any]:
+        """Records a stage call that started at `start` (seconds since the epoch)."""
+
+        event = {
+            "stage": stage,
+            "file_name": getattr(self._context, "file_name", None),
+            "page_num": getattr(self._context, "page_num", None),
+            "start": start,
+            "duration": duration,
+            "bytes": num_bytes,
+            "retries": retries,
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+        }
+        with self._lock:
+            self.events.append(event)
+        return event
+
+    def add_events(self, events: List[Dict[str, Any]]) -> None:
+        """Adds events recorded by another profiler, e.g. in a PDF parsing process."""
+
+        with self._lock:
+            self.events.extend(events)
+
+    @contextmanager
+    def stage(self, stage: str, num_bytes: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Times the enclosed block as one call of `stage`. The yielded dictionary's "bytes" and
+        "retries" entries can be updated inside the block.
+        """
+
+        counters = {"bytes": num_bytes, "retries": 0}
+        start = time.time()
+        try:
+            yield counters
+        finally:
+            self.add_event(
+                stage,
+                start,
+                time.time() - start,
+                counters["bytes"],
+                counters["retries"],
+            )
+
+    def get_events_df(self) -> pd.DataFrame:
+        """Returns one row per recorded stage call."""
+
+        with self._lock:
+            return pd.DataFrame(
+                list(self.events),
+                columns=[
+                    "stage",
+                    "file_name",
+                    "page_num",
+                    "start",
+                    "duration",
+                    "bytes",
+                    "retries",
+                    "pid",
+                    "thread",
+                ],
+            )
+
+    def summary(self, by: Union[str, List[str]] = "stage") -> pd.DataFrame:
+        """
+        Aggregates the recorded stage calls.
+
+        Args:
+            by: The columns to group by, e.g. "stage", ["file_name", "stage"] or
+                ["file_name", "page_num", "stage"].
+
+        Returns:
+            A DataFrame with the number of calls, the total, mean and maximum wall time in seconds,
+            the bytes and the retries of every group, sorted by total wall time. Wall time is summed
+            over concurrent calls, so it can exceed the elapsed time in pipelined mode.
+        """
+
+        events_df = self.get_events_df()
+        return (
+            events_df.groupby(by, dropna=False)
+            .agg(
+                calls=("duration", "size"),
+                wall_time_s=("duration", "sum"),
+                mean_s=("duration", "mean"),
+                max_s=("duration", "max"),
+                bytes=("bytes", "sum"),
+                retries=("retries", "sum"),
+            )
+            .sort_values("wall_time_s", ascending=False)
+        )
+
+    def write_chrome_trace(self, path: str) -> None:
+        """Writes the recorded stage calls as a Chrome trace event JSON file."""
+
+        with self._lock:
+            events = list(self.events)
+
+        origin = min((event["start"] for event in events), default=0.0)
+        trace_events = [
+            {
+                "name": event["stage"],
+                "cat": "ingestion",
+                "ph": "X",
+                "ts": (event["start"] - origin) * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": event["pid"],
+                "tid": event["thread"],
+                "args": {
+                    "file_name": event["file_name"],
+                    "page_num": event["page_num"],
+                    "bytes": event["bytes"],
+                    "retries": event["retries"],
+                },
+            }
+            for event in events
+        ]
+
+        with open(path, "w") as trace_file:
+            json.dump(
+                {"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file
+            )
+
+
+ingestion_profiler: Optional[IngestionProfiler] = None
+
+
+def set_ingestion_profiler(enabled: bool = True) -> Optional[IngestionProfiler]:
+    """
+    Enables (with a new, empty profiler) or disables the profiling of ingestion stages.
+
+    Args:
+        enabled: Whether to profile the following `get_document_metadata` calls.
+
+    Returns:
+        The active IngestionProfiler, or None if profiling is disabled.
+    """
+
+    global ingestion_profiler
+
+    ingestion_profiler = IngestionProfiler() if enabled else None
+    return ingestion_profiler
+
+
+def _profile_stage(stage: str, num_bytes: int = 0) -> Any:
+    """Returns a context manager timing a stage call if profiling is enabled."""
+
+    if ingestion_profiler is None:
+        return nullcontext({"bytes": num_bytes, "retries": 0})
+
+    return ingestion_profiler.stage(stage, num_bytes)
+
+
+def _set_profile_context(file_name: Optional[str], page_num: Optional[int]) -> None:
+    """Attributes the following stage calls of this thread to a file and page, if profiling."""
+
+    if ingestion_profiler is not None:
+        ingestion_profiler.set_context(file_name, page_num)
+
+
+def _call_in_profile_context(
+    file_name: str, page_num: Optional[int], function: Any, *args: Any
+) -> Any:
+    """Calls `function` in a worker thread with its stages attributed to a file and page."""
+
+    _set_profile_context(file_name, page_num)
+    return function(*args)
+
+
 # Functions for getting text and image embeddings
 
 
@@ -45,8 +814,7 @@ def get_text_embedding_from_text_embedding_model(
                                The format (list or NumPy array) depends on the
                                value of the 'return_array' parameter.
     """
-    embeddings = text_embedding_model.get_embeddings([text])
-    text_embedding = [embedding.values for embedding in embeddings][0]
+    text_embedding = get_text_embeddings_from_text_embedding_model([text])[0]
 
     if return_array:
         return np.fromiter(text_embedding, dtype=float)
@@ -55,11 +823,53 @@ def get_text_embedding_from_text_embedding_model(
     return text_embedding
 
 
+def get_text_embeddings_from_text_embedding_model(
+    texts: List[str],
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+) -> List[list]:
+    """
+    Generates text embeddings for a list of texts using batched calls to the text embedding model.
+
+    Args:
+        texts: The input text strings to be embedded.
+        embedding_scheduler: The scheduler batching and pacing the requests.
+                             Defaults to the module level `text_embedding_scheduler`.
+
+    Returns:
+        list: One 768-dimensional embedding (as a list) per input text, in input order.
+    """
+
+    embedding_scheduler = embedding_scheduler or text_embedding_scheduler
+
+    if ingestion_cache is None:
+        return embedding_scheduler.embed(texts)
+
+    # Only send the texts that are not cached yet
+    model_name = _get_model_name(embedding_scheduler.model or text_embedding_model)
+    keys = [
+        ingestion_cache.make_key(
+            "text_embedding", text.encode("utf-8"), model_name=model_name
+        )
+        for text in texts
+    ]
+    text_embeddings = [ingestion_cache.get(key) for key in keys]
+    missing = [index for index, value in enumerate(text_embeddings) if value is None]
+
+    for index, text_embedding in zip(
+        missing, embedding_scheduler.embed([texts[index] for index in missing])
+    ):
+        ingestion_cache.put(keys[index], text_embedding)
+        text_embeddings[index] = text_embedding
+
+    return text_embeddings
+
+
 def get_image_embedding_from_multimodal_embedding_model(
     image_uri: str,
     embedding_size: int = 512,
     text: Optional[str] = None,
     return_array: Optional[bool] = False,
+    image_bytes: Optional[bytes] = None,
 ) -> list:
     """Extracts an image embedding from a multimodal embedding model.
     The function can optionally utilize contextual text to refine the embedding.
@@ -70,19 +880,42 @@ def get_image_embedding_from_multimodal_embedding_model(
         embedding_size (int): The desired dimensionality of the output embedding. Defaults to 512.
         return_array (Optional[bool]): If True, returns the embedding as a NumPy array.
         Otherwise, returns a list. Defaults to False.
+        image_bytes (Optional[bytes]): The encoded image, if already in memory. `image_uri` is then not read.
 
     Returns:
         list: A list containing the image embedding values. If `return_array` is True, returns a NumPy array instead.
     """
-    image = vision_model_Image.load_from_file(image_uri)
-    embeddings = multimodal_embedding_model.get_embeddings(
-        image=image, contextual_text=text, dimension=embedding_size
-    )  # 128, 256, 512, 1408
+    cache_key = None
+    if ingestion_cache is not None:
+        cache_key = ingestion_cache.make_key(
+            "image_embedding",
+            image_bytes or _read_image_content(image_uri),
+            model_name=_get_model_name(multimodal_embedding_model),
+            dimension=embedding_size,
+            contextual_text=text,
+        )
+        image_embedding = ingestion_cache.get(cache_key)
+    else:
+        image_embedding = None
+
+    if image_embedding is None:
+        if image_bytes is not None:
+            image = vision_model_Image(image_bytes=image_bytes)
+        else:
+            image = vision_model_Image.load_from_file(image_uri)
+        with _profile_stage("image_embedding", len(image_bytes or b"")):
+            embeddings = multimodal_embedding_model.get_embeddings(
+                image=image, contextual_text=text, dimension=embedding_size
+            )  # 128, 256, 512, 1408
+        image_embedding = embeddings.image_embedding
+
+        if cache_key is not None:
+            ingestion_cache.put(cache_key, image_embedding)
 
     if return_array:
-        return np.fromiter(embeddings.image_embedding, dtype=float)
+        return np.fromiter(image_embedding, dtype=float)
 
-    return embeddings.image_embedding
+    return image_embedding
 
 
 def get_text_overlapping_chunk(
@@ -106,30 +939,54 @@ def get_text_overlapping_chunk(
 
     """
 
-    if overlap > character_limit:
-        raise ValueError("Overlap cannot be larger than character limit.")
-
-    # Initialize variables
-    chunk_number = 1
     chunked_text_dict = {}
 
-    # Iterate over text with the given limit and overlap
-    for i in range(0, len(text), character_limit - overlap):
-        end_index = min(i + character_limit, len(text))
-        chunk = text[i:end_index]
-
+    for chunk_number, (start, end) in get_text_chunk_offsets(
+        len(text), character_limit, overlap
+    ).items():
         # Encode and decode for consistent encoding
-        chunked_text_dict[chunk_number] = chunk.encode("ascii", "ignore").decode(
-            "utf-8", "ignore"
+        chunked_text_dict[chunk_number] = (
+            text[start:end].encode("ascii", "ignore").decode("utf-8", "ignore")
         )
 
-        # Increment chunk number
-        chunk_number += 1
-
     return chunked_text_dict
 
 
-def get_page_text_embedding(text_data: Union[dict, str]) -> dict:
+def get_text_chunk_offsets(
+    text_length: int, character_limit: int = 1000, overlap: int = 100
+) -> Dict[int, Tuple[int, int]]:
+    """
+    Returns the character offsets of the chunks made by `get_text_overlapping_chunk`, so the
+    chunks can be referenced in the page text instead of being copied.
+
+    Args:
+        text_length: The length of the text document to be chunked.
+        character_limit: Maximum characters per chunk (defaults to 1000).
+        overlap: Number of overlapping characters between chunks (defaults to 100).
+
+    Returns:
+        A dictionary where keys are chunk numbers and values are the (start, end) offsets of the
+        corresponding chunks.
+
+    Raises:
+        ValueError: If `overlap` is greater than `character_limit`.
+    """
+
+    if overlap > character_limit:
+        raise ValueError("Overlap cannot be larger than character limit.")
+
+    return {
+        chunk_number: (start, min(start + character_limit, text_length))
+        for chunk_number, start in enumerate(
+            range(0, text_length, character_limit - overlap), start=1
+        )
+    }
+
+
+def get_page_text_embedding(
+    text_data: Union[dict, str],
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+) -> dict:
     """
     * Generates embeddings for each text chunk using a specified embedding model.
     * Takes a dictionary of text chunks and an embedding size as input.
@@ -137,7 +994,7 @@ def get_page_text_embedding(text_data: Union[dict, str]) -> dict:
 
     Args:
         text_data: Either a dictionary of pre-chunked text or the entire page text.
-        embedding_size: Size of the embedding vector (defaults to 128).
+        embedding_scheduler: The scheduler batching and pacing the embedding requests.
 
     Returns:
         A dictionary where keys are chunk numbers or "text_embedding" and values are the corresponding embeddings.
@@ -150,16 +1007,20 @@ def get_page_text_embedding(text_data: Union[dict, str]) -> dict:
         return embeddings_dict
 
     if isinstance(text_data, dict):
-        # Process each chunk
-        for chunk_number, chunk_value in text_data.items():
-            embeddings_dict[
-                chunk_number
-            ] = get_text_embedding_from_text_embedding_model(text=chunk_value)
+        # Process all chunks in batched requests
+        chunk_embeddings = get_text_embeddings_from_text_embedding_model(
+            list(text_data.values()), embedding_scheduler
+        )
+        embeddings_dict = dict(zip(text_data.keys(), chunk_embeddings))
     else:
         # Process the first 1000 characters of the page text
         embeddings_dict[
             "text_embedding"
-        ] = get_text_embedding_from_text_embedding_model(text=text_data)
+        ] = get_text_embeddings_from_text_embedding_model(
+            [text_data], embedding_scheduler
+        )[
+            0
+        ]
 
     return embeddings_dict
 
@@ -169,6 +1030,7 @@ def get_chunk_text_metadata(
     character_limit: int = 1000,
     overlap: int = 100,
     embedding_size: int = 128,
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
 ) -> tuple[str, dict, dict, dict]:
     """
     * Extracts text from a given page object, chunks it, and generates embeddings for each chunk.
@@ -180,6 +1042,7 @@ def get_chunk_text_metadata(
         character_limit: Maximum characters per chunk (defaults to 1000).
         overlap: Number of overlapping characters between chunks (defaults to 100).
         embedding_size: Size of the embedding vector (defaults to 128).
+        embedding_scheduler: The scheduler batching and pacing the embedding requests.
 
     Returns:
         A tuple containing:
@@ -196,22 +1059,56 @@ def get_chunk_text_metadata(
     if overlap > character_limit:
         raise ValueError("Overlap cannot be larger than character limit.")
 
-    # Extract text from the page
-    text: str = page.get_text().encode("ascii", "ignore").decode("utf-8", "ignore")
-
-    # Get whole-page text embeddings
-    page_text_embeddings_dict: dict = get_page_text_embedding(text)
+    with _profile_stage("text_extraction") as profile:
+        # Extract text from the page
+        text: str = page.get_text().encode("ascii", "ignore").decode("utf-8", "ignore")
+        profile["bytes"] = len(text)
 
-    # Chunk the text with the given limit and overlap
-    chunked_text_dict: dict = get_text_overlapping_chunk(text, character_limit, overlap)
+        # Chunk the text with the given limit and overlap
+        chunked_text_dict: dict = get_text_overlapping_chunk(
+            text, character_limit, overlap
+        )
 
-    # Get embeddings for the chunks
-    chunk_embeddings_dict: dict = get_page_text_embedding(chunked_text_dict)
+    # Get whole-page and chunk text embeddings in shared batched requests
+    page_text_embeddings_dict, chunk_embeddings_dict = _get_page_and_chunk_embeddings(
+        text, chunked_text_dict, embedding_scheduler
+    )
 
     # Return all extracted data
     return text, page_text_embeddings_dict, chunked_text_dict, chunk_embeddings_dict
 
 
+def _get_page_and_chunk_embeddings(
+    text: str,
+    chunked_text_dict: dict,
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+) -> Tuple[dict, dict]:
+    """
+    Embeds the whole page text and its chunks in shared batched requests.
+
+    Args:
+        text: The page text.
+        chunked_text_dict: Dictionary of chunked text (key=chunk number, value=text chunk).
+        embedding_scheduler: The scheduler batching and pacing the embedding requests.
+
+    Returns:
+        A tuple containing the page embedding dictionary (key="text_embedding") and the chunk
+        embedding dictionary (key=chunk number). Both are empty when the page has no text.
+    """
+
+    page_text_embeddings_dict: dict = {}
+    chunk_embeddings_dict: dict = {}
+
+    if text:
+        embeddings = get_text_embeddings_from_text_embedding_model(
+            [text, *chunked_text_dict.values()], embedding_scheduler
+        )
+        page_text_embeddings_dict["text_embedding"] = embeddings[0]
+        chunk_embeddings_dict = dict(zip(chunked_text_dict.keys(), embeddings[1:]))
+
+    return page_text_embeddings_dict, chunk_embeddings_dict
+
+
 def get_image_for_gemini(
     doc: fitz.Document,
     image: tuple,
@@ -219,10 +1116,12 @@ def get_image_for_gemini(
     image_save_dir: str,
     file_name: str,
     page_num: int,
+    max_image_edge: Optional[int] = None,
+    save_image: bool = True,
 ) -> Tuple[Image, str]:
     """
-    Extracts an image from a PDF document, converts it to JPEG format, saves it to a specified directory,
-    and loads it as a PIL Image Object.
+    Extracts an image from a PDF document, converts it to JPEG format, optionally saves it to a specified
+    directory, and wraps the in-memory JPEG bytes as a Gemini Image Object.
 
     Parameters:
     - doc (fitz.Document): The PDF document from which the image is extracted.
@@ -231,44 +1130,631 @@ def get_image_for_gemini(
     - image_save_dir (str): The directory where the image will be saved.
     - file_name (str): The base name for the image file.
     - page_num (int): The page number from which the image is extracted.
+    - max_image_edge (Optional[int]): Downscales the image so that its longest edge is at most this many pixels.
+    - save_image (bool): Whether to write the image to `image_save_dir` (only needed for citations).
 
     Returns:
     - Tuple[Image.Image, str]: A tuple containing the Gemini Image object and the image filename.
     """
 
+    image_name, image_bytes = _extract_pdf_image(
+        doc,
+        image,
+        image_no,
+        image_save_dir,
+        file_name,
+        page_num,
+        max_image_edge,
+        save_image,
+    )
+
+    # Wrap the in-memory image as a Gemini Image Object
+    image_for_gemini = Image.from_bytes(image_bytes)
+
+    return image_for_gemini, image_name
+
+
+def _extract_pdf_image(
+    doc: fitz.Document,
+    image: tuple,
+    image_no: int,
+    image_save_dir: str,
+    file_name: str,
+    page_num: int,
+    max_image_edge: Optional[int] = None,
+    save_image: bool = True,
+) -> Tuple[str, bytes]:
+    """
+    Extracts an image from a PDF document as JPEG bytes, downscaled to `max_image_edge` if given,
+    and optionally saves them as a file in `image_save_dir`.
+
+    Returns:
+        A tuple containing the image filename and the JPEG bytes sent to the models.
+    """
+
+    with _profile_stage("image_extraction") as profile:
+        image_name, image_bytes = _extract_pdf_image_bytes(
+            doc, image, image_no, image_save_dir, file_name, page_num, max_image_edge
+        )
+        profile["bytes"] = len(image_bytes)
+
+        if save_image:
+            # Create the image save directory if it doesn't exist
+            os.makedirs(image_save_dir, exist_ok=True)
+
+            # Save the image to the specified location
+            with open(image_name, "wb") as image_file:
+                image_file.write(image_bytes)
+
+    return image_name, image_bytes
+
+
+def _extract_pdf_image_bytes(
+    doc: fitz.Document,
+    image: tuple,
+    image_no: int,
+    image_save_dir: str,
+    file_name: str,
+    page_num: int,
+    max_image_edge: Optional[int],
+) -> Tuple[str, bytes]:
+    """Returns the file name and the (optionally downscaled) JPEG bytes of a PDF image."""
+
     # Extract the image from the document
     xref = image[0]
     pix = fitz.Pixmap(doc, xref)
 
-    # Convert the image to JPEG format
-    pix.tobytes("jpeg")
-
     # Create the image file name
     image_name = f"{image_save_dir}/{file_name}_image_{page_num}_{image_no}_{xref}.jpeg"
 
-    # Create the image save directory if it doesn't exist
-    os.makedirs(image_save_dir, exist_ok=True)
+    if max_image_edge is not None and max(pix.width, pix.height) > max_image_edge:
+        # JPEG needs RGB without alpha
+        if pix.n - pix.alpha != 3:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
 
-    # Save the image to the specified location
-    pix.save(image_name)
+        pil_image = PIL.Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        pil_image.thumbnail((max_image_edge, max_image_edge), PIL.Image.LANCZOS)
 
-    # Load the saved image as a Gemini Image Object
-    image_for_gemini = Image.load_from_file(image_name)
+        image_buffer = io.BytesIO()
+        pil_image.save(image_buffer, format="JPEG", quality=90)
+        image_bytes = image_buffer.getvalue()
+    else:
+        image_bytes = pix.tobytes("jpeg")
 
-    return image_for_gemini, image_name
+    return image_name, image_bytes
 
 
-def get_gemini_response(
+def _get_image_description_and_embedding(
     generative_multimodal_model,
-    model_input: List[str],
-    stream: bool = True,
-    generation_config: Optional[GenerationConfig] = GenerationConfig(
-        temperature=0.2, max_output_tokens=2048
-    ),
-    safety_settings: Optional[dict] = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    image_name: str,
+    image_description_prompt: str,
+    embedding_size: int,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    image_bytes: Optional[bytes] = None,
+    coarse_embedding_size: Optional[int] = None,
+) -> Tuple[str, list, Optional[list]]:
+    """
+    Describes an image with Gemini and embeds it with the multimodal embedding model. When
+    `image_bytes` is given, the same in-memory bytes are sent to both models and `image_name`
+    is not read.
+
+    Returns:
+        A tuple containing the image description, the image embedding and the low-dimension
+        image embedding used for coarse-to-fine search (None if `coarse_embedding_size` is None).
+    """
+
+    response = _get_image_description(
+        generative_multimodal_model,
+        image_name,
+        image_description_prompt,
+        generation_config,
+        safety_settings,
+        image_bytes,
+    )
+
+    return (response,) + _get_image_embeddings(
+        image_name, embedding_size, image_bytes, coarse_embedding_size
+    )
+
+
+def _get_image_description_cache_key(
+    generative_multimodal_model,
+    image_name: str,
+    image_description_prompt: str,
+    image_bytes: Optional[bytes],
+) -> Optional[str]:
+    """Returns the ingestion cache key of an image description, or None if caching is disabled."""
+
+    if ingestion_cache is None:
+        return None
+
+    return ingestion_cache.make_key(
+        "image_description",
+        image_bytes or _read_image_content(image_name),
+        model_name=_get_model_name(generative_multimodal_model),
+        prompt=image_description_prompt,
+    )
+
+
+def _get_image_for_gemini(image_name: str, image_bytes: Optional[bytes]) -> Image:
+    """Wraps in-memory image bytes, or loads the image file, as a Gemini Image Object."""
+
+    if image_bytes is not None:
+        return Image.from_bytes(image_bytes)
+
+    return Image.load_from_file(image_name)
+
+
+def _get_image_description(
+    generative_multimodal_model,
+    image_name: str,
+    image_description_prompt: str,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    image_bytes: Optional[bytes] = None,
+) -> str:
+    """Describes one image with Gemini, consulting the ingestion cache first."""
+
+    cache_key = _get_image_description_cache_key(
+        generative_multimodal_model, image_name, image_description_prompt, image_bytes
+    )
+    response = ingestion_cache.get(cache_key) if cache_key is not None else None
+
+    if response is None:
+        image_for_gemini = _get_image_for_gemini(image_name, image_bytes)
+        with _profile_stage("image_description", len(image_bytes or b"")):
+            response = get_gemini_response(
+                generative_multimodal_model,
+                model_input=[image_description_prompt, image_for_gemini],
+                generation_config=generation_config,
+                safety_settings=safety_settings,
+                stream=True,
+            )
+
+        # Failed (blocked) responses are not cached so they are retried on the next run
+        if cache_key is not None and "Exception occurred" not in response:
+            ingestion_cache.put(cache_key, response)
+
+    return response
+
+
+def _get_image_embeddings(
+    image_name: str,
+    embedding_size: int,
+    image_bytes: Optional[bytes] = None,
+    coarse_embedding_size: Optional[int] = None,
+) -> Tuple[list, Optional[list]]:
+    """Returns the image embedding and the optional low-dimension image embedding of an image."""
+
+    image_embedding = get_image_embedding_from_multimodal_embedding_model(
+        image_uri=image_name,
+        embedding_size=embedding_size,
+        image_bytes=image_bytes,
+    )
+
+    coarse_image_embedding = None
+    if coarse_embedding_size is not None:
+        coarse_image_embedding = get_image_embedding_from_multimodal_embedding_model(
+            image_uri=image_name,
+            embedding_size=coarse_embedding_size,
+            image_bytes=image_bytes,
+        )
+
+    return image_embedding, coarse_image_embedding
+
+
+MULTI_IMAGE_DESCRIPTION_INSTRUCTION = (
+    "You are given {num_images} images. Follow the instructions above for each image separately "
+    "and return only a JSON array of exactly {num_images} strings, where the i-th string is the "
+    "description of the i-th image."
+)
+
+
+def _parse_image_descriptions(response: str, num_images: int) -> Optional[List[str]]:
+    """
+    Parses the JSON array of descriptions returned for a multi-image request.
+
+    Returns:
+        The descriptions, or None if the response is not a JSON array of `num_images` strings.
+    """
+
+    response = response.strip()
+
+    # Accept an array wrapped in a Markdown code block
+    if response.startswith("```"):
+        response = response.strip("`").strip()
+        if response.startswith("json"):
+            response = response.replace("json", "", 1)
+
+    try:
+        descriptions = json.loads(response)
+    except ValueError:
+        return None
+
+    if (
+        not isinstance(descriptions, list)
+        or len(descriptions) != num_images
+        or not all(isinstance(description, str) for description in descriptions)
+    ):
+        return None
+
+    return descriptions
+
+
+def _get_image_descriptions(
+    generative_multimodal_model,
+    image_names: List[str],
+    image_description_prompt: str,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    image_bytes_list: List[Optional[bytes]],
+    images_per_request: int,
+) -> List[str]:
+    """
+    Describes several images with multi-image Gemini requests of at most `images_per_request`
+    images, each asking for a JSON array of descriptions. A group whose response cannot be parsed
+    falls back to one request per image.
+
+    Returns:
+        One description per image, in input order.
+    """
+
+    cache_keys = [
+        _get_image_description_cache_key(
+            generative_multimodal_model,
+            image_name,
+            image_description_prompt,
+            image_bytes,
+        )
+        for image_name, image_bytes in zip(image_names, image_bytes_list)
+    ]
+    descriptions = [
+        ingestion_cache.get(cache_key) if cache_key is not None else None
+        for cache_key in cache_keys
+    ]
+    missing = [index for index, value in enumerate(descriptions) if value is None]
+
+    for start in range(0, len(missing), images_per_request):
+        end = start + images_per_request
+        group = missing[start:end]
+
+        group_descriptions = None
+        if len(group) > 1:
+            group_bytes = sum(len(image_bytes_list[index] or b"") for index in group)
+            with _profile_stage("image_description", group_bytes):
+                response = get_gemini_response(
+                    generative_multimodal_model,
+                    model_input=[
+                        image_description_prompt,
+                        MULTI_IMAGE_DESCRIPTION_INSTRUCTION.format(
+                            num_images=len(group)
+                        ),
+                    ]
+                    + [
+                        _get_image_for_gemini(
+                            image_names[index], image_bytes_list[index]
+                        )
+                        for index in group
+                    ],
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                    stream=True,
+                )
+            group_descriptions = _parse_image_descriptions(response, len(group))
+
+        if group_descriptions is None:
+            # Fall back to one request per image
+            group_descriptions = [
+                _get_image_description(
+                    generative_multimodal_model,
+                    image_names[index],
+                    image_description_prompt,
+                    generation_config,
+                    safety_settings,
+                    image_bytes_list[index],
+                )
+                for index in group
+            ]
+        else:
+            for index, description in zip(group, group_descriptions):
+                if cache_keys[index] is not None:
+                    ingestion_cache.put(cache_keys[index], description)
+
+        for index, description in zip(group, group_descriptions):
+            descriptions[index] = description
+
+    return descriptions
+
+
+def _get_images_description_and_embedding(
+    generative_multimodal_model,
+    image_names: List[str],
+    image_description_prompt: str,
+    embedding_size: int,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    image_bytes_list: List[Optional[bytes]],
+    coarse_embedding_size: Optional[int] = None,
+    images_per_request: int = 1,
+) -> List[Tuple[str, list, Optional[list]]]:
+    """
+    Describes and embeds several images, packing up to `images_per_request` images in each
+    Gemini request.
+
+    Returns:
+        One `_get_image_description_and_embedding` result per image, in input order.
+    """
+
+    if images_per_request <= 1:
+        return [
+            _get_image_description_and_embedding(
+                generative_multimodal_model,
+                image_name,
+                image_description_prompt,
+                embedding_size,
+                generation_config,
+                safety_settings,
+                image_bytes,
+                coarse_embedding_size,
+            )
+            for image_name, image_bytes in zip(image_names, image_bytes_list)
+        ]
+
+    descriptions = _get_image_descriptions(
+        generative_multimodal_model,
+        image_names,
+        image_description_prompt,
+        generation_config,
+        safety_settings,
+        image_bytes_list,
+        images_per_request,
+    )
+
+    return [
+        (description,)
+        + _get_image_embeddings(
+            image_name, embedding_size, image_bytes, coarse_embedding_size
+        )
+        for description, image_name, image_bytes in zip(
+            descriptions, image_names, image_bytes_list
+        )
+    ]
+
+
+# Image triage
+
+# Number of set bits of every byte value, used to compute Hamming distances between hashes
+_BYTE_POPCOUNT = np.array(
+    [bin(value).count("1") for value in range(256)], dtype=np.uint8
+)
+
+
+# Edge length of the RGB thumbnail used by the optional pixel difference check of ImageTriage
+FINGERPRINT_THUMBNAIL_SIZE = 16
+
+
+def get_image_fingerprint(image: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    Computes a 64-bit perceptual difference hash (dHash), a digest of the decoded pixels, a small
+    RGB thumbnail and the size of a saved image.
+
+    The hash shortlists candidate duplicates; the pixel digest (or the thumbnail) confirms them.
+
+    Args:
+        image: The path to the image file, or the encoded image bytes.
+
+    Returns:
+        A dictionary with the perceptual hash, the SHA-256 digest of the RGB pixels, the
+        thumbnail pixels, the width and height in pixels and the file size in bytes.
+    """
+
+    if not isinstance(image, bytes):
+        with open(image, "rb") as image_file:
+            image = image_file.read()
+
+    with PIL.Image.open(io.BytesIO(image)) as pil_image:
+        width, height = pil_image.size
+        rgb_image = pil_image.convert("RGB")
+        digest = hashlib.sha256(rgb_image.tobytes()).hexdigest()
+        pixels = np.asarray(
+            rgb_image.convert("L").resize((9, 8), PIL.Image.LANCZOS), dtype=np.int16
+        )
+        thumbnail = np.asarray(
+            rgb_image.resize(
+                (FINGERPRINT_THUMBNAIL_SIZE, FINGERPRINT_THUMBNAIL_SIZE),
+                PIL.Image.BOX,
+            ),
+            dtype=np.uint8,
+        )
+
+    # One bit per pixel: is it brighter than its right neighbour?
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    image_hash = int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+    return {
+        "hash": image_hash,
+        "digest": digest,
+        "thumbnail": thumbnail.tobytes(),
+        "width": width,
+        "height": height,
+        "num_bytes": len(image),
+    }
+
+
+class ImageTriage:
+    """
+    Decides which extracted images need a Gemini description before any model call is made.
+
+    Images below the pixel or byte thresholds (icons, bullets, separators) are skipped. An image
+    reuses the description and embedding of an already described image only if their perceptual
+    hashes are within `max_hash_distance` bits *and* the match is confirmed: both images have the
+    same dimensions and the same decoded pixels (the same image embedded again, whatever its
+    encoding). Lossy re-encodings can be matched too by setting `max_pixel_difference`, at the
+    risk of merging distinct but similar-looking images. Pass the same instance to several
+    `get_document_metadata` calls to reuse results across files and runs.
+    """
+
+    def __init__(
+        self,
+        min_width: int = 32,
+        min_height: int = 32,
+        min_bytes: int = 2048,
+        max_hash_distance: int = 1,
+        max_pixel_difference: Optional[float] = None,
+    ):
+        """
+        Args:
+            min_width: Images narrower than this (in pixels) are skipped.
+            min_height: Images shorter than this (in pixels) are skipped.
+            min_bytes: Images whose saved file is smaller than this are skipped.
+            max_hash_distance: The maximum number of differing hash bits for two images to be
+                               candidate duplicates (0 only matches identical hashes).
+            max_pixel_difference: (Optional) If set, candidates whose RGB thumbnails differ by at
+                                  most this mean absolute difference (0-255) are also
+                                  duplicates. By default only identical pixels match.
+        """
+
+        self.min_width = min_width
+        self.min_height = min_height
+        self.min_bytes = min_bytes
+        self.max_hash_distance = max_hash_distance
+        self.max_pixel_difference = max_pixel_difference
+
+        self._hashes = np.empty(64, dtype=np.uint64)
+        self._fingerprints: List[Dict[str, Any]] = []
+        self._values: List[Any] = []
+        self._lock = threading.Lock()
+
+        self.skipped_small = 0
+        self.reused_duplicates = 0
+        self.described = 0
+
+    def is_too_small(self, fingerprint: Dict[str, Any]) -> bool:
+        """Returns True (and counts the image as skipped) if it is below the size thresholds."""
+
+        too_small = (
+            fingerprint["width"] < self.min_width
+            or fingerprint["height"] < self.min_height
+            or fingerprint["num_bytes"] < self.min_bytes
+        )
+
+        if too_small:
+            with self._lock:
+                self.skipped_small += 1
+
+        return too_small
+
+    def is_duplicate(
+        self, fingerprint: Dict[str, Any], other_fingerprint: Dict[str, Any]
+    ) -> bool:
+        """Returns True if two fingerprints belong to the same image (see the class docstring)."""
+
+        if (fingerprint["width"], fingerprint["height"]) != (
+            other_fingerprint["width"],
+            other_fingerprint["height"],
+        ):
+            return False
+
+        if fingerprint["digest"] == other_fingerprint["digest"]:
+            return True
+
+        differing_bits = bin(fingerprint["hash"] ^ other_fingerprint["hash"]).count("1")
+        if self.max_pixel_difference is None or differing_bits > self.max_hash_distance:
+            return False
+
+        thumbnail = np.frombuffer(fingerprint["thumbnail"], dtype=np.uint8)
+        other_thumbnail = np.frombuffer(other_fingerprint["thumbnail"], dtype=np.uint8)
+        pixel_difference = np.abs(
+            thumbnail.astype(np.int16) - other_thumbnail.astype(np.int16)
+        ).mean()
+
+        return pixel_difference <= self.max_pixel_difference
+
+    def find_duplicate(self, fingerprint: Dict[str, Any]) -> Optional[Any]:
+        """
+        Returns the value stored for an already seen image if it is a confirmed duplicate,
+        otherwise None.
+        """
+
+        with self._lock:
+            num_hashes = len(self._values)
+            if num_hashes == 0:
+                return None
+
+            # Shortlist candidates by hash distance, then confirm them from the closest one
+            differing_bits = self._hashes[:num_hashes] ^ np.uint64(fingerprint["hash"])
+            distances = (
+                _BYTE_POPCOUNT[differing_bits.view(np.uint8)]
+                .reshape(num_hashes, 8)
+                .sum(axis=1)
+            )
+            candidates = np.flatnonzero(distances <= self.max_hash_distance)
+
+            for candidate in candidates[
+                np.argsort(distances[candidates], kind="stable")
+            ]:
+                if self.is_duplicate(fingerprint, self._fingerprints[candidate]):
+                    self.reused_duplicates += 1
+                    return self._values[candidate]
+
+            return None
+
+    def find_duplicate_in(
+        self, fingerprint: Dict[str, Any], fingerprints: List[Dict[str, Any]]
+    ) -> Optional[int]:
+        """
+        Returns the position of the first confirmed duplicate in `fingerprints` (for example the
+        images of a page that are queued for a description), otherwise None.
+        """
+
+        for position, other_fingerprint in enumerate(fingerprints):
+            if self.is_duplicate(fingerprint, other_fingerprint):
+                with self._lock:
+                    self.reused_duplicates += 1
+                return position
+
+        return None
+
+    def add(self, fingerprint: Dict[str, Any], value: Any) -> None:
+        """Records the result (for example the description and embedding) of a described image."""
+
+        with self._lock:
+            num_hashes = len(self._values)
+            if num_hashes == len(self._hashes):
+                self._hashes = np.concatenate(
+                    [self._hashes, np.empty(num_hashes, dtype=np.uint64)]
+                )
+
+            self._hashes[num_hashes] = fingerprint["hash"]
+            self._fingerprints.append(fingerprint)
+            self._values.append(value)
+            self.described += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of skipped, reused and described images."""
+
+        with self._lock:
+            return {
+                "skipped_small": self.skipped_small,
+                "reused_duplicates": self.reused_duplicates,
+                "described": self.described,
+            }
+
+
+def get_gemini_response(
+    generative_multimodal_model,
+    model_input: List[str],
+    stream: bool = True,
+    generation_config: Optional[GenerationConfig] = GenerationConfig(
+        temperature=0.2, max_output_tokens=2048
+    ),
+    safety_settings: Optional[dict] = {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
         HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
     },
 ) -> str:
@@ -322,7 +1808,15 @@ def get_text_metadata_df(
         A Pandas DataFrame with the extracted text, chunk text, and chunk embeddings for each page.
     """
 
-    final_data_text: List[Dict] = []
+    return_df = pd.DataFrame(list(_iter_text_records(filename, text_metadata)))
+    return_df = return_df.reset_index(drop=True)
+    return return_df
+
+
+def _iter_text_records(
+    filename: str, text_metadata: Dict[Union[int, str], Dict]
+) -> Iterator[Dict]:
+    """Yields one text metadata record (a row of `get_text_metadata_df`) per chunk."""
 
     for key, values in text_metadata.items():
         for chunk_number, chunk_text in values["chunked_text_dict"].items():
@@ -337,11 +1831,48 @@ def get_text_metadata_df(
             data["chunk_text"] = chunk_text
             data["text_embedding_chunk"] = values["chunk_embeddings_dict"][chunk_number]
 
-            final_data_text.append(data)
+            yield data
 
-    return_df = pd.DataFrame(final_data_text)
-    return_df = return_df.reset_index(drop=True)
-    return return_df
+
+def _iter_page_and_chunk_records(
+    filename: str, text_metadata: Dict[Union[int, str], Dict], first_page_index: int
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yields ("page", record) for every page with text and ("chunk", record) for each of its
+    chunks, the rows of the tables returned by `normalize_text_metadata`. `first_page_index` is
+    the position of the first page of the file in the page table.
+    """
+
+    page_index = first_page_index
+    for key, values in text_metadata.items():
+        if not values["chunked_text_dict"]:
+            continue
+
+        yield "page", {
+            "file_name": filename,
+            "page_num": int(key) + 1,
+            "text": values["text"],
+            "text_embedding_page": values["page_text_embeddings"]["text_embedding"],
+        }
+
+        for chunk_number, (chunk_start, chunk_end) in values[
+            "chunk_offsets_dict"
+        ].items():
+            yield "chunk", {
+                "file_name": filename,
+                "page_num": int(key) + 1,
+                "page_index": page_index,
+                "chunk_number": chunk_number,
+                "chunk_start": chunk_start,
+                "chunk_end": chunk_end,
+                "text_embedding_chunk": values["chunk_embeddings_dict"][chunk_number],
+            }
+
+        page_index += 1
+
+
+# Low-dimension image embeddings stored for coarse-to-fine search (see `get_coarse_to_fine_scores`)
+COARSE_IMAGE_EMBEDDING_COLUMN = "mm_embedding_from_img_only_coarse"
 
 
 def get_image_metadata_df(
@@ -361,7 +1892,17 @@ def get_image_metadata_df(
         A Pandas DataFrame with the extracted image path, image description, and image embeddings for each image.
     """
 
-    final_data_image: List[Dict] = []
+    return_df = pd.DataFrame(list(_iter_image_records(filename, image_metadata)))
+    return_df = return_df.dropna()
+    return_df = return_df.reset_index(drop=True)
+    return return_df
+
+
+def _iter_image_records(
+    filename: str, image_metadata: Dict[Union[int, str], Dict]
+) -> Iterator[Dict]:
+    """Yields one image metadata record (a row of `get_image_metadata_df`) per image."""
+
     for key, values in image_metadata.items():
         for _, image_values in values.items():
             data: Dict = {}
@@ -376,53 +1917,229 @@ def get_image_metadata_df(
             data["mm_embedding_from_img_only"] = image_values[
                 "mm_embedding_from_img_only"
             ]
+            if COARSE_IMAGE_EMBEDDING_COLUMN in image_values:
+                data[COARSE_IMAGE_EMBEDDING_COLUMN] = image_values[
+                    COARSE_IMAGE_EMBEDDING_COLUMN
+                ]
             data["text_embedding_from_image_description"] = image_values[
                 "text_embedding_from_image_description"
             ]
-            final_data_image.append(data)
 
-    return_df = pd.DataFrame(final_data_image).dropna()
-    return_df = return_df.reset_index(drop=True)
-    return return_df
+            yield data
 
 
-def get_document_metadata(
-    generative_multimodal_model,
-    pdf_folder_path: str,
-    image_save_dir: str,
-    image_description_prompt: str,
-    embedding_size: int = 128,
-    generation_config: Optional[GenerationConfig] = GenerationConfig(
-        temperature=0.2, max_output_tokens=2048
-    ),
-    safety_settings: Optional[dict] = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    },
-    add_sleep_after_page: bool = False,
-    sleep_time_after_page: int = 2,
+def normalize_text_metadata(
+    text_metadata_df: pd.DataFrame,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
-    This function takes a PDF path, an image save directory, an image description prompt, an embedding size, and a text embedding text limit as input.
+    Splits existing text metadata into a page table and a chunk table so the page text and the
+    page embedding are stored once per page instead of once per chunk. New metadata can be
+    extracted as these tables directly with `get_document_metadata(normalized_text=True)`.
+
+    The chunk table references its page by position (`page_index`) and stores the character
+    offsets of the chunk in the page text (`chunk_start`, `chunk_end`) instead of a copy of the
+    chunk text. Pass both tables to `get_similar_text_from_query` (`page_metadata_df=...`), and
+    the page table as `text_metadata_df` to `get_similar_image_from_query`.
+
+    Args:
+        text_metadata_df: The text metadata DataFrame returned by `get_document_metadata`.
+
+    Returns:
+        A tuple containing:
+            - The page table: file_name, page_num, text, text_embedding_page.
+            - The chunk table: file_name, page_num, page_index, chunk_number, chunk_start, chunk_end, text_embedding_chunk.
+
+    Raises:
+        ValueError: If a chunk is not the chunk of its page text made by `get_text_overlapping_chunk`.
+    """
+
+    if text_metadata_df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    page_columns = [
+        column
+        for column in ("file_name", "page_num", "text", "text_embedding_page")
+        if column in text_metadata_df.columns
+    ]
+    page_metadata_df = text_metadata_df.drop_duplicates(
+        subset=["file_name", "page_num"]
+    )[page_columns].reset_index(drop=True)
+
+    page_keys = ["file_name", "page_num"]
+    page_index = pd.MultiIndex.from_frame(page_metadata_df[page_keys]).get_indexer(
+        pd.MultiIndex.from_frame(text_metadata_df[page_keys])
+    )
+
+    # The chunk offsets are those of the chunker, checked against the stored chunk texts
+    page_texts = page_metadata_df["text"].to_numpy()
+    page_offsets: Dict[int, Dict[int, Tuple[int, int]]] = {}
+    chunk_starts = np.empty(len(text_metadata_df), dtype=np.int64)
+    chunk_ends = np.empty(len(text_metadata_df), dtype=np.int64)
+
+    for row, (page, chunk_number, chunk) in enumerate(
+        zip(
+            page_index,
+            text_metadata_df["chunk_number"].to_numpy(),
+            text_metadata_df["chunk_text"].to_numpy(),
+        )
+    ):
+        if page not in page_offsets:
+            page_offsets[page] = get_text_chunk_offsets(len(page_texts[page]))
+        start, end = page_offsets[page].get(chunk_number, (0, -1))
+        if page_texts[page][start:end] != chunk:
+            raise ValueError(
+                f"Chunk {row} is not chunk {chunk_number} of its page text; cannot normalize."
+            )
+        chunk_starts[row] = start
+        chunk_ends[row] = end
+
+    chunk_metadata_df = text_metadata_df.drop(
+        columns=["text", "chunk_text", "text_embedding_page"], errors="ignore"
+    ).reset_index(drop=True)
+    chunk_metadata_df.insert(
+        chunk_metadata_df.columns.get_loc("page_num") + 1, "page_index", page_index
+    )
+    chunk_metadata_df.insert(
+        chunk_metadata_df.columns.get_loc("chunk_number") + 1,
+        "chunk_start",
+        chunk_starts,
+    )
+    chunk_metadata_df.insert(
+        chunk_metadata_df.columns.get_loc("chunk_start") + 1, "chunk_end", chunk_ends
+    )
+
+    return page_metadata_df, chunk_metadata_df
+
+
+def _extract_pdf_content(
+    pdf_path: str,
+    image_save_dir: str,
+    fingerprint_images: bool = False,
+    max_image_edge: Optional[int] = None,
+    save_images: bool = True,
+    profile: bool = False,
+) -> Dict[str, Any]:
+    """
+    Extracts the page text, text chunks and images of a PDF without calling any model.
+
+    This is the parsing stage of the pipelined ingestion; it only returns plain Python
+    objects so it can run in a worker process.
 
     Args:
         pdf_path: The path to the PDF document.
         image_save_dir: The directory where extracted images should be saved.
-        image_description_prompt: A prompt to guide Gemini for generating image descriptions.
-        embedding_size: The dimensionality of the embedding vectors.
-        text_emb_text_limit: The maximum number of tokens for text embedding.
+        fingerprint_images: Whether to also compute the fingerprint of every image (see
+                            `get_image_fingerprint`).
+        max_image_edge: Downscales images so that their longest edge is at most this many pixels.
+        save_images: Whether to write the images to `image_save_dir`.
+        profile: Whether to profile the parsing stages in this process (see `IngestionProfiler`).
 
     Returns:
-        A tuple containing two DataFrames:
-            * One DataFrame containing the extracted text metadata for each page of the PDF, including the page text, chunked text dictionaries, and chunk embedding dictionaries.
-            * Another DataFrame containing the extracted image metadata for each image in the PDF, including the image path, image description, image embeddings (with and without context), and image description text embedding.
+        A dictionary with the file name and, for each page, the page text, the chunked text
+        dictionary and the chunk offsets, the image paths, the JPEG bytes of the images and their fingerprints (None if
+        not requested), plus the recorded "profile_events" (None if not profiling).
+    """
+
+    global ingestion_profiler
+
+    # The worker process cannot report to the parent's profiler, so it records its own events
+    parent_profiler = ingestion_profiler
+    ingestion_profiler = IngestionProfiler() if profile else None
+
+    try:
+        content = _extract_pdf_pages(
+            pdf_path, image_save_dir, fingerprint_images, max_image_edge, save_images
+        )
+    finally:
+        worker_profiler = ingestion_profiler
+        ingestion_profiler = parent_profiler
+
+    content["profile_events"] = worker_profiler.events if worker_profiler else None
+    return content
+
+
+def _extract_pdf_pages(
+    pdf_path: str,
+    image_save_dir: str,
+    fingerprint_images: bool,
+    max_image_edge: Optional[int],
+    save_images: bool,
+) -> Dict[str, Any]:
+    """Extracts the pages of a PDF for `_extract_pdf_content`."""
+
+    doc: fitz.Document = fitz.open(pdf_path)
+    file_name = pdf_path.split("/")[-1]
+
+    pages = []
+    for page_num, page in enumerate(doc):
+        _set_profile_context(file_name, page_num + 1)
+        with _profile_stage("text_extraction") as profile:
+            text = page.get_text().encode("ascii", "ignore").decode("utf-8", "ignore")
+            profile["bytes"] = len(text)
+        images = [
+            _extract_pdf_image(
+                doc,
+                image,
+                image_no,
+                image_save_dir,
+                file_name,
+                page_num,
+                max_image_edge,
+                save_images,
+            )
+            for image_no, image in enumerate(page.get_images())
+        ]
+        pages.append(
+            {
+                "text": text,
+                "chunked_text_dict": get_text_overlapping_chunk(text),
+                "chunk_offsets_dict": get_text_chunk_offsets(len(text)),
+                "images": [image_name for image_name, _ in images],
+                "image_bytes": [image_bytes for _, image_bytes in images],
+                "image_fingerprints": [
+                    _get_profiled_image_fingerprint(image_bytes)
+                    for _, image_bytes in images
+                ]
+                if fingerprint_images
+                else None,
+            }
+        )
+
+    return {"file_name": file_name, "pages": pages}
+
+
+def _get_profiled_image_fingerprint(image_bytes: bytes) -> Dict[str, Any]:
+    """Computes the fingerprint of an image as an "image_triage" profiling stage."""
+
+    with _profile_stage("image_triage", len(image_bytes)):
+        return get_image_fingerprint(image_bytes)
+
+
+def _iter_file_metadata(
+    pdf_paths: List[str],
+    generative_multimodal_model,
+    image_save_dir: str,
+    image_description_prompt: str,
+    embedding_size: int,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    add_sleep_after_page: bool,
+    sleep_time_after_page: int,
+    embedding_scheduler: Optional[TextEmbeddingScheduler],
+    image_triage: Optional[ImageTriage] = None,
+    max_image_edge: Optional[int] = None,
+    save_images: bool = True,
+    coarse_embedding_size: Optional[int] = None,
+    images_per_description_request: int = 1,
+) -> Iterator[Tuple[str, Dict, Dict]]:
     """
+    Processes PDFs one page at a time.
 
-    text_metadata_df_final, image_metadata_df_final = pd.DataFrame(), pd.DataFrame()
+    Yields:
+        A tuple with the file name, the text metadata and the image metadata of each PDF, in order.
+    """
 
-    for pdf_path in glob.glob(pdf_folder_path + "/*.pdf"):
+    for pdf_path in pdf_paths:
         print(
             "\n\n",
             "Processing the file: ---------------------------------",
@@ -430,155 +2147,2296 @@ def get_document_metadata(
             "\n\n",
         )
 
-        # Open the PDF file
-        doc: fitz.Document = fitz.open(pdf_path)
+        # Open the PDF file
+        doc: fitz.Document = fitz.open(pdf_path)
+
+        file_name = pdf_path.split("/")[-1]
+
+        text_metadata: Dict[Union[int, str], Dict] = {}
+        image_metadata: Dict[Union[int, str], Dict] = {}
+
+        for page_num, page in enumerate(doc):
+            print(f"Processing page: {page_num + 1}")
+            _set_profile_context(file_name, page_num + 1)
+
+            (
+                text,
+                page_text_embeddings_dict,
+                chunked_text_dict,
+                chunk_embeddings_dict,
+            ) = get_chunk_text_metadata(
+                page,
+                embedding_size=embedding_size,
+                embedding_scheduler=embedding_scheduler,
+            )
+
+            text_metadata[page_num] = {
+                "text": text,
+                "page_text_embeddings": page_text_embeddings_dict,
+                "chunked_text_dict": chunked_text_dict,
+                "chunk_offsets_dict": get_text_chunk_offsets(len(text)),
+                "chunk_embeddings_dict": chunk_embeddings_dict,
+            }
+
+            images = page.get_images()
+            image_metadata[page_num] = {}
+
+            # Images that need a description, described together once the page is extracted
+            pending_images = []
+            # Duplicates of pending images of the same page, as (image number, name, position)
+            page_duplicates = []
+
+            for image_no, image in enumerate(images):
+                image_number = int(image_no + 1)
+                image_metadata[page_num][image_number] = {}
+
+                image_name, image_bytes = _extract_pdf_image(
+                    doc,
+                    image,
+                    image_no,
+                    image_save_dir,
+                    file_name,
+                    page_num,
+                    max_image_edge,
+                    save_images,
+                )
+
+                print(
+                    f"Extracting image from page: {page_num + 1}, saved as: {image_name}"
+                )
+
+                fingerprint = None
+                if image_triage is not None:
+                    fingerprint = _get_profiled_image_fingerprint(image_bytes)
+
+                    if image_triage.is_too_small(fingerprint):
+                        print(f"Skipping small image: {image_name}")
+                        del image_metadata[page_num][image_number]
+                        continue
+
+                    duplicate = image_triage.find_duplicate(fingerprint)
+                    if duplicate is not None:
+                        print(
+                            f"Reusing the description of a duplicate image: {image_name}"
+                        )
+                        image_metadata[page_num][image_number] = _get_image_values(
+                            image_number, image_name, duplicate
+                        )
+                        continue
+
+                    position = image_triage.find_duplicate_in(
+                        fingerprint, [pending[3] for pending in pending_images]
+                    )
+                    if position is not None:
+                        print(
+                            f"Reusing the description of a duplicate image: {image_name}"
+                        )
+                        page_duplicates.append((image_number, image_name, position))
+                        continue
+
+                pending_images.append(
+                    (image_number, image_name, image_bytes, fingerprint)
+                )
+
+            pending_results = _get_images_description_and_embedding(
+                generative_multimodal_model,
+                [image_name for _, image_name, _, _ in pending_images],
+                image_description_prompt,
+                embedding_size,
+                generation_config,
+                safety_settings,
+                [image_bytes for _, _, image_bytes, _ in pending_images],
+                coarse_embedding_size,
+                images_per_description_request,
+            )
+
+            for (image_number, image_name, _, fingerprint), image_results in zip(
+                pending_images, pending_results
+            ):
+                # Failed (blocked) responses are not reused so duplicates are retried
+                if (
+                    image_triage is not None
+                    and "Exception occurred" not in image_results[0]
+                ):
+                    image_triage.add(fingerprint, image_results)
+
+                image_metadata[page_num][image_number] = _get_image_values(
+                    image_number, image_name, image_results
+                )
+
+            for image_number, image_name, position in page_duplicates:
+                image_metadata[page_num][image_number] = _get_image_values(
+                    image_number, image_name, pending_results[position]
+                )
+
+            # Embed all image descriptions of the page in shared batched requests
+            _add_image_description_embeddings(
+                image_metadata[page_num], embedding_scheduler
+            )
+
+            # Add sleep to reduce issues with Quota error on API
+            if add_sleep_after_page:
+                with _profile_stage("page_sleep"):
+                    time.sleep(sleep_time_after_page)
+                print(
+                    "Sleeping for ",
+                    sleep_time_after_page,
+                    """ sec before processing the next page to avoid quota issues. You can disable it: "add_sleep_after_page = False"  """,
+                )
+
+        yield file_name, text_metadata, image_metadata
+
+
+def _get_image_values(
+    image_number: int, image_name: str, image_results: Tuple[str, list, Optional[list]]
+) -> Dict[str, Any]:
+    """Builds the metadata of one image from the results of `_get_image_description_and_embedding`."""
+
+    response, image_embedding, coarse_image_embedding = image_results
+
+    image_values = {
+        "img_num": image_number,
+        "img_path": image_name,
+        "img_desc": response,
+        # "mm_embedding_from_text_desc_and_img": image_embedding_with_description,
+        "mm_embedding_from_img_only": image_embedding,
+    }
+    if coarse_image_embedding is not None:
+        image_values[COARSE_IMAGE_EMBEDDING_COLUMN] = coarse_image_embedding
+
+    return image_values
+
+
+def _add_image_description_embeddings(
+    page_image_metadata: Dict[int, Dict],
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+) -> None:
+    """
+    Embeds the descriptions of all images of a page in shared batched requests and stores them
+    under "text_embedding_from_image_description".
+    """
+
+    image_description_text_embeddings = get_text_embeddings_from_text_embedding_model(
+        [values["img_desc"] for values in page_image_metadata.values()],
+        embedding_scheduler,
+    )
+
+    for values, image_description_text_embedding in zip(
+        page_image_metadata.values(), image_description_text_embeddings
+    ):
+        values[
+            "text_embedding_from_image_description"
+        ] = image_description_text_embedding
+
+
+def _submit_page_tasks(
+    content: Dict[str, Any],
+    model_pool: ThreadPoolExecutor,
+    generative_multimodal_model,
+    image_description_prompt: str,
+    embedding_size: int,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    embedding_scheduler: Optional[TextEmbeddingScheduler],
+    image_triage: Optional[ImageTriage],
+    pending_descriptions: Dict[Tuple[Future, int], Dict[str, Any]],
+    coarse_embedding_size: Optional[int],
+    images_per_description_request: int,
+) -> List[Dict[str, Any]]:
+    """
+    Submits the page text embeddings and image description/embedding calls of a parsed PDF to
+    `model_pool` and returns one task dictionary per page.
+
+    Each image task holds either the "results" reused from `image_triage`, or the "future" and
+    "position" of the results in a group of images described together. The images described
+    for the first time are recorded in `pending_descriptions` with their fingerprint, so
+    duplicates in later pages share their description before it is added to `image_triage`.
+    """
+
+    page_tasks = []
+    for page_num, page in enumerate(content["pages"]):
+        image_tasks: List[Dict[str, Any]] = []
+        # Positions in image_tasks of the images to describe
+        pending_images = []
+        # Duplicates of pending images of the same page, as (task, pending task) positions
+        page_duplicates = []
+        for image_no, image_name in enumerate(page["images"]):
+            image_task = {
+                "image_no": image_no,
+                "image_name": image_name,
+                "fingerprint": None,
+                "retry": False,
+            }
+
+            if image_triage is not None:
+                fingerprint = page["image_fingerprints"][image_no]
+
+                if image_triage.is_too_small(fingerprint):
+                    continue
+
+                duplicate = image_triage.find_duplicate(fingerprint)
+                if duplicate is not None:
+                    image_task["results"] = duplicate
+                    image_tasks.append(image_task)
+                    continue
+
+                # A description of an earlier page that is still pending is shared, and the
+                # image is described again if it fails, like in `_iter_file_metadata`
+                pending_keys = list(pending_descriptions)
+                position = image_triage.find_duplicate_in(
+                    fingerprint, list(pending_descriptions.values())
+                )
+                if position is not None:
+                    image_task["future"], image_task["position"] = pending_keys[
+                        position
+                    ]
+                    image_task["retry"] = True
+                    image_tasks.append(image_task)
+                    continue
+
+                position = image_triage.find_duplicate_in(
+                    fingerprint,
+                    [
+                        page["image_fingerprints"][image_tasks[task_no]["image_no"]]
+                        for task_no in pending_images
+                    ],
+                )
+                if position is not None:
+                    image_tasks.append(image_task)
+                    page_duplicates.append(
+                        (len(image_tasks) - 1, pending_images[position])
+                    )
+                    continue
+
+                image_task["fingerprint"] = fingerprint
+
+            image_tasks.append(image_task)
+            pending_images.append(len(image_tasks) - 1)
+
+        group_size = max(1, images_per_description_request)
+        for start in range(0, len(pending_images), group_size):
+            end = start + group_size
+            group = [image_tasks[task_no] for task_no in pending_images[start:end]]
+            group_future = model_pool.submit(
+                _call_in_profile_context,
+                content["file_name"],
+                page_num + 1,
+                _get_images_description_and_embedding,
+                generative_multimodal_model,
+                [image_task["image_name"] for image_task in group],
+                image_description_prompt,
+                embedding_size,
+                generation_config,
+                safety_settings,
+                [page["image_bytes"][image_task["image_no"]] for image_task in group],
+                coarse_embedding_size,
+                group_size,
+            )
+
+            for position, image_task in enumerate(group):
+                image_task["future"] = group_future
+                image_task["position"] = position
+                if image_task["fingerprint"] is not None:
+                    pending_descriptions[(group_future, position)] = image_task[
+                        "fingerprint"
+                    ]
+
+        for task_no, pending_task_no in page_duplicates:
+            image_tasks[task_no]["future"] = image_tasks[pending_task_no]["future"]
+            image_tasks[task_no]["position"] = image_tasks[pending_task_no]["position"]
+
+        page_tasks.append(
+            {
+                "page": page,
+                "text_future": model_pool.submit(
+                    _call_in_profile_context,
+                    content["file_name"],
+                    page_num + 1,
+                    _get_page_and_chunk_embeddings,
+                    page["text"],
+                    page["chunked_text_dict"],
+                    embedding_scheduler,
+                ),
+                "image_tasks": image_tasks,
+            }
+        )
+
+    return page_tasks
+
+
+def _iter_file_metadata_pipelined(
+    pdf_paths: List[str],
+    generative_multimodal_model,
+    image_save_dir: str,
+    image_description_prompt: str,
+    embedding_size: int,
+    generation_config: Optional[GenerationConfig],
+    safety_settings: Optional[dict],
+    embedding_scheduler: Optional[TextEmbeddingScheduler],
+    max_parse_processes: Optional[int],
+    max_model_workers: int,
+    image_triage: Optional[ImageTriage] = None,
+    max_image_edge: Optional[int] = None,
+    save_images: bool = True,
+    coarse_embedding_size: Optional[int] = None,
+    images_per_description_request: int = 1,
+    max_files_in_flight: int = 4,
+) -> Iterator[Tuple[str, Dict, Dict]]:
+    """
+    Processes PDFs in three overlapping stages: PDF parsing and image extraction run in a
+    process pool, while page text embeddings and image description/embedding calls run in a
+    bounded thread pool as soon as each PDF has been parsed. Image description embeddings are
+    batched per page once all images of the page are described. Image triage runs in the main
+    thread, so duplicates share the pending description of the first image, and descriptions
+    are added to the triage once collected, as in `_iter_file_metadata`. With
+    `images_per_description_request` > 1, the images of a page are described in groups.
+
+    At most `max_files_in_flight` PDFs are parsed or waiting for model calls at any time. Each
+    PDF is yielded as soon as its model calls are done, and the next PDF is parsed in its place.
+
+    Yields:
+        A tuple with the file name, the text metadata and the image metadata of each PDF, in
+        the same order and with the same content as `_iter_file_metadata`.
+    """
+
+    if max_files_in_flight < 1:
+        raise ValueError("max_files_in_flight must be at least 1.")
+
+    parse_pool = ProcessPoolExecutor(max_workers=max_parse_processes)
+    model_pool = ThreadPoolExecutor(max_workers=max_model_workers)
+
+    pdf_path_iter = iter(pdf_paths)
+    # The parse futures of the files in flight, in the original file order
+    content_futures: Deque[Future] = deque()
+    file_tasks: Dict[Future, Tuple[str, List[Dict[str, Any]]]] = {}
+    # The fingerprints of the images being described, by (group future, position)
+    pending_descriptions: Dict[Tuple[Future, int], Dict[str, Any]] = {}
+
+    def submit_parses() -> None:
+        for pdf_path in itertools.islice(
+            pdf_path_iter, max_files_in_flight - len(content_futures)
+        ):
+            content_futures.append(
+                parse_pool.submit(
+                    _extract_pdf_content,
+                    pdf_path,
+                    image_save_dir,
+                    image_triage is not None,
+                    max_image_edge,
+                    save_images,
+                    ingestion_profiler is not None,
+                )
+            )
+
+    try:
+        submit_parses()
+
+        while content_futures:
+            # Stage 2: fan out the model calls of each PDF as soon as it has been parsed, until
+            # the next PDF in order has been parsed
+            next_future = content_futures[0]
+            while next_future not in file_tasks:
+                wait(
+                    [
+                        content_future
+                        for content_future in content_futures
+                        if content_future not in file_tasks
+                    ],
+                    return_when=FIRST_COMPLETED,
+                )
+                for content_future in content_futures:
+                    if not content_future.done() or content_future in file_tasks:
+                        continue
+
+                    content = content_future.result()
+                    print(
+                        "Parsed the file: ---------------------------------",
+                        content["file_name"],
+                    )
+                    if ingestion_profiler is not None and content["profile_events"]:
+                        ingestion_profiler.add_events(content["profile_events"])
+
+                    file_tasks[content_future] = (
+                        content["file_name"],
+                        _submit_page_tasks(
+                            content,
+                            model_pool,
+                            generative_multimodal_model,
+                            image_description_prompt,
+                            embedding_size,
+                            generation_config,
+                            safety_settings,
+                            embedding_scheduler,
+                            image_triage,
+                            pending_descriptions,
+                            coarse_embedding_size,
+                            images_per_description_request,
+                        ),
+                    )
+
+            content_futures.popleft()
+            file_name, page_tasks = file_tasks.pop(next_future)
+            submit_parses()
+
+            # Stage 3: batch the image description embeddings of each page
+            for page_num, page_task in enumerate(page_tasks):
+                page_image_metadata: Dict[int, Dict] = {}
+
+                for image_task in page_task["image_tasks"]:
+                    if "results" in image_task:
+                        image_results = image_task["results"]
+                    else:
+                        image_results = image_task["future"].result()[
+                            image_task["position"]
+                        ]
+
+                    if image_task["retry"] and "Exception occurred" in image_results[0]:
+                        image_results = _call_in_profile_context(
+                            file_name,
+                            page_num + 1,
+                            _get_images_description_and_embedding,
+                            generative_multimodal_model,
+                            [image_task["image_name"]],
+                            image_description_prompt,
+                            embedding_size,
+                            generation_config,
+                            safety_settings,
+                            [page_task["page"]["image_bytes"][image_task["image_no"]]],
+                            coarse_embedding_size,
+                        )[0]
+                        image_task["fingerprint"] = page_task["page"][
+                            "image_fingerprints"
+                        ][image_task["image_no"]]
+
+                    # Only the resolved results of described images are added to the triage,
+                    # and failed (blocked) responses are not reused so duplicates are retried
+                    if image_task["fingerprint"] is not None:
+                        pending_descriptions.pop(
+                            (image_task.get("future"), image_task.get("position")), None
+                        )
+                        if "Exception occurred" not in image_results[0]:
+                            image_triage.add(image_task["fingerprint"], image_results)
+
+                    page_image_metadata[image_task["image_no"] + 1] = _get_image_values(
+                        image_task["image_no"] + 1,
+                        image_task["image_name"],
+                        image_results,
+                    )
+
+                page_task["image_metadata"] = page_image_metadata
+                page_task["description_future"] = model_pool.submit(
+                    _call_in_profile_context,
+                    file_name,
+                    page_num + 1,
+                    _add_image_description_embeddings,
+                    page_image_metadata,
+                    embedding_scheduler,
+                )
+
+            # Collect the results in the original page order
+            text_metadata: Dict[Union[int, str], Dict] = {}
+            image_metadata: Dict[Union[int, str], Dict] = {}
+
+            for page_num, page_task in enumerate(page_tasks):
+                page_text_embeddings_dict, chunk_embeddings_dict = page_task[
+                    "text_future"
+                ].result()
+                page_task["description_future"].result()
+
+                text_metadata[page_num] = {
+                    "text": page_task["page"]["text"],
+                    "page_text_embeddings": page_text_embeddings_dict,
+                    "chunked_text_dict": page_task["page"]["chunked_text_dict"],
+                    "chunk_offsets_dict": page_task["page"]["chunk_offsets_dict"],
+                    "chunk_embeddings_dict": chunk_embeddings_dict,
+                }
+                image_metadata[page_num] = page_task["image_metadata"]
+
+            yield file_name, text_metadata, image_metadata
+    finally:
+        # Do not keep paying for model calls once the caller has stopped or failed
+        model_pool.shutdown(wait=True, cancel_futures=True)
+        parse_pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_document_metadata(
+    generative_multimodal_model,
+    pdf_folder_path: str,
+    image_save_dir: str,
+    image_description_prompt: str,
+    embedding_size: int = 128,
+    generation_config: Optional[GenerationConfig] = GenerationConfig(
+        temperature=0.2, max_output_tokens=2048
+    ),
+    safety_settings: Optional[dict] = {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    },
+    add_sleep_after_page: bool = False,
+    sleep_time_after_page: int = 2,
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+    pipelined: bool = False,
+    max_parse_processes: Optional[int] = None,
+    max_model_workers: int = 8,
+    pdf_paths: Optional[List[str]] = None,
+    image_triage: Optional[ImageTriage] = None,
+    max_image_edge: Optional[int] = None,
+    save_images: bool = True,
+    coarse_embedding_size: Optional[int] = None,
+    images_per_description_request: int = 1,
+    max_files_in_flight: int = 4,
+    normalized_text: bool = False,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Extracts the metadata of PDFs like `get_document_metadata`, but yields one record at a time
+    instead of building DataFrames: ("text", record) for every text chunk and ("image", record)
+    for every image, file after file. The records are the rows of the DataFrames returned by
+    `get_document_metadata`, so memory stays flat regardless of the corpus size when the records
+    are consumed as they are produced (e.g. by `write_document_metadata_parquet`).
+
+    With `normalized_text`, ("page", record) and ("chunk", record) records, the rows of the page
+    table and the chunk table, are yielded instead of the text records.
+
+    Args:
+        Same as `get_document_metadata`.
+
+    Yields:
+        A tuple with the record type ("text", "page", "chunk" or "image") and the record
+        dictionary.
+    """
+
+    if pdf_paths is None:
+        pdf_paths = glob.glob(pdf_folder_path + "/*.pdf")
+
+    if pipelined:
+        file_metadata = _iter_file_metadata_pipelined(
+            pdf_paths,
+            generative_multimodal_model,
+            image_save_dir,
+            image_description_prompt,
+            embedding_size,
+            generation_config,
+            safety_settings,
+            embedding_scheduler,
+            max_parse_processes,
+            max_model_workers,
+            image_triage,
+            max_image_edge,
+            save_images,
+            coarse_embedding_size,
+            images_per_description_request,
+            max_files_in_flight,
+        )
+    else:
+        file_metadata = _iter_file_metadata(
+            pdf_paths,
+            generative_multimodal_model,
+            image_save_dir,
+            image_description_prompt,
+            embedding_size,
+            generation_config,
+            safety_settings,
+            add_sleep_after_page,
+            sleep_time_after_page,
+            embedding_scheduler,
+            image_triage,
+            max_image_edge,
+            save_images,
+            coarse_embedding_size,
+            images_per_description_request,
+        )
+
+    num_pages = 0
+    for file_name, text_metadata, image_metadata in file_metadata:
+        if normalized_text:
+            for record_type, record in _iter_page_and_chunk_records(
+                file_name, text_metadata, num_pages
+            ):
+                num_pages += record_type == "page"
+                yield record_type, record
+        else:
+            for text_record in _iter_text_records(file_name, text_metadata):
+                yield "text", text_record
+
+        # Skip incomplete records and images whose description repeats one of the same file
+        image_descriptions = set()
+        for image_record in _iter_image_records(file_name, image_metadata):
+            if any(
+                not isinstance(value, (list, np.ndarray)) and pd.isna(value)
+                for value in image_record.values()
+            ):
+                continue
+            if image_record["img_desc"] in image_descriptions:
+                continue
+
+            image_descriptions.add(image_record["img_desc"])
+            yield "image", image_record
+
+
+def get_document_metadata(
+    generative_multimodal_model,
+    pdf_folder_path: str,
+    image_save_dir: str,
+    image_description_prompt: str,
+    embedding_size: int = 128,
+    generation_config: Optional[GenerationConfig] = GenerationConfig(
+        temperature=0.2, max_output_tokens=2048
+    ),
+    safety_settings: Optional[dict] = {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    },
+    add_sleep_after_page: bool = False,
+    sleep_time_after_page: int = 2,
+    embedding_scheduler: Optional[TextEmbeddingScheduler] = None,
+    pipelined: bool = False,
+    max_parse_processes: Optional[int] = None,
+    max_model_workers: int = 8,
+    pdf_paths: Optional[List[str]] = None,
+    normalized_text: bool = False,
+    image_triage: Optional[ImageTriage] = None,
+    max_image_edge: Optional[int] = None,
+    save_images: bool = True,
+    coarse_embedding_size: Optional[int] = None,
+    images_per_description_request: int = 1,
+    max_files_in_flight: int = 4,
+) -> Union[
+    Tuple[pd.DataFrame, pd.DataFrame], Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+]:
+    """
+    This function takes a PDF path, an image save directory, an image description prompt, an embedding size, and a text embedding text limit as input.
+
+    Args:
+        pdf_path: The path to the PDF document.
+        image_save_dir: The directory where extracted images should be saved.
+        image_description_prompt: A prompt to guide Gemini for generating image descriptions.
+        embedding_size: The dimensionality of the embedding vectors.
+        text_emb_text_limit: The maximum number of tokens for text embedding.
+        add_sleep_after_page: Whether to sleep after every page. Text embedding requests are already
+                              paced by `embedding_scheduler`, so this is only needed for very low quotas.
+                              Ignored when `pipelined` is True.
+        sleep_time_after_page: The number of seconds to sleep after every page.
+        embedding_scheduler: The scheduler batching and pacing text embedding requests against your quota.
+                             Defaults to the module level `text_embedding_scheduler`.
+        pipelined: Whether to parse PDFs in a process pool and run model calls for pages and images of
+                   many PDFs concurrently. The returned DataFrames are identical to the sequential mode.
+        max_parse_processes: The number of PDF parsing processes in pipelined mode (defaults to the CPU count).
+        max_model_workers: The maximum number of concurrent model calls in pipelined mode.
+        pdf_paths: The PDFs to process. Defaults to every PDF in `pdf_folder_path`.
+        normalized_text: Whether to extract the text metadata as a page table and a chunk table (see `normalize_text_metadata`),
+                         built page by page without any per-chunk copy of the page text.
+        image_triage: Skips small images and reuses the description and embedding of near-duplicate images
+                      (e.g. logos repeated on every page) before calling Gemini. See `ImageTriage`.
+        max_image_edge: Downscales extracted images so that their longest edge is at most this many pixels
+                        before they are sent to Gemini and the multimodal embedding model.
+        save_images: Whether to write the extracted images to `image_save_dir`. Images are sent to the models
+                     from memory; the files are only needed to display citations. Without them, the
+                     "image_object" of the image search results is None.
+        coarse_embedding_size: Also stores a low-dimension (e.g. 128) image embedding in the
+                               "mm_embedding_from_img_only_coarse" column, used together with a full
+                               `embedding_size` (e.g. 1408) for coarse-to-fine image search.
+        images_per_description_request: The maximum number of images of a page packed into one Gemini request
+                                        that asks for a JSON array of descriptions. Groups whose response cannot
+                                        be parsed fall back to one request per image. Defaults to 1 (one request
+                                        per image).
+        max_files_in_flight: The maximum number of PDFs parsed or waiting for model calls at the same time in
+                             pipelined mode. Bounds the memory used by parsed pages and images.
+
+    Returns:
+        A tuple containing two DataFrames:
+            * One DataFrame containing the extracted text metadata for each page of the PDF, including the page text, chunked text dictionaries, and chunk embedding dictionaries.
+            * Another DataFrame containing the extracted image metadata for each image in the PDF, including the image path, image description, image embeddings (with and without context), and image description text embedding.
+        If `normalized_text` is True, a tuple containing the page table, the chunk table and the image metadata DataFrame.
+    """
+
+    records: Dict[str, List[Dict]] = {"text": [], "page": [], "chunk": [], "image": []}
+
+    for record_type, record in iter_document_metadata(
+        generative_multimodal_model,
+        pdf_folder_path=pdf_folder_path,
+        image_save_dir=image_save_dir,
+        image_description_prompt=image_description_prompt,
+        embedding_size=embedding_size,
+        generation_config=generation_config,
+        safety_settings=safety_settings,
+        add_sleep_after_page=add_sleep_after_page,
+        sleep_time_after_page=sleep_time_after_page,
+        embedding_scheduler=embedding_scheduler,
+        pipelined=pipelined,
+        max_parse_processes=max_parse_processes,
+        max_model_workers=max_model_workers,
+        pdf_paths=pdf_paths,
+        image_triage=image_triage,
+        max_image_edge=max_image_edge,
+        save_images=save_images,
+        coarse_embedding_size=coarse_embedding_size,
+        images_per_description_request=images_per_description_request,
+        max_files_in_flight=max_files_in_flight,
+        normalized_text=normalized_text,
+    ):
+        records[record_type].append(record)
+
+    # Build each DataFrame once instead of concatenating a growing DataFrame per file
+    image_metadata_df_final = pd.DataFrame(records["image"])
+
+    if normalized_text:
+        page_metadata_df = pd.DataFrame(records["page"])
+        chunk_metadata_df = pd.DataFrame(records["chunk"])
+        if not page_metadata_df.empty:
+            get_page_text_index(page_metadata_df)
+        return page_metadata_df, chunk_metadata_df, image_metadata_df_final
+
+    text_metadata_df_final = pd.DataFrame(records["text"])
+
+    # Build the page text index used by image search citations together with the DataFrames
+    if not text_metadata_df_final.empty:
+        get_page_text_index(text_metadata_df_final)
+
+    return text_metadata_df_final, image_metadata_df_final
+
+
+def write_document_metadata_parquet(
+    records: Iterable[Tuple[str, Dict[str, Any]]],
+    output_dir: str,
+    batch_size: int = 10000,
+) -> Dict[str, int]:
+    """
+    Writes the records yielded by `iter_document_metadata` to Parquet in batches, so at most
+    `batch_size` records of each type are held in memory.
+
+    The records of each type are written as numbered part files in the `<type>_metadata`
+    subdirectory of `output_dir`: `text_metadata` and `image_metadata`, or `page_metadata`,
+    `chunk_metadata` and `image_metadata` for normalized text. Each subdirectory can be read back
+    as one DataFrame with `pd.read_parquet`.
+
+    Args:
+        records: The (record type, record) tuples yielded by `iter_document_metadata`.
+        output_dir: The directory where the Parquet files are written.
+        batch_size: The number of records of each type written per Parquet file.
+
+    Returns:
+        The number of records written of each type.
+
+    Raises:
+        ValueError: If `output_dir` already contains part files.
+    """
+
+    batches: Dict[str, List[Dict]] = {"text": [], "page": [], "chunk": [], "image": []}
+    counts = dict.fromkeys(batches, 0)
+    part_numbers = dict.fromkeys(batches, 0)
+
+    for record_type in batches:
+        table_dir = os.path.join(output_dir, f"{record_type}_metadata")
+        if glob.glob(os.path.join(table_dir, "part-*.parquet")):
+            raise ValueError(f"{table_dir} already contains Parquet part files.")
+
+    def write_batch(record_type: str) -> None:
+        table_dir = os.path.join(output_dir, f"{record_type}_metadata")
+        os.makedirs(table_dir, exist_ok=True)
+        part_path = os.path.join(
+            table_dir, f"part-{part_numbers[record_type]:05d}.parquet"
+        )
+        pd.DataFrame(batches[record_type]).to_parquet(part_path, index=False)
+
+        counts[record_type] += len(batches[record_type])
+        part_numbers[record_type] += 1
+        batches[record_type] = []
+
+    for record_type, record in records:
+        batches[record_type].append(record)
+        if len(batches[record_type]) >= batch_size:
+            write_batch(record_type)
+
+    for record_type in batches:
+        if batches[record_type]:
+            write_batch(record_type)
+
+    return counts
+
+
+# Columnar on-disk index
+
+INDEX_FILE_NAME = "index.json"
+INDEX_FORMAT_VERSION = 1
+
+
+def _is_embedding_column(series: pd.Series) -> bool:
+    """Returns True if a column holds one numeric vector (list or array) per row."""
+
+    if series.dtype != object or series.empty:
+        return False
+
+    first_value = series.iloc[0]
+    return isinstance(first_value, (list, tuple, np.ndarray)) and (
+        len(first_value) == 0 or isinstance(first_value[0], (int, float, np.number))
+    )
+
+
+def _write_atomically(path: str, write: Any) -> None:
+    """
+    Writes a file through a temporary file renamed into place, so readers that memory-mapped
+    the previous version keep a valid mapping.
+    """
+
+    with open(path + ".tmp", "wb") as file:
+        write(file)
+    os.replace(path + ".tmp", path)
+
+
+def _save_metadata_table(dataframe: pd.DataFrame, index_dir: str, name: str) -> Dict:
+    """
+    Saves the scalar columns of a table to Parquet, each embedding column to a .npy file, each
+    attached IVF index to a .ivf.npz file and each attached quantized matrix to .npy files.
+    """
+
+    embedding_columns = [
+        column
+        for column in dataframe.columns
+        if _is_embedding_column(dataframe[column])
+    ]
+
+    scalar_df = dataframe.drop(columns=embedding_columns).reset_index(drop=True)
+    _write_atomically(
+        os.path.join(index_dir, f"{name}.parquet"),
+        lambda file: scalar_df.to_parquet(file, index=False),
+    )
+
+    ivf_columns = []
+    quantized_columns = {}
+    for column in embedding_columns:
+        # Packed without being cached, so quantized columns keep no float32 copy in memory
+        matrix = _get_float32_rows(
+            _get_embedding_rows_source(dataframe, column), slice(None)
+        )
+        _write_atomically(
+            os.path.join(index_dir, f"{name}.{column}.npy"),
+            lambda file: np.save(file, matrix),
+        )
+
+        ivf_index = get_ivf_index(dataframe, column)
+        if ivf_index is not None:
+            ivf_index.save(os.path.join(index_dir, f"{name}.{column}.ivf.npz"))
+            ivf_columns.append(column)
+
+        quantized = get_quantized_embeddings(dataframe, column)
+        if quantized is not None:
+            quantized.save(os.path.join(index_dir, f"{name}.{column}"))
+            quantized_columns[column] = {
+                "dtype": quantized.dtype,
+                "rescore_size": quantized.rescore_size,
+            }
+
+    return {
+        "columns": list(dataframe.columns),
+        "embedding_columns": embedding_columns,
+        "ivf_columns": ivf_columns,
+        "quantized_columns": quantized_columns,
+        "num_rows": len(dataframe),
+    }
+
+
+def _load_metadata_table(
+    index_dir: str, name: str, table_info: Dict, mmap: bool
+) -> pd.DataFrame:
+    """Loads a table saved by `_save_metadata_table`, memory-mapping the embedding matrices."""
+
+    dataframe = pd.read_parquet(os.path.join(index_dir, f"{name}.parquet"))
+
+    matrices = {}
+    for column in table_info["embedding_columns"]:
+        matrix = np.load(
+            os.path.join(index_dir, f"{name}.{column}.npy"),
+            mmap_mode="r" if mmap else None,
+        )
+        # Each row is a view into the mapped matrix, so no embedding is copied
+        dataframe[column] = pd.Series(list(np.asarray(matrix)), dtype=object)
+        matrices[column] = matrix
+
+    if table_info["columns"]:
+        dataframe = dataframe[table_info["columns"]]
+
+    # Let the vectorized search score directly against the mapped matrices
+    for column, matrix in matrices.items():
+        _set_derived(dataframe, "matrices", column, matrix)
+    for column in table_info.get("ivf_columns", []):
+        _set_derived(
+            dataframe,
+            "ivf_indexes",
+            column,
+            IVFIndex.load(os.path.join(index_dir, f"{name}.{column}.ivf.npz")),
+        )
+    for column, quantized_info in table_info.get("quantized_columns", {}).items():
+        _set_derived(
+            dataframe,
+            "quantized",
+            column,
+            QuantizedEmbeddings.load(
+                os.path.join(index_dir, f"{name}.{column}"),
+                quantized_info["dtype"],
+                quantized_info["rescore_size"],
+                mmap,
+            ),
+        )
+
+    return dataframe
+
+
+def save_metadata_index(
+    text_metadata_df: pd.DataFrame,
+    image_metadata_df: pd.DataFrame,
+    index_dir: str,
+    page_metadata_df: Optional[pd.DataFrame] = None,
+) -> None:
+    """
+    Saves the text and image metadata in a columnar on-disk format: scalar columns go to Parquet
+    and every embedding column to a float32 .npy matrix that `load_metadata_index` memory-maps.
+    IVF indexes attached with `build_ivf_index` and quantized matrices attached with
+    `quantize_embedding_column` are saved next to their embedding matrix.
+
+    Args:
+        text_metadata_df: The text metadata DataFrame returned by `get_document_metadata` (or the normalized chunk table).
+        image_metadata_df: The image metadata DataFrame returned by `get_document_metadata`.
+        index_dir: The directory where the index is written.
+        page_metadata_df: The normalized page table, if the text metadata is normalized.
+
+    Returns:
+        None
+    """
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    index_info = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "text_metadata": _save_metadata_table(
+            text_metadata_df, index_dir, "text_metadata"
+        ),
+        "image_metadata": _save_metadata_table(
+            image_metadata_df, index_dir, "image_metadata"
+        ),
+    }
+
+    if page_metadata_df is not None:
+        index_info["page_metadata"] = _save_metadata_table(
+            page_metadata_df, index_dir, "page_metadata"
+        )
+
+    _write_atomically(
+        os.path.join(index_dir, INDEX_FILE_NAME),
+        lambda file: file.write(json.dumps(index_info, indent=2).encode()),
+    )
+
+
+def load_metadata_index(
+    index_dir: str, mmap: bool = True
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads text and image metadata saved by `save_metadata_index`.
+
+    With `mmap=True` the embedding matrices are opened with `np.memmap`: loading is near-instant
+    regardless of the index size, the embeddings are paged in on demand and the pages are shared
+    through the OS page cache by every process that loads the same index. The search helpers score
+    directly against the mapped matrices.
+
+    Args:
+        index_dir: The directory where the index was written.
+        mmap: Whether to memory-map the embedding matrices (True) or read them into memory (False).
+
+    Returns:
+        A tuple containing the text metadata and image metadata DataFrames.
+
+    Raises:
+        ValueError: If the index was written with an unsupported format version.
+    """
+
+    with open(os.path.join(index_dir, INDEX_FILE_NAME)) as index_file:
+        index_info = json.load(index_file)
+
+    if index_info["format_version"] != INDEX_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index format version {index_info['format_version']}."
+        )
+
+    return (
+        _load_metadata_table(
+            index_dir, "text_metadata", index_info["text_metadata"], mmap
+        ),
+        _load_metadata_table(
+            index_dir, "image_metadata", index_info["image_metadata"], mmap
+        ),
+    )
+
+
+def load_page_metadata_index(
+    index_dir: str, mmap: bool = True
+) -> Optional[pd.DataFrame]:
+    """
+    Loads the normalized page table saved by `save_metadata_index`.
+
+    Args:
+        index_dir: The directory where the index was written.
+        mmap: Whether to memory-map the embedding matrices (True) or read them into memory (False).
+
+    Returns:
+        The page table, or None if the index was saved without one.
+    """
+
+    with open(os.path.join(index_dir, INDEX_FILE_NAME)) as index_file:
+        index_info = json.load(index_file)
+
+    if "page_metadata" not in index_info:
+        return None
+
+    return _load_metadata_table(
+        index_dir, "page_metadata", index_info["page_metadata"], mmap
+    )
+
+
+# Incremental indexing
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def _get_file_hash(file_path: str) -> str:
+    """Returns the hexadecimal SHA-256 digest of a file's content."""
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(index_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads the manifest of indexed PDFs.
+
+    Args:
+        index_dir: The directory holding the persisted index.
+
+    Returns:
+        A dictionary keyed by file name with the path, size, mtime and sha256 of each indexed PDF.
+        Empty if nothing has been indexed yet.
+    """
+
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _save_manifest(index_dir: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+    """Atomically writes the manifest of indexed PDFs."""
+
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE_NAME)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _merge_file_rows(
+    previous_df: pd.DataFrame,
+    new_df: pd.DataFrame,
+    dropped_file_names: Iterable[str],
+    file_names: List[str],
+) -> pd.DataFrame:
+    """
+    Replaces the rows of dropped files in `previous_df` by `new_df`, ordering the files like
+    `file_names` so the result matches a full rebuild.
+    """
+
+    if "file_name" in previous_df.columns:
+        previous_df = previous_df[
+            ~previous_df["file_name"].isin(list(dropped_file_names))
+        ]
+
+    merged_df = pd.concat([previous_df, new_df], axis=0)
+    if merged_df.empty:
+        return merged_df.reset_index(drop=True)
+
+    file_order = {file_name: position for position, file_name in enumerate(file_names)}
+    merged_df = merged_df.iloc[
+        np.argsort(merged_df["file_name"].map(file_order).to_numpy(), kind="stable")
+    ]
+    return merged_df.reset_index(drop=True)
+
+
+def update_document_metadata(
+    generative_multimodal_model,
+    pdf_folder_path: str,
+    image_save_dir: str,
+    image_description_prompt: str,
+    index_dir: str,
+    **kwargs: Any,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Incrementally updates a persisted index of `pdf_folder_path`.
+
+    A manifest in `index_dir` records the path, size, mtime and content hash of every indexed PDF.
+    Only new or changed PDFs are processed with `get_document_metadata`, rows of deleted PDFs are
+    dropped, and the result is merged into the previously persisted metadata. Files whose size and
+    mtime are unchanged are not re-hashed.
+
+    Args:
+        generative_multimodal_model: The Gemini model used to describe images.
+        pdf_folder_path: The folder containing the PDF documents.
+        image_save_dir: The directory where extracted images should be saved.
+        image_description_prompt: A prompt to guide Gemini for generating image descriptions.
+        index_dir: The directory holding the manifest and the persisted metadata.
+        kwargs: Any other `get_document_metadata` argument, e.g. `embedding_size` or `pipelined`.
+
+    Returns:
+        A tuple containing the updated text metadata and image metadata DataFrames.
+    """
+
+    if kwargs.get("normalized_text"):
+        raise ValueError("Incremental indexing does not support normalized_text.")
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    manifest = load_manifest(index_dir)
+
+    if os.path.exists(os.path.join(index_dir, INDEX_FILE_NAME)):
+        text_metadata_df, image_metadata_df = load_metadata_index(index_dir)
+    else:
+        text_metadata_df, image_metadata_df = pd.DataFrame(), pd.DataFrame()
+
+    pdf_paths = glob.glob(pdf_folder_path + "/*.pdf")
+    file_names = [pdf_path.split("/")[-1] for pdf_path in pdf_paths]
+
+    new_manifest: Dict[str, Dict[str, Any]] = {}
+    changed_pdf_paths: List[str] = []
+
+    for pdf_path, file_name in zip(pdf_paths, file_names):
+        stat = os.stat(pdf_path)
+        entry = manifest.get(file_name)
+
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+        ):
+            new_manifest[file_name] = entry
+            continue
+
+        sha256 = _get_file_hash(pdf_path)
+        new_manifest[file_name] = {
+            "path": pdf_path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+        }
+
+        # Touched but identical files only need their manifest entry refreshed
+        if entry is None or entry["sha256"] != sha256:
+            changed_pdf_paths.append(pdf_path)
+
+    changed_file_names = {pdf_path.split("/")[-1] for pdf_path in changed_pdf_paths}
+    deleted_file_names = set(manifest) - set(new_manifest)
+
+    print(
+        f"Incremental update: {len(changed_file_names)} new or changed, "
+        f"{len(deleted_file_names)} deleted, "
+        f"{len(pdf_paths) - len(changed_file_names)} unchanged PDFs."
+    )
+
+    if changed_pdf_paths:
+        new_text_metadata_df, new_image_metadata_df = get_document_metadata(
+            generative_multimodal_model,
+            pdf_folder_path,
+            image_save_dir,
+            image_description_prompt,
+            pdf_paths=changed_pdf_paths,
+            **kwargs,
+        )
+    else:
+        new_text_metadata_df, new_image_metadata_df = pd.DataFrame(), pd.DataFrame()
+
+    dropped_file_names = changed_file_names | deleted_file_names
+    text_metadata_df = _merge_file_rows(
+        text_metadata_df, new_text_metadata_df, dropped_file_names, file_names
+    )
+    image_metadata_df = _merge_file_rows(
+        image_metadata_df, new_image_metadata_df, dropped_file_names, file_names
+    )
+
+    # Persist the metadata before the manifest so an interrupted update is redone next time
+    save_metadata_index(text_metadata_df, image_metadata_df, index_dir)
+    _save_manifest(index_dir, new_manifest)
+
+    return text_metadata_df, image_metadata_df
+
+
+# Helper Functions
+
+
+def get_user_query_text_embeddings(user_query: str) -> np.ndarray:
+    """
+    Extracts text embeddings for the user query using a text embedding model. Repeated queries
+    are answered from `query_embedding_cache`.
+
+    Args:
+        user_query: The user query text.
+        embedding_size: The desired embedding size.
+
+    Returns:
+        A NumPy array representing the user query text embedding.
+    """
+
+    return _get_query_text_embeddings([user_query])[0]
+
+
+def _get_query_text_embeddings(queries: List[str]) -> List[list]:
+    """
+    Embeds user queries with batched calls to the text embedding model, answering repeated
+    queries from `query_embedding_cache`.
+    """
+
+    if query_embedding_cache is None:
+        return get_text_embeddings_from_text_embedding_model(queries)
+
+    model_name = _get_model_name(text_embedding_scheduler.model or text_embedding_model)
+    keys = [QueryEmbeddingCache.make_text_key(query, model_name) for query in queries]
+    query_embeddings = [query_embedding_cache.get(key) for key in keys]
+
+    # Embed each missing query once, even if it is repeated in the batch
+    missing: Dict[str, int] = {}
+    for index, value in enumerate(query_embeddings):
+        if value is None:
+            missing.setdefault(keys[index], index)
+
+    new_embeddings = dict(
+        zip(
+            missing,
+            get_text_embeddings_from_text_embedding_model(
+                [queries[index] for index in missing.values()]
+            ),
+        )
+    )
+    for key, query_embedding in new_embeddings.items():
+        query_embedding_cache.put(key, query_embedding)
+
+    return [
+        value if value is not None else new_embeddings[key]
+        for key, value in zip(keys, query_embeddings)
+    ]
+
+
+def get_user_query_image_embeddings(
+    image_query_path: str, embedding_size: int
+) -> np.ndarray:
+    """
+    Extracts image embeddings for the user query image using a multimodal embedding model.
+    Repeated query images are answered from `query_embedding_cache`.
+
+    Args:
+        image_query_path: The path to the user query image.
+        embedding_size: The desired embedding size.
+
+    Returns:
+        A NumPy array representing the user query image embedding.
+    """
+
+    cache_key = None
+    if query_embedding_cache is not None:
+        cache_key = QueryEmbeddingCache.make_image_key(
+            image_query_path,
+            _get_model_name(multimodal_embedding_model),
+            embedding_size,
+        )
+        query_embedding = query_embedding_cache.get(cache_key)
+        if query_embedding is not None:
+            return query_embedding
+
+    query_embedding = get_image_embedding_from_multimodal_embedding_model(
+        image_uri=image_query_path, embedding_size=embedding_size
+    )
+
+    if cache_key is not None:
+        query_embedding_cache.put(cache_key, query_embedding)
+
+    return query_embedding
+
+
+def get_cosine_score(
+    dataframe: pd.DataFrame, column_name: str, input_text_embed: np.ndarray
+) -> float:
+    """
+    Calculates the cosine similarity between the user query embedding and the dataframe embedding for a specific column.
+
+    Args:
+        dataframe: The pandas DataFrame containing the data to compare against.
+        column_name: The name of the column containing the embeddings to compare with.
+        input_text_embed: The NumPy array representing the user query embedding.
+
+    Returns:
+        The cosine similarity score (rounded to two decimal places) between the user query embedding and the dataframe embedding.
+    """
+
+    return round(np.dot(dataframe[column_name], input_text_embed), 2)
+
+
+# Vectorized retrieval engine
+
+# Number of queries scored together by the batched search helpers; bounds the size
+# of the intermediate (queries x rows) score matrix.
+QUERY_BLOCK_SIZE = 256
+
+_DATAFRAME_STATE: Dict[int, Dict[str, Any]] = {}
+
+
+def _get_dataframe_state(dataframe: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Returns the dictionary of derived search structures attached to a DataFrame.
+
+    The state is keyed by object identity and is released automatically when the
+    DataFrame is garbage collected.
+
+    Args:
+        dataframe: The metadata DataFrame the state belongs to.
+
+    Returns:
+        A (possibly empty) dictionary shared by every call with the same DataFrame.
+    """
+
+    key = id(dataframe)
+    state = _DATAFRAME_STATE.get(key)
+    if state is None:
+        state = {}
+        _DATAFRAME_STATE[key] = state
+        weakref.finalize(dataframe, _DATAFRAME_STATE.pop, key, None)
+    return state
+
+
+def _get_column_values(dataframe: pd.DataFrame, column_name: str) -> Any:
+    """Returns the NumPy array or extension array backing a column, without copying it."""
+
+    column = dataframe[column_name]
+    if isinstance(column.dtype, np.dtype):
+        return column.to_numpy(copy=False)
+    return column.array
+
+
+def _is_same_values(values: Any, other_values: Any) -> bool:
+    """Checks whether two column arrays are the same array (or views of the same memory)."""
+
+    if values is other_values:
+        return True
+    if not isinstance(values, np.ndarray) or not isinstance(other_values, np.ndarray):
+        return False
+    return (
+        values.__array_interface__["data"][0]
+        == other_values.__array_interface__["data"][0]
+        and values.shape == other_values.shape
+        and values.strides == other_values.strides
+    )
+
+
+def _get_content_token(
+    dataframe: pd.DataFrame, column_names: Iterable[str]
+) -> Tuple[pd.Index, Dict[str, Any]]:
+    """
+    Returns a cheap token identifying the content of some columns of a DataFrame: its row index
+    and the arrays backing the columns. Replacing, reordering or filtering the rows or assigning a
+    new column changes the token; modifying a column in place does not.
+    """
+
+    return dataframe.index, {
+        column_name: _get_column_values(dataframe, column_name)
+        for column_name in column_names
+    }
+
+
+def _matches_content_token(
+    dataframe: pd.DataFrame, token: Tuple[pd.Index, Dict[str, Any]]
+) -> bool:
+    """Checks whether a DataFrame still has the content a token was taken from."""
+
+    index, column_values = token
+    if dataframe.index is not index and not dataframe.index.equals(index):
+        return False
+
+    for column_name, values in column_values.items():
+        if column_name not in dataframe.columns or not _is_same_values(
+            values, _get_column_values(dataframe, column_name)
+        ):
+            return False
+
+    return True
+
+
+def _set_derived(
+    dataframe: pd.DataFrame,
+    kind: str,
+    column_name: str,
+    value: Any,
+    column_names: Optional[List[str]] = None,
+) -> None:
+    """
+    Attaches a structure derived from a column (a matrix, an index, ...) to a DataFrame, together
+    with the content token of the columns it was built from (defaults to `column_name`).
+    """
+
+    token = _get_content_token(dataframe, column_names or [column_name])
+    _get_dataframe_state(dataframe).setdefault(kind, {})[column_name] = (token, value)
+
+
+def _get_derived(dataframe: pd.DataFrame, kind: str, column_name: str) -> Any:
+    """
+    Returns a structure attached by `_set_derived`, or None if there is none or if the rows or the
+    columns it was built from have changed since.
+    """
+
+    token, value = (
+        _get_dataframe_state(dataframe).get(kind, {}).get(column_name, (None, None))
+    )
+    if value is None or not _matches_content_token(dataframe, token):
+        return None
+    return value
+
+
+def get_embedding_matrix(dataframe: pd.DataFrame, column_name: str) -> np.ndarray:
+    """
+    Packs an embedding column of a metadata DataFrame into one contiguous float32 matrix.
+
+    The matrix is built on first use and reused by every later query against the same
+    DataFrame and column. It is rebuilt when the rows of the DataFrame or the column are
+    replaced; call `clear_embedding_matrices` after modifying an embedding column in place.
+
+    Args:
+        dataframe: The pandas DataFrame containing the embeddings.
+        column_name: The name of the column containing the embeddings.
+
+    Returns:
+        A NumPy array of shape (number of rows, embedding dimension).
+    """
+
+    matrix = _get_derived(dataframe, "matrices", column_name)
+
+    if matrix is None:
+        embeddings = dataframe[column_name].tolist()
+        if embeddings:
+            matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        _set_derived(dataframe, "matrices", column_name, matrix)
+
+    return matrix
+
+
+def clear_embedding_matrices(dataframe: pd.DataFrame) -> None:
+    """
+    Drops the packed embedding matrices cached for a DataFrame.
+
+    Args:
+        dataframe: The pandas DataFrame whose cached matrices should be rebuilt on next use.
+
+    Returns:
+        None
+    """
+
+    _get_dataframe_state(dataframe).pop("matrices", None)
+
+
+def get_cosine_scores(
+    dataframe: pd.DataFrame, column_name: str, input_text_embed: np.ndarray
+) -> np.ndarray:
+    """
+    Calculates the cosine similarity between the user query embedding and every row of an
+    embedding column with a single matrix-vector (or matrix-matrix) product.
+
+    Args:
+        dataframe: The pandas DataFrame containing the data to compare against.
+        column_name: The name of the column containing the embeddings to compare with.
+        input_text_embed: The NumPy array representing the user query embedding, or a
+                          (number of queries, dimension) matrix of query embeddings.
+
+    Returns:
+        A NumPy array with one cosine similarity score (rounded to two decimal places) per row,
+        or a (number of queries, number of rows) array when several queries are given.
+    """
+
+    matrix = get_embedding_matrix(dataframe, column_name)
+    query = np.asarray(input_text_embed, dtype=np.float32)
+
+    if matrix.shape[0] == 0:
+        return np.empty(query.shape[:-1] + (0,), dtype=np.float64)
+
+    return np.round((query @ matrix.T).astype(np.float64), 2)
+
+
+def _get_top_n_indices(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Selects the positions of the top N scores in descending order using `argpartition`.
+
+    Ties are resolved in row order, matching `pandas.Series.nlargest(keep="first")`. NaN scores
+    (rows that an approximate search did not score) are never selected.
+
+    Args:
+        scores: A one-dimensional NumPy array of scores.
+        top_n: The number of positions to return.
+
+    Returns:
+        A NumPy array of at most `top_n` positions into `scores`.
+    """
+
+    scored = np.flatnonzero(~np.isnan(scores))
+    if scored.shape[0] < scores.shape[0]:
+        return scored[_get_top_n_indices(scores[scored], top_n)]
+
+    top_n = min(top_n, scores.shape[0])
+    if top_n <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if top_n < scores.shape[0]:
+        partition = np.argpartition(-scores, top_n - 1)[:top_n]
+        threshold = scores[partition].min()
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[: top_n - above.shape[0]]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(scores.shape[0])
+
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+# Approximate nearest-neighbour search
+
+
+class IVFIndex:
+    """
+    An inverted file (IVF) index over the rows of an embedding matrix, using only NumPy.
+
+    The rows are clustered with spherical k-means; each row is stored in the inverted list of its
+    closest centroid. The inverted lists are one contiguous array of row positions sorted by list,
+    delimited by `list_offsets`. A query is only scored against the rows of its `nprobe` closest
+    lists, read from the embedding matrix the index was built on.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = 8,
+    ):
+        """
+        Args:
+            centroids: The (number of lists, dimension) matrix of unit-norm centroids.
+            list_offsets: The start of every inverted list in `list_ids`, followed by its length.
+            list_ids: The row positions of every inverted list, one list after the other.
+            nprobe: The default number of lists scanned per query.
+        """
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.nprobe = nprobe
+
+    @property
+    def num_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def num_rows(self) -> int:
+        return self.list_ids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        num_lists: Optional[int] = None,
+        nprobe: int = 8,
+        num_iterations: int = 10,
+        max_training_rows_per_list: int = 256,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        Clusters the rows of an embedding matrix and builds the inverted lists.
+
+        Args:
+            matrix: The (number of rows, dimension) embedding matrix.
+            num_lists: The number of k-means centroids (defaults to the square root of the number of rows).
+            nprobe: The default number of lists scanned per query.
+            num_iterations: The number of k-means iterations.
+            max_training_rows_per_list: k-means is trained on a random sample of at most this many rows per list.
+            seed: The seed of the random sample and of the centroid initialization.
+
+        Returns:
+            The IVFIndex.
+        """
+
+        num_rows = matrix.shape[0]
+        if num_lists is None:
+            num_lists = int(np.sqrt(num_rows))
+        num_lists = max(1, min(num_lists, num_rows))
+
+        rng = np.random.default_rng(seed)
+        training_rows = np.sort(
+            rng.choice(
+                num_rows,
+                min(num_rows, num_lists * max_training_rows_per_list),
+                replace=False,
+            )
+        )
+        training_matrix = _normalize_rows(np.asarray(matrix[training_rows]))
+
+        centroids = training_matrix[
+            rng.choice(training_matrix.shape[0], num_lists, replace=False)
+        ]
+
+        for _ in range(num_iterations):
+            labels = _assign_to_centroids(training_matrix, centroids)
+
+            # Sum the rows of every cluster in one pass over the rows sorted by cluster
+            order = np.argsort(labels, kind="stable")
+            counts = np.bincount(labels, minlength=num_lists)
+            non_empty = np.flatnonzero(counts)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+
+            new_centroids = training_matrix[
+                rng.choice(training_matrix.shape[0], num_lists)
+            ]
+            new_centroids[non_empty] = np.add.reduceat(
+                training_matrix[order], starts, axis=0
+            )
+            centroids = _normalize_rows(new_centroids)
+
+        labels = _assign_to_centroids(matrix, centroids)
+        list_ids = np.argsort(labels, kind="stable")
+        list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(labels, minlength=num_lists))]
+        )
+
+        return cls(centroids, list_offsets, list_ids, nprobe)
+
+    def get_scores(
+        self,
+        matrix: np.ndarray,
+        input_embed: np.ndarray,
+        nprobe: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Scores the rows of the `nprobe` inverted lists closest to each query.
+
+        Args:
+            matrix: The embedding matrix the index was built on, or its `QuantizedEmbeddings`.
+            input_embed: The query embedding, or a (number of queries, dimension) matrix of query embeddings.
+            nprobe: The number of lists scanned per query (defaults to `self.nprobe`).
+
+        Returns:
+            An array shaped like the output of `get_cosine_scores`, holding the scores (rounded to
+            two decimal places) of the scanned rows and NaN for every other row.
+        """
+
+        nprobe = min(nprobe or self.nprobe, self.num_lists)
+        queries = np.atleast_2d(np.asarray(input_embed, dtype=np.float32))
+        scores = np.full((queries.shape[0], self.num_rows), np.nan)
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        for query_no, probe in enumerate(probes):
+            list_starts = self.list_offsets[np.sort(probe)]
+            list_ends = self.list_offsets[np.sort(probe) + 1]
+            rows = np.concatenate(
+                [self.list_ids[start:end] for start, end in zip(list_starts, list_ends)]
+            )
+            if isinstance(matrix, QuantizedEmbeddings):
+                row_scores = matrix.get_scores(queries[query_no], rows=rows)
+            else:
+                row_scores = matrix[rows] @ queries[query_no]
+            scores[query_no, rows] = np.round(row_scores.astype(np.float64), 2)
+
+        if np.ndim(input_embed) == 1:
+            return scores[0]
+
+        return scores
+
+    def save(self, path: str) -> None:
+        """Saves the index to a .npz file."""
+
+        _write_atomically(
+            path,
+            lambda file: np.savez(
+                file,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_ids=self.list_ids,
+                nprobe=self.nprobe,
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """Loads an index saved by `IVFIndex.save`."""
+
+        with np.load(path) as arrays:
+            return cls(
+                arrays["centroids"],
+                arrays["list_offsets"],
+                arrays["list_ids"],
+                int(arrays["nprobe"]),
+            )
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scales every row of a matrix to unit norm (rows of zeros are left unchanged)."""
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def _assign_to_centroids(
+    matrix: np.ndarray, centroids: np.ndarray, block_size: int = 65536
+) -> np.ndarray:
+    """Returns the position of the closest centroid (by inner product) of every row."""
+
+    labels = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], block_size):
+        end = start + block_size
+        block = np.asarray(matrix[start:end], dtype=np.float32)
+        labels[start:end] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def build_ivf_index(
+    dataframe: pd.DataFrame,
+    column_name: str,
+    num_lists: Optional[int] = None,
+    nprobe: int = 8,
+    num_iterations: int = 10,
+    seed: int = 0,
+) -> IVFIndex:
+    """
+    Builds an IVF index over an embedding column and attaches it to the DataFrame, so the
+    `get_similar_*` helpers search it instead of scoring every row. The index is saved and loaded
+    with the metadata by `save_metadata_index` and `load_metadata_index`.
+
+    Args:
+        dataframe: The metadata DataFrame containing the embeddings.
+        column_name: The name of the embedding column.
+        num_lists: The number of inverted lists (defaults to the square root of the number of rows).
+        nprobe: The number of lists scanned per query. Higher values trade speed for recall.
+        num_iterations: The number of k-means iterations.
+        seed: The seed of the k-means initialization.
+
+    Returns:
+        The IVFIndex. Its `nprobe` attribute can be changed at any time.
+    """
+
+    index = IVFIndex.build(
+        get_embedding_matrix(dataframe, column_name),
+        num_lists=num_lists,
+        nprobe=nprobe,
+        num_iterations=num_iterations,
+        seed=seed,
+    )
+    _set_derived(dataframe, "ivf_indexes", column_name, index)
+
+    return index
+
+
+def get_ivf_index(dataframe: pd.DataFrame, column_name: str) -> Optional[IVFIndex]:
+    """
+    Returns the IVF index attached to an embedding column, or None if there is none or if the
+    rows or the column of the DataFrame have changed since the index was built.
+    """
+
+    return _get_derived(dataframe, "ivf_indexes", column_name)
+
+
+def drop_ivf_indexes(dataframe: pd.DataFrame) -> None:
+    """
+    Detaches every IVF index from a DataFrame, so the search helpers score every row again.
+
+    Args:
+        dataframe: The pandas DataFrame whose IVF indexes should be dropped.
+
+    Returns:
+        None
+    """
+
+    _get_dataframe_state(dataframe).pop("ivf_indexes", None)
+
+
+def evaluate_ivf_recall(
+    dataframe: pd.DataFrame,
+    column_name: str,
+    query_embeddings: np.ndarray,
+    top_n: int = 10,
+    nprobe: Optional[int] = None,
+) -> float:
+    """
+    Measures the recall of the IVF index of an embedding column against brute-force search.
+
+    Args:
+        dataframe: The metadata DataFrame with an IVF index attached (see `build_ivf_index`).
+        column_name: The name of the embedding column.
+        query_embeddings: A (number of queries, dimension) matrix of sample query embeddings.
+        top_n: The number of results compared per query.
+        nprobe: The number of lists scanned per query (defaults to the index's `nprobe`).
+
+    Returns:
+        The fraction of the exact top N results that the IVF search also returns, averaged over the queries.
+
+    Raises:
+        ValueError: If no IVF index is attached to the column.
+    """
+
+    index = get_ivf_index(dataframe, column_name)
+    if index is None:
+        raise ValueError(f"No IVF index is attached to the column '{column_name}'.")
+
+    matrix = get_embedding_matrix(dataframe, column_name)
+    queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+
+    recalls = []
+    for start in range(0, queries.shape[0], QUERY_BLOCK_SIZE):
+        end = start + QUERY_BLOCK_SIZE
+        exact_scores = get_cosine_scores(dataframe, column_name, queries[start:end])
+        ivf_scores = index.get_scores(matrix, queries[start:end], nprobe)
+
+        for exact_row, ivf_row in zip(exact_scores, ivf_scores):
+            exact_top = _get_top_n_indices(exact_row, top_n)
+            ivf_top = _get_top_n_indices(ivf_row, top_n)
+            recalls.append(
+                np.intersect1d(exact_top, ivf_top).shape[0] / max(1, exact_top.shape[0])
+            )
+
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+# Quantized embeddings
+
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Up to this many queries, int8 codes are scored with integer dot products against int8 query
+# codes. NumPy has no BLAS kernel for integer matrices, so larger query batches are faster with
+# one float32 conversion of each block shared by all queries.
+INTEGER_SCORING_MAX_QUERIES = 4
+
+
+def _get_float32_rows(matrix: Any, rows: Any) -> np.ndarray:
+    """
+    Returns rows of an embedding matrix as float32. `matrix` may also be the object array of row
+    vectors of an embedding column, so that rows are read without packing the whole column.
+    """
+
+    block = matrix[rows]
+    if block.dtype != object:
+        return np.asarray(block, dtype=np.float32)
+    if len(block) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack(block.tolist()).astype(np.float32, copy=False)
+
+
+def _get_embedding_rows_source(dataframe: pd.DataFrame, column_name: str) -> Any:
+    """
+    Returns the packed matrix of an embedding column if one is attached (e.g. memory-mapped by
+    `load_metadata_index`), and otherwise the object array of the column, without packing it.
+    """
+
+    matrix = _get_derived(dataframe, "matrices", column_name)
+    if matrix is not None:
+        return matrix
+    return dataframe[column_name].to_numpy()
+
+
+class QuantizedEmbeddings:
+    """
+    A scalar-quantized copy of an embedding matrix, with one scale per vector.
+
+    int8 codes take a quarter and float16 codes half of the memory of the float32 matrix, so the
+    first scoring pass reads 2-4x fewer bytes. Single int8 queries are scored with integer dot
+    products on the codes, and the row scales are applied to the dot products, so the codes are
+    never dequantized. Indexing (`quantized[rows]`) returns the dequantized float32 rows.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, rescore_size: int = 100):
+        """
+        Args:
+            codes: The (number of rows, dimension) matrix of int8 or float16 codes.
+            scales: The float32 scale of every row; a row is approximated by `codes[row] * scales[row]`.
+            rescore_size: The number of best candidates of the first pass rescored with full-precision vectors.
+        """
+
+        self.codes = codes
+        self.scales = scales
+        self.rescore_size = rescore_size
+
+    @property
+    def dtype(self) -> str:
+        return np.dtype(self.codes.dtype).name
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows: Any) -> np.ndarray:
+        return self.codes[rows].astype(np.float32) * self.scales[rows, np.newaxis]
+
+    @classmethod
+    def quantize(
+        cls,
+        matrix: np.ndarray,
+        dtype: str = "int8",
+        rescore_size: int = 100,
+        block_size: int = 65536,
+    ) -> "QuantizedEmbeddings":
+        """
+        Quantizes an embedding matrix, `block_size` rows at a time.
+
+        Args:
+            matrix: The (number of rows, dimension) embedding matrix, or the object array of row
+                    vectors of an embedding column.
+            dtype: "int8" or "float16".
+            rescore_size: The number of best candidates of the first pass rescored with full-precision vectors.
+            block_size: The number of rows quantized at once.
+
+        Returns:
+            The QuantizedEmbeddings.
+
+        Raises:
+            ValueError: If `dtype` is not supported.
+        """
+
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(
+                f"Unsupported dtype '{dtype}', use one of {list(QUANTIZED_DTYPES)}."
+            )
+
+        # int8 codes span [-127, 127], float16 codes [-1, 1]
+        code_range = 127.0 if dtype == "int8" else 1.0
+
+        num_rows = matrix.shape[0]
+        dimension = len(matrix[0]) if num_rows else 0
+        codes = np.empty((num_rows, dimension), dtype=QUANTIZED_DTYPES[dtype])
+        scales = np.empty(num_rows, dtype=np.float32)
+
+        for start in range(0, num_rows, block_size):
+            end = start + block_size
+            block = _get_float32_rows(matrix, slice(start, end))
+            max_values = np.abs(block).max(axis=1, initial=0)
+            block_scales = np.where(max_values == 0, 1, max_values / code_range)
+
+            scaled_block = block / block_scales[:, np.newaxis]
+            if dtype == "int8":
+                scaled_block = np.rint(scaled_block)
+            codes[start:end] = scaled_block
+            scales[start:end] = block_scales
+
+        return cls(codes, scales, rescore_size)
+
+    def get_scores(
+        self, input_embed: np.ndarray, block_size: int = 16384, rows: Any = None
+    ) -> np.ndarray:
+        """
+        Computes approximate (unrounded) scores of every row, `block_size` rows at a time.
+
+        Args:
+            input_embed: The query embedding, or a (number of queries, dimension) matrix of query embeddings.
+            block_size: The number of rows scored at once.
+            rows: (Optional) The indices of the rows to score. Defaults to every row.
+
+        Returns:
+            A NumPy array with one approximate score per scored row, or a (number of queries,
+            number of scored rows) array.
+        """
+
+        queries = np.atleast_2d(np.asarray(input_embed, dtype=np.float32))
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None else self.scales[rows]
+        scores = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+
+        if codes.dtype == np.int8 and queries.shape[0] <= INTEGER_SCORING_MAX_QUERIES:
+            # Quantize the queries too and accumulate the int8 products in int32
+            query_scales = np.abs(queries).max(axis=1) / 127.0
+            query_scales[query_scales == 0] = 1
+            query_codes = np.rint(queries / query_scales[:, np.newaxis]).astype(np.int8)
+
+            for start in range(0, codes.shape[0], block_size):
+                end = start + block_size
+                dot_products = np.einsum(
+                    "ij,kj->ki", codes[start:end], query_codes, dtype=np.int32
+                )
+                scores[:, start:end] = (
+                    dot_products * query_scales[:, np.newaxis] * scales[start:end]
+                )
+        else:
+            for start in range(0, codes.shape[0], block_size):
+                end = start + block_size
+                block_scores = queries @ codes[start:end].astype(np.float32).T
+                scores[:, start:end] = block_scores * scales[start:end]
+
+        if np.ndim(input_embed) == 1:
+            return scores[0]
+
+        return scores
+
+    def save(self, path_prefix: str) -> None:
+        """Saves the codes and scales to `{path_prefix}.{dtype}.npy` and `{path_prefix}.scales.npy`."""
+
+        _write_atomically(
+            f"{path_prefix}.{self.dtype}.npy", lambda file: np.save(file, self.codes)
+        )
+        _write_atomically(
+            f"{path_prefix}.scales.npy", lambda file: np.save(file, self.scales)
+        )
+
+    @classmethod
+    def load(
+        cls, path_prefix: str, dtype: str, rescore_size: int = 100, mmap: bool = True
+    ) -> "QuantizedEmbeddings":
+        """Loads quantized embeddings saved by `QuantizedEmbeddings.save`."""
+
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(f"{path_prefix}.{dtype}.npy", mmap_mode=mmap_mode),
+            np.load(f"{path_prefix}.scales.npy", mmap_mode=mmap_mode),
+            rescore_size,
+        )
+
 
-        file_name = pdf_path.split("/")[-1]
+def quantize_embedding_column(
+    dataframe: pd.DataFrame,
+    column_name: str,
+    dtype: str = "int8",
+    rescore_size: int = 100,
+) -> QuantizedEmbeddings:
+    """
+    Quantizes an embedding column and attaches the quantized matrix to the DataFrame.
 
-        text_metadata: Dict[Union[int, str], Dict] = {}
-        image_metadata: Dict[Union[int, str], Dict] = {}
+    The `get_similar_*` helpers then score every row (or every row of the scanned IVF lists) on the
+    quantized matrix and rescore only the `rescore_size` best candidates with the full-precision
+    vectors. The packed float32 matrix of the column is not kept: the rescored rows are read from
+    the column. Load the metadata with `load_metadata_index(mmap=True)` to keep the full-precision
+    vectors on disk: only the rescored rows are then read. The quantized matrix is saved and loaded
+    with the metadata by `save_metadata_index` and `load_metadata_index`.
 
-        for page_num, page in enumerate(doc):
-            print(f"Processing page: {page_num + 1}")
+    Args:
+        dataframe: The metadata DataFrame containing the embeddings.
+        column_name: The name of the embedding column.
+        dtype: "int8" (4x smaller than float32) or "float16" (2x smaller).
+        rescore_size: The number of best candidates rescored with full-precision vectors per query.
 
-            text = page.get_text()
-            (
-                text,
-                page_text_embeddings_dict,
-                chunked_text_dict,
-                chunk_embeddings_dict,
-            ) = get_chunk_text_metadata(page, embedding_size=embedding_size)
+    Returns:
+        The QuantizedEmbeddings.
 
-            text_metadata[page_num] = {
-                "text": text,
-                "page_text_embeddings": page_text_embeddings_dict,
-                "chunked_text_dict": chunked_text_dict,
-                "chunk_embeddings_dict": chunk_embeddings_dict,
-            }
+    Raises:
+        ValueError: If `dtype` is not supported.
+    """
 
-            images = page.get_images()
-            image_metadata[page_num] = {}
+    quantized = QuantizedEmbeddings.quantize(
+        _get_embedding_rows_source(dataframe, column_name), dtype, rescore_size
+    )
+    _set_derived(dataframe, "quantized", column_name, quantized)
 
-            for image_no, image in enumerate(images):
-                image_number = int(image_no + 1)
-                image_metadata[page_num][image_number] = {}
+    # The search rescores candidates from the column, so an in-memory float32 copy is not needed
+    matrix = _get_derived(dataframe, "matrices", column_name)
+    if matrix is not None and not isinstance(matrix, np.memmap):
+        _get_dataframe_state(dataframe)["matrices"].pop(column_name)
 
-                image_for_gemini, image_name = get_image_for_gemini(
-                    doc, image, image_no, image_save_dir, file_name, page_num
-                )
+    return quantized
 
-                print(
-                    f"Extracting image from page: {page_num + 1}, saved as: {image_name}"
-                )
 
-                response = get_gemini_response(
-                    generative_multimodal_model,
-                    model_input=[image_description_prompt, image_for_gemini],
-                    generation_config=generation_config,
-                    safety_settings=safety_settings,
-                    stream=True,
-                )
+def get_quantized_embeddings(
+    dataframe: pd.DataFrame, column_name: str
+) -> Optional[QuantizedEmbeddings]:
+    """
+    Returns the quantized matrix attached to an embedding column, or None if there is none or if
+    the rows or the column of the DataFrame have changed since it was built.
+    """
 
-                image_embedding = get_image_embedding_from_multimodal_embedding_model(
-                    image_uri=image_name,
-                    embedding_size=embedding_size,
-                )
+    return _get_derived(dataframe, "quantized", column_name)
 
-                image_description_text_embedding = (
-                    get_text_embedding_from_text_embedding_model(text=response)
-                )
 
-                image_metadata[page_num][image_number] = {
-                    "img_num": image_number,
-                    "img_path": image_name,
-                    "img_desc": response,
-                    # "mm_embedding_from_text_desc_and_img": image_embedding_with_description,
-                    "mm_embedding_from_img_only": image_embedding,
-                    "text_embedding_from_image_description": image_description_text_embedding,
-                }
+def drop_quantized_embeddings(dataframe: pd.DataFrame) -> None:
+    """
+    Detaches every quantized matrix from a DataFrame, so the search helpers score the full-precision
+    vectors directly again.
 
-            # Add sleep to reduce issues with Quota error on API
-            if add_sleep_after_page:
-                time.sleep(sleep_time_after_page)
-                print(
-                    "Sleeping for ",
-                    sleep_time_after_page,
-                    """ sec before processing the next page to avoid quota issues. You can disable it: "add_sleep_after_page = False"  """,
-                )
+    Args:
+        dataframe: The pandas DataFrame whose quantized matrices should be dropped.
 
-        text_metadata_df = get_text_metadata_df(file_name, text_metadata)
-        image_metadata_df = get_image_metadata_df(file_name, image_metadata)
+    Returns:
+        None
+    """
 
-        text_metadata_df_final = pd.concat(
-            [text_metadata_df_final, text_metadata_df], axis=0
-        )
-        image_metadata_df_final = pd.concat(
-            [
-                image_metadata_df_final,
-                image_metadata_df.drop_duplicates(subset=["img_desc"]),
-            ],
-            axis=0,
-        )
+    _get_dataframe_state(dataframe).pop("quantized", None)
 
-        text_metadata_df_final = text_metadata_df_final.reset_index(drop=True)
-        image_metadata_df_final = image_metadata_df_final.reset_index(drop=True)
 
-    return text_metadata_df_final, image_metadata_df_final
+def _rescore_candidates(
+    matrix: np.ndarray,
+    input_embed: np.ndarray,
+    approximate_scores: np.ndarray,
+    rescore_size: int,
+) -> np.ndarray:
+    """
+    Rescores the `rescore_size` best rows of approximate scores exactly with the full-precision
+    matrix (or the object array of an embedding column). Every other row is NaN.
+    """
 
+    queries = np.atleast_2d(np.asarray(input_embed, dtype=np.float32))
+    scores = np.full((queries.shape[0], matrix.shape[0]), np.nan)
 
-# Helper Functions
+    for query_no, query_scores in enumerate(np.atleast_2d(approximate_scores)):
+        # Read the candidates in row order, which is friendlier to memory-mapped matrices
+        candidates = np.sort(_get_top_n_indices(query_scores, rescore_size))
+        if candidates.shape[0] == 0:
+            continue
+        scores[query_no, candidates] = np.round(
+            (_get_float32_rows(matrix, candidates) @ queries[query_no]).astype(
+                np.float64
+            ),
+            2,
+        )
 
+    if np.ndim(input_embed) == 1:
+        return scores[0]
 
-def get_user_query_text_embeddings(user_query: str) -> np.ndarray:
-    """
-    Extracts text embeddings for the user query using a text embedding model.
+    return scores
 
-    Args:
-        user_query: The user query text.
-        embedding_size: The desired embedding size.
 
-    Returns:
-        A NumPy array representing the user query text embedding.
+def _get_search_scores(
+    dataframe: pd.DataFrame,
+    column_name: str,
+    input_embed: np.ndarray,
+    top_n: int = 0,
+) -> np.ndarray:
+    """
+    Scores the rows of an embedding column with the search structures attached to it: the IVF
+    index restricts the scored rows, and the quantized matrix provides a first pass whose best
+    `max(rescore_size, top_n)` candidates are rescored with the full-precision vectors. Rows that
+    are not scored are NaN. Without either structure the rows are scored exactly with
+    `get_cosine_scores`.
     """
 
-    return get_text_embedding_from_text_embedding_model(user_query)
+    ivf_index = get_ivf_index(dataframe, column_name)
+    quantized = get_quantized_embeddings(dataframe, column_name)
 
+    if quantized is None:
+        if ivf_index is None:
+            return get_cosine_scores(dataframe, column_name, input_embed)
 
-def get_user_query_image_embeddings(
-    image_query_path: str, embedding_size: int
+        return ivf_index.get_scores(
+            get_embedding_matrix(dataframe, column_name), input_embed
+        )
+
+    if ivf_index is None:
+        approximate_scores = quantized.get_scores(input_embed)
+    else:
+        approximate_scores = ivf_index.get_scores(quantized, input_embed)
+
+    return _rescore_candidates(
+        _get_embedding_rows_source(dataframe, column_name),
+        input_embed,
+        approximate_scores,
+        max(quantized.rescore_size, top_n),
+    )
+
+
+def get_coarse_to_fine_scores(
+    dataframe: pd.DataFrame,
+    coarse_column_name: str,
+    column_name: str,
+    coarse_query_embed: np.ndarray,
+    input_embed: np.ndarray,
+    shortlist_size: int = 100,
 ) -> np.ndarray:
     """
-    Extracts image embeddings for the user query image using a multimodal embedding model.
+    Scores rows in two passes: a cheap pass over the low-dimension embedding matrix selects
+    `shortlist_size` candidates, which are then rescored exactly with the full-dimension embeddings.
+
+    Only the shortlisted rows of the full-dimension matrix are read, so most of the memory
+    bandwidth of a full scan is saved on large image corpora.
 
     Args:
-        image_query_path: The path to the user query image.
-        embedding_size: The desired embedding size.
+        dataframe: The pandas DataFrame containing both embedding columns.
+        coarse_column_name: The column holding the low-dimension embeddings (e.g. 128-d).
+        column_name: The column holding the full-dimension embeddings (e.g. 1408-d).
+        coarse_query_embed: The query embedding(s) at the low dimension.
+        input_embed: The query embedding(s) at the full dimension.
+        shortlist_size: The number of candidates rescored at the full dimension per query.
 
     Returns:
-        A NumPy array representing the user query image embedding.
+        An array shaped like the output of `get_cosine_scores`, holding the full-dimension scores
+        (rounded to two decimal places) of the shortlisted rows and NaN for every other row.
     """
 
-    return get_image_embedding_from_multimodal_embedding_model(
-        image_uri=image_query_path, embedding_size=embedding_size
-    )
+    coarse_matrix = get_embedding_matrix(dataframe, coarse_column_name)
+    matrix = get_embedding_matrix(dataframe, column_name)
+    coarse_queries = np.atleast_2d(np.asarray(coarse_query_embed, dtype=np.float32))
+    queries = np.atleast_2d(np.asarray(input_embed, dtype=np.float32))
 
+    scores = np.full((queries.shape[0], len(dataframe)), np.nan)
+    shortlist_size = min(shortlist_size, len(dataframe))
 
-def get_cosine_score(
-    dataframe: pd.DataFrame, column_name: str, input_text_embed: np.ndarray
-) -> float:
+    if shortlist_size > 0:
+        coarse_scores = coarse_queries @ coarse_matrix.T
+        if shortlist_size < len(dataframe):
+            shortlists = np.argpartition(-coarse_scores, shortlist_size - 1, axis=1)
+            shortlists = shortlists[:, :shortlist_size]
+        else:
+            shortlists = np.broadcast_to(np.arange(len(dataframe)), coarse_scores.shape)
+
+        for query_no, shortlist in enumerate(shortlists):
+            scores[query_no, shortlist] = np.round(
+                (matrix[shortlist] @ queries[query_no]).astype(np.float64), 2
+            )
+
+    if np.ndim(input_embed) == 1:
+        return scores[0]
+
+    return scores
+
+
+_NO_PAGE_TEXT = np.empty(0, dtype=object)
+
+
+def get_page_text_index(
+    text_metadata_df: pd.DataFrame,
+) -> Dict[Tuple[str, int], np.ndarray]:
     """
-    Calculates the cosine similarity between the user query embedding and the dataframe embedding for a specific column.
+    Returns the index from (file name, page number) to the unique page texts of that page, used
+    to attach page text to matched images without scanning the text metadata per match.
+
+    The index is built on first use and reused by every later query against the same DataFrame.
 
     Args:
-        dataframe: The pandas DataFrame containing the data to compare against.
-        column_name: The name of the column containing the embeddings to compare with.
-        input_text_embed: The NumPy array representing the user query embedding.
+        text_metadata_df: The text metadata DataFrame (or the normalized page table).
 
     Returns:
-        The cosine similarity score (rounded to two decimal places) between the user query embedding and the dataframe embedding.
+        A dictionary from (file name, page number) to the sorted unique page texts of the page.
     """
 
-    return round(np.dot(dataframe[column_name], input_text_embed), 2)
+    page_text_index = _get_derived(text_metadata_df, "page_text_index", "text")
+
+    if page_text_index is None:
+        page_texts: Dict[Tuple[str, int], List[str]] = {}
+        pages = text_metadata_df[["file_name", "page_num", "text"]].drop_duplicates()
+        for file_name, page_num, text in zip(
+            pages["file_name"], pages["page_num"], pages["text"]
+        ):
+            page_texts.setdefault((file_name, page_num), []).append(text)
+
+        page_text_index = {
+            page: np.unique(np.array(texts, dtype=object))
+            for page, texts in page_texts.items()
+        }
+        _set_derived(
+            text_metadata_df,
+            "page_text_index",
+            "text",
+            page_text_index,
+            ["file_name", "page_num", "text"],
+        )
+
+    return page_text_index
 
 
 def print_text_to_image_citation(
@@ -591,6 +4449,7 @@ def print_text_to_image_citation(
         final_images: A dictionary containing information about matched images,
                     with keys as image number and values as dictionaries containing
                     image path, page number, page text, cosine similarity score, and image description.
+                    The page text is taken from the page text index of the search, without another lookup.
         print_top: A boolean flag indicating whether to only print the first citation (True) or all citations (False).
 
     Returns:
@@ -694,12 +4553,15 @@ def get_similar_image_from_query(
     image_emb: bool = True,
     top_n: int = 3,
     embedding_size: int = 128,
+    coarse_column_name: Optional[str] = None,
+    coarse_embedding_size: int = 128,
+    shortlist_size: int = 100,
 ) -> Dict[int, Dict[str, Any]]:
     """
     Finds the top N most similar images from a metadata DataFrame based on a text query or an image query.
 
     Args:
-        text_metadata_df: A Pandas DataFrame containing text metadata associated with the images.
+        text_metadata_df: A Pandas DataFrame containing text metadata associated with the images (or the normalized page table).
         image_metadata_df: A Pandas DataFrame containing image metadata (paths, descriptions, etc.).
         query: The text query used for finding similar images (if image_emb is False).
         image_query_path: The path to the image used for finding similar images (if image_emb is True).
@@ -707,6 +4569,10 @@ def get_similar_image_from_query(
         image_emb: Whether to use image embeddings (True) or text captions (False) for comparisons.
         top_n: The number of most similar images to return.
         embedding_size: The dimensionality of the image embeddings (only used if image_emb is True).
+        coarse_column_name: The column containing low-dimension image embeddings (e.g. "mm_embedding_from_img_only_coarse").
+                            If set (and image_emb is True), candidates are shortlisted on this column and reranked on `column_name`.
+        coarse_embedding_size: The dimensionality of the embeddings in `coarse_column_name`.
+        shortlist_size: The number of candidates reranked at the full dimension.
 
     Returns:
         A dictionary containing information about the top N most similar images, including cosine scores, image objects, paths, page numbers, text excerpts, and descriptions.
@@ -717,76 +4583,97 @@ def get_similar_image_from_query(
         user_query_image_embedding = get_user_query_image_embeddings(
             image_query_path, embedding_size
         )
-        cosine_scores = image_metadata_df.apply(
-            lambda x: get_cosine_score(x, column_name, user_query_image_embedding),
-            axis=1,
-        )
+        if coarse_column_name:
+            cosine_scores = get_coarse_to_fine_scores(
+                image_metadata_df,
+                coarse_column_name,
+                column_name,
+                get_user_query_image_embeddings(
+                    image_query_path, coarse_embedding_size
+                ),
+                user_query_image_embedding,
+                max(shortlist_size, top_n),
+            )
+        else:
+            cosine_scores = _get_search_scores(
+                image_metadata_df, column_name, user_query_image_embedding, top_n
+            )
     else:
         # Calculate cosine similarity between query text and metadata image captions
         user_query_text_embedding = get_user_query_text_embeddings(query)
-        cosine_scores = image_metadata_df.apply(
-            lambda x: get_cosine_score(x, column_name, user_query_text_embedding),
-            axis=1,
+        cosine_scores = _get_search_scores(
+            image_metadata_df, column_name, user_query_text_embedding, top_n
         )
 
+    return _get_image_results(text_metadata_df, image_metadata_df, cosine_scores, top_n)
+
+
+def _get_image_results(
+    text_metadata_df: pd.DataFrame,
+    image_metadata_df: pd.DataFrame,
+    cosine_scores: np.ndarray,
+    top_n: int,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Builds the matched image dictionary returned by `get_similar_image_from_query`.
+
+    Args:
+        text_metadata_df: A Pandas DataFrame containing text metadata associated with the images.
+        image_metadata_df: A Pandas DataFrame containing image metadata (paths, descriptions, etc.).
+        cosine_scores: One cosine similarity score per row of `image_metadata_df`.
+        top_n: The number of most similar images to return.
+
+    Returns:
+        A dictionary containing information about the top N most similar images.
+        The "image_object" is None when the image file does not exist (e.g. the metadata
+        was built with `save_images=False`).
+    """
+
+    page_text_index = get_page_text_index(text_metadata_df)
+
     # Remove same image comparison score when user image is matched exactly with metadata image
-    cosine_scores = cosine_scores[cosine_scores < 1.0]
+    candidates = np.flatnonzero(cosine_scores < 1.0)
 
-    # Get top N cosine scores and their indices
-    top_n_cosine_scores = cosine_scores.nlargest(top_n).index.tolist()
-    top_n_cosine_values = cosine_scores.nlargest(top_n).values.tolist()
+    # Get top N cosine scores and their positions
+    top_n_indices = candidates[_get_top_n_indices(cosine_scores[candidates], top_n)]
+    matched_rows = image_metadata_df.iloc[top_n_indices]
 
     # Create a dictionary to store matched images and their information
     final_images: Dict[int, Dict[str, Any]] = {}
 
-    for matched_imageno, indexvalue in enumerate(top_n_cosine_scores):
+    for matched_imageno, indexvalue in enumerate(top_n_indices):
+        file_name = matched_rows["file_name"].iat[matched_imageno]
+        img_path = matched_rows["img_path"].iat[matched_imageno]
+        page_num = matched_rows["page_num"].iat[matched_imageno]
+
         # Create a sub-dictionary for each matched image
         final_images[matched_imageno] = {}
 
         # Store cosine score
-        final_images[matched_imageno]["cosine_score"] = top_n_cosine_values[
-            matched_imageno
-        ]
+        final_images[matched_imageno]["cosine_score"] = float(cosine_scores[indexvalue])
 
-        # Load image from file
-        final_images[matched_imageno]["image_object"] = Image.load_from_file(
-            image_metadata_df.iloc[indexvalue]["img_path"]
+        # Load image from file; the file is missing when the images were not saved
+        final_images[matched_imageno]["image_object"] = (
+            Image.load_from_file(img_path) if os.path.exists(img_path) else None
         )
 
         # Add file name
-        final_images[matched_imageno]["file_name"] = image_metadata_df.iloc[indexvalue][
-            "file_name"
-        ]
+        final_images[matched_imageno]["file_name"] = file_name
 
         # Store image path
-        final_images[matched_imageno]["img_path"] = image_metadata_df.iloc[indexvalue][
-            "img_path"
-        ]
+        final_images[matched_imageno]["img_path"] = img_path
 
         # Store page number
-        final_images[matched_imageno]["page_num"] = image_metadata_df.iloc[indexvalue][
-            "page_num"
-        ]
+        final_images[matched_imageno]["page_num"] = page_num
 
-        final_images[matched_imageno]["page_text"] = np.unique(
-            text_metadata_df[
-                (
-                    text_metadata_df["page_num"].isin(
-                        [final_images[matched_imageno]["page_num"]]
-                    )
-                )
-                & (
-                    text_metadata_df["file_name"].isin(
-                        [final_images[matched_imageno]["file_name"]]
-                    )
-                )
-            ]["text"].values
+        final_images[matched_imageno]["page_text"] = page_text_index.get(
+            (file_name, page_num), _NO_PAGE_TEXT
         )
 
         # Store image description
-        final_images[matched_imageno]["image_description"] = image_metadata_df.iloc[
-            indexvalue
-        ]["img_desc"]
+        final_images[matched_imageno]["image_description"] = matched_rows[
+            "img_desc"
+        ].iat[matched_imageno]
 
     return final_images
 
@@ -798,6 +4685,7 @@ def get_similar_text_from_query(
     top_n: int = 3,
     chunk_text: bool = True,
     print_citation: bool = False,
+    page_metadata_df: Optional[pd.DataFrame] = None,
 ) -> Dict[int, Dict[str, Any]]:
     """
     Finds the top N most similar text passages from a metadata DataFrame based on a text query.
@@ -810,32 +4698,117 @@ def get_similar_text_from_query(
         embedding_size: The dimensionality of the text embeddings (only used if text embeddings are stored in the column specified by `column_name`).
         chunk_text: Whether to return individual text chunks (True) or the entire page text (False).
         print_citation: Whether to immediately print formatted citations for the matched text passages (True) or just return the dictionary (False).
+        page_metadata_df: The page table, when `text_metadata_df` is the chunk table returned by `normalize_text_metadata`.
 
     Returns:
         A dictionary containing information about the top N most similar text passages, including cosine scores, page numbers, chunk numbers (optional), and chunk text or page text (depending on `chunk_text`).
 
     Raises:
-        KeyError: If the specified `column_name` is not present in the `text_metadata_df`.
+        KeyError: If the specified `column_name` is not present in the `text_metadata_df` (or `page_metadata_df`).
     """
 
-    if column_name not in text_metadata_df.columns:
-        raise KeyError(f"Column '{column_name}' not found in the 'text_metadata_df'")
+    _check_text_column(text_metadata_df, column_name, page_metadata_df)
 
     query_vector = get_user_query_text_embeddings(query)
 
     # Calculate cosine similarity between query text and metadata text
-    cosine_scores = text_metadata_df.apply(
-        lambda row: get_cosine_score(
-            row,
-            column_name,
-            query_vector,
-        ),
-        axis=1,
+    cosine_scores = _get_text_cosine_scores(
+        text_metadata_df, column_name, query_vector, page_metadata_df, top_n
+    )
+
+    final_text = _get_text_results(
+        text_metadata_df, cosine_scores, top_n, chunk_text, page_metadata_df
+    )
+
+    # Optionally print citations immediately
+    if print_citation:
+        print_text_to_text_citation(final_text, chunk_text=chunk_text)
+
+    return final_text
+
+
+def _check_text_column(
+    text_metadata_df: pd.DataFrame,
+    column_name: str,
+    page_metadata_df: Optional[pd.DataFrame] = None,
+) -> None:
+    """Raises KeyError if `column_name` is neither a text metadata nor a page table column."""
+
+    if column_name in text_metadata_df.columns:
+        return
+
+    if page_metadata_df is not None and column_name in page_metadata_df.columns:
+        return
+
+    raise KeyError(f"Column '{column_name}' not found in the 'text_metadata_df'")
+
+
+def _get_text_cosine_scores(
+    text_metadata_df: pd.DataFrame,
+    column_name: str,
+    input_text_embed: np.ndarray,
+    page_metadata_df: Optional[pd.DataFrame] = None,
+    top_n: int = 0,
+) -> np.ndarray:
+    """
+    Scores the rows of the text metadata, with the IVF index and quantized matrix of the column
+    if they are attached.
+    Page-level columns of a normalized page table are scored once per page and broadcast to the
+    chunks of each page through `page_index`.
+    """
+
+    if column_name in text_metadata_df.columns or page_metadata_df is None:
+        return _get_search_scores(
+            text_metadata_df, column_name, input_text_embed, top_n
+        )
+
+    page_scores = _get_search_scores(
+        page_metadata_df, column_name, input_text_embed, top_n
     )
+    return page_scores[..., text_metadata_df["page_index"].to_numpy()]
+
+
+def _get_text_results(
+    text_metadata_df: pd.DataFrame,
+    cosine_scores: np.ndarray,
+    top_n: int,
+    chunk_text: bool = True,
+    page_metadata_df: Optional[pd.DataFrame] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Builds the matched text dictionary returned by `get_similar_text_from_query`.
+
+    Args:
+        text_metadata_df: A Pandas DataFrame containing the text metadata that was searched.
+        cosine_scores: One cosine similarity score per row of `text_metadata_df`.
+        top_n: The number of most similar text passages to return.
+        chunk_text: Whether to return individual text chunks (True) or the entire page text (False).
+        page_metadata_df: The page table, when `text_metadata_df` is a normalized chunk table.
+
+    Returns:
+        A dictionary containing information about the top N most similar text passages.
+    """
 
-    # Get top N cosine scores and their indices
-    top_n_indices = cosine_scores.nlargest(top_n).index.tolist()
-    top_n_scores = cosine_scores.nlargest(top_n).values.tolist()
+    # Get top N cosine scores and their positions
+    top_n_indices = _get_top_n_indices(cosine_scores, top_n)
+    matched_rows = text_metadata_df.iloc[top_n_indices]
+
+    if page_metadata_df is not None:
+        # Join the matched chunks to their page text and slice the chunks out of it
+        page_texts = page_metadata_df["text"].to_numpy()[
+            matched_rows["page_index"].to_numpy()
+        ]
+        matched_rows = matched_rows.assign(
+            text=page_texts,
+            chunk_text=[
+                page_text[start:end]
+                for page_text, start, end in zip(
+                    page_texts,
+                    matched_rows["chunk_start"].to_numpy(),
+                    matched_rows["chunk_end"].to_numpy(),
+                )
+            ],
+        )
 
     # Create a dictionary to store matched text and their information
     final_text: Dict[int, Dict[str, Any]] = {}
@@ -844,40 +4817,182 @@ def get_similar_text_from_query(
         # Create a sub-dictionary for each matched text
         final_text[matched_textno] = {}
 
-        # Store page number
-        final_text[matched_textno]["file_name"] = text_metadata_df.iloc[index][
-            "file_name"
+        # Store file name
+        final_text[matched_textno]["file_name"] = matched_rows["file_name"].iat[
+            matched_textno
         ]
 
         # Store page number
-        final_text[matched_textno]["page_num"] = text_metadata_df.iloc[index][
-            "page_num"
+        final_text[matched_textno]["page_num"] = matched_rows["page_num"].iat[
+            matched_textno
         ]
 
         # Store cosine score
-        final_text[matched_textno]["cosine_score"] = top_n_scores[matched_textno]
+        final_text[matched_textno]["cosine_score"] = float(cosine_scores[index])
 
         if chunk_text:
             # Store chunk number
-            final_text[matched_textno]["chunk_number"] = text_metadata_df.iloc[index][
+            final_text[matched_textno]["chunk_number"] = matched_rows[
                 "chunk_number"
-            ]
+            ].iat[matched_textno]
 
             # Store chunk text
-            final_text[matched_textno]["chunk_text"] = text_metadata_df["chunk_text"][
-                index
+            final_text[matched_textno]["chunk_text"] = matched_rows["chunk_text"].iat[
+                matched_textno
             ]
         else:
             # Store page text
-            final_text[matched_textno]["text"] = text_metadata_df["text"][index]
-
-    # Optionally print citations immediately
-    if print_citation:
-        print_text_to_text_citation(final_text, chunk_text=chunk_text)
+            final_text[matched_textno]["text"] = matched_rows["text"].iat[
+                matched_textno
+            ]
 
     return final_text
 
 
+def get_similar_text_from_queries(
+    queries: List[str],
+    text_metadata_df: pd.DataFrame,
+    column_name: str = "",
+    top_n: int = 3,
+    chunk_text: bool = True,
+    print_citation: bool = False,
+    page_metadata_df: Optional[pd.DataFrame] = None,
+) -> List[Dict[int, Dict[str, Any]]]:
+    """
+    Finds the top N most similar text passages for each query in a list of text queries.
+
+    The queries are embedded with batched calls to the text embedding model and scored
+    against the metadata with matrix-matrix products, `QUERY_BLOCK_SIZE` queries at a time.
+
+    Args:
+        queries: The text queries used for finding similar passages.
+        text_metadata_df: A Pandas DataFrame containing the text metadata to search.
+        column_name: The column name in the text_metadata_df containing the text embeddings or text itself.
+        top_n: The number of most similar text passages to return per query.
+        chunk_text: Whether to return individual text chunks (True) or the entire page text (False).
+        print_citation: Whether to immediately print formatted citations for the matched text passages (True) or just return the list (False).
+        page_metadata_df: The page table, when `text_metadata_df` is the chunk table returned by `normalize_text_metadata`.
+
+    Returns:
+        A list with one dictionary per query, in query order, each in the format returned by `get_similar_text_from_query`.
+
+    Raises:
+        KeyError: If the specified `column_name` is not present in the `text_metadata_df` (or `page_metadata_df`).
+    """
+
+    _check_text_column(text_metadata_df, column_name, page_metadata_df)
+
+    query_vectors = _get_query_text_embeddings(list(queries))
+
+    final_texts: List[Dict[int, Dict[str, Any]]] = []
+
+    for start in range(0, len(query_vectors), QUERY_BLOCK_SIZE):
+        end = start + QUERY_BLOCK_SIZE
+        # Calculate cosine similarity between a block of queries and metadata text
+        block_scores = _get_text_cosine_scores(
+            text_metadata_df,
+            column_name,
+            query_vectors[start:end],
+            page_metadata_df,
+            top_n,
+        )
+
+        for cosine_scores in block_scores:
+            final_text = _get_text_results(
+                text_metadata_df, cosine_scores, top_n, chunk_text, page_metadata_df
+            )
+
+            # Optionally print citations immediately
+            if print_citation:
+                print_text_to_text_citation(final_text, chunk_text=chunk_text)
+
+            final_texts.append(final_text)
+
+    return final_texts
+
+
+def get_similar_image_from_queries(
+    text_metadata_df: pd.DataFrame,
+    image_metadata_df: pd.DataFrame,
+    queries: Optional[List[str]] = None,
+    image_query_paths: Optional[List[str]] = None,
+    column_name: str = "",
+    image_emb: bool = True,
+    top_n: int = 3,
+    embedding_size: int = 128,
+    coarse_column_name: Optional[str] = None,
+    coarse_embedding_size: int = 128,
+    shortlist_size: int = 100,
+) -> List[Dict[int, Dict[str, Any]]]:
+    """
+    Finds the top N most similar images for each query in a list of text queries or image queries.
+
+    Text queries are embedded with batched calls to the text embedding model. The multimodal
+    embedding model accepts one image per request, so image queries are embedded one at a time.
+    All queries are then scored with matrix-matrix products, `QUERY_BLOCK_SIZE` queries at a time.
+
+    Args:
+        text_metadata_df: A Pandas DataFrame containing text metadata associated with the images (or the normalized page table).
+        image_metadata_df: A Pandas DataFrame containing image metadata (paths, descriptions, etc.).
+        queries: The text queries used for finding similar images (if image_emb is False).
+        image_query_paths: The paths to the images used for finding similar images (if image_emb is True).
+        column_name: The column name in the image_metadata_df containing the image embeddings or captions.
+        image_emb: Whether to use image embeddings (True) or text captions (False) for comparisons.
+        top_n: The number of most similar images to return per query.
+        embedding_size: The dimensionality of the image embeddings (only used if image_emb is True).
+        coarse_column_name: The column containing low-dimension image embeddings, used for coarse-to-fine search
+                            (see `get_similar_image_from_query`).
+        coarse_embedding_size: The dimensionality of the embeddings in `coarse_column_name`.
+        shortlist_size: The number of candidates reranked at the full dimension per query.
+
+    Returns:
+        A list with one dictionary per query, in query order, each in the format returned by `get_similar_image_from_query`.
+    """
+
+    if image_emb:
+        query_vectors = [
+            get_user_query_image_embeddings(image_query_path, embedding_size)
+            for image_query_path in image_query_paths or []
+        ]
+        if coarse_column_name:
+            coarse_query_vectors = [
+                get_user_query_image_embeddings(image_query_path, coarse_embedding_size)
+                for image_query_path in image_query_paths or []
+            ]
+    else:
+        query_vectors = _get_query_text_embeddings(list(queries or []))
+
+    final_images: List[Dict[int, Dict[str, Any]]] = []
+
+    for start in range(0, len(query_vectors), QUERY_BLOCK_SIZE):
+        end = start + QUERY_BLOCK_SIZE
+        if image_emb and coarse_column_name:
+            block_scores = get_coarse_to_fine_scores(
+                image_metadata_df,
+                coarse_column_name,
+                column_name,
+                coarse_query_vectors[start:end],
+                query_vectors[start:end],
+                max(shortlist_size, top_n),
+            )
+        else:
+            block_scores = _get_search_scores(
+                image_metadata_df,
+                column_name,
+                query_vectors[start:end],
+                top_n,
+            )
+
+        for cosine_scores in block_scores:
+            final_images.append(
+                _get_image_results(
+                    text_metadata_df, image_metadata_df, cosine_scores, top_n
+                )
+            )
+
+    return final_images
+
+
 def display_images(
     images: Iterable[Union[str, PIL.Image.Image]], resize_ratio: float = 0.5
 ) -> None:
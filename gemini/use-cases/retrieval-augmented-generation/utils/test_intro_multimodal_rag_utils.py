@@ -0,0 +1,784 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=redefined-outer-name,protected-access
+
+"""
+Unit tests for intro_multimodal_rag_utils.
+
+The Vertex AI models are replaced by the deterministic fakes of the benchmark script, so the
+tests run without credentials or network access.
+"""
+
+import contextlib
+import io
+import itertools
+import json
+from types import SimpleNamespace
+
+import PIL.Image
+import fitz
+import numpy as np
+import pandas as pd
+import pytest
+
+from fake_models import (
+    FakeGenerativeModel,
+    FakeMultiModalEmbeddingModel,
+    FakeTextEmbeddingModel,
+    import_utils_with_fake_models,
+)
+
+utils = import_utils_with_fake_models(
+    FakeTextEmbeddingModel(), FakeMultiModalEmbeddingModel()
+)
+
+
+# Test helper functions
+def get_image_bytes(pixels: np.ndarray, image_format: str = "PNG", **kwargs) -> bytes:
+    """Encode RGB pixels as an image file."""
+    output = io.BytesIO()
+    PIL.Image.fromarray(pixels.astype(np.uint8)).save(
+        output, format=image_format, **kwargs
+    )
+    return output.getvalue()
+
+
+def get_random_gradient(seed: int, size: int = 256) -> np.ndarray:
+    """Create the kind of random gradient image used by the benchmark fixtures."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=3)
+    gradient = np.linspace(0, 1, size)[:, None, None] * rng.integers(0, 256, size=3)
+    noise = rng.integers(0, 48, size=(size, size, 3))
+    return np.clip(base + gradient + noise, 0, 255)
+
+
+def write_pdf(path: str, images: list, num_pages: int = 1) -> None:
+    """Write a PDF whose pages have some text and the given encoded images."""
+    doc = fitz.open()
+    for _ in range(num_pages):
+        page = doc.new_page()
+        page.insert_text((50, 50), "A page with images.")
+        for image_no, image in enumerate(images):
+            left = 50 + 150 * image_no
+            page.insert_image(fitz.Rect(left, 100, left + 140, 240), stream=image)
+    doc.save(path)
+    doc.close()
+
+
+class FakeClock:
+    """A monotonic clock advanced by time.sleep, so waits take no real time."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FlakyTextEmbeddingModel:
+    """A text embedding model rejecting its first requests with ResourceExhausted."""
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.batches = []
+
+    def get_embeddings(self, texts: list) -> list:
+        self.batches.append(list(texts))
+        if self.failures:
+            self.failures -= 1
+            raise utils.ResourceExhausted("Quota exceeded.")
+        return [SimpleNamespace(values=[float(len(text))]) for text in texts]
+
+
+class BlockedChunk:
+    """A streamed response chunk whose text was blocked."""
+
+    @property
+    def text(self) -> str:
+        raise ValueError("The response was blocked.")
+
+
+class BlockingGenerativeModel(FakeGenerativeModel):
+    """A Gemini model whose first responses are blocked."""
+
+    def __init__(self, blocked: int) -> None:
+        super().__init__()
+        self.blocked = blocked
+
+    def generate_content(self, contents: list, **kwargs) -> list:
+        response = super().generate_content(contents, **kwargs)
+        if self.calls > self.blocked:
+            return response
+        return [BlockedChunk()]
+
+
+def get_document_metadata(
+    pdf_dir: str, image_dir: str, generative_model=None, **kwargs
+) -> tuple:
+    """Run get_document_metadata with a fake Gemini model and without the progress output."""
+    generative_model = generative_model or FakeGenerativeModel()
+    with contextlib.redirect_stdout(io.StringIO()):
+        metadata_dfs = utils.get_document_metadata(
+            generative_model, pdf_dir, image_dir, "Describe the image.", **kwargs
+        )
+    return (generative_model,) + tuple(metadata_dfs)
+
+
+# Fixtures
+@pytest.fixture
+def fake_clock(monkeypatch) -> FakeClock:
+    """Replace the clock of the rate limiters and the retry backoff."""
+    clock = FakeClock()
+    monkeypatch.setattr(utils.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(utils.time, "sleep", clock.sleep)
+    return clock
+
+
+# TokenBucket and TextEmbeddingScheduler
+def test_token_bucket_waits_for_refill(fake_clock) -> None:
+    """Tokens beyond the capacity are granted at the configured rate."""
+    bucket = utils.TokenBucket(rate_per_minute=60)
+
+    assert bucket.acquire(60) == 0
+    assert bucket.acquire(30) == pytest.approx(30)
+    assert fake_clock.now == pytest.approx(30)
+
+
+def test_token_bucket_clamps_large_amounts(fake_clock) -> None:
+    """A request larger than the bucket waits for a full bucket only."""
+    bucket = utils.TokenBucket(rate_per_minute=60, capacity=10)
+    bucket.acquire(10)
+
+    assert bucket.acquire(100) == pytest.approx(10)
+
+
+def test_token_bucket_rejects_non_positive_rate() -> None:
+    """The rate must be positive."""
+    with pytest.raises(ValueError):
+        utils.TokenBucket(rate_per_minute=0)
+
+
+def test_scheduler_batches_within_limits() -> None:
+    """Batches respect the instance and estimated token limits and keep the order."""
+    scheduler = utils.TextEmbeddingScheduler(
+        max_instances_per_request=3, max_tokens_per_request=10, chars_per_token=1
+    )
+    texts = ["aaaa", "bbbb", "cc", "d", "e", "f", "gggggggggggg", "h"]
+
+    batches = scheduler.get_batches(texts)
+
+    assert batches == [
+        ["aaaa", "bbbb", "cc"],
+        ["d", "e", "f"],
+        ["gggggggggggg"],
+        ["h"],
+    ]
+
+
+def test_scheduler_retries_resource_exhausted(fake_clock) -> None:
+    """Rejected requests are retried with backoff until they succeed."""
+    model = FlakyTextEmbeddingModel(failures=2)
+    scheduler = utils.TextEmbeddingScheduler(
+        model, requests_per_minute=None, initial_backoff=1, max_backoff=2
+    )
+
+    embeddings = scheduler.embed(["a", "bb"])
+
+    assert embeddings == [[1.0], [2.0]]
+    assert scheduler.request_count == 3
+    assert scheduler.retry_count == 2
+    assert model.batches == [["a", "bb"]] * 3
+    assert fake_clock.now <= 1 + 2
+
+
+def test_scheduler_gives_up_after_max_retries(fake_clock) -> None:
+    """The error is raised once the retries are exhausted."""
+    model = FlakyTextEmbeddingModel(failures=10)
+    scheduler = utils.TextEmbeddingScheduler(
+        model, requests_per_minute=None, max_retries=2
+    )
+
+    with pytest.raises(utils.ResourceExhausted):
+        scheduler.embed(["a"])
+
+    assert scheduler.request_count == 3
+
+
+def test_scheduler_paces_requests(fake_clock) -> None:
+    """Requests beyond the request quota wait for the token bucket."""
+    scheduler = utils.TextEmbeddingScheduler(
+        FlakyTextEmbeddingModel(failures=0),
+        max_instances_per_request=1,
+        requests_per_minute=2,
+    )
+
+    scheduler.embed(["a", "b", "c"])
+
+    assert fake_clock.now == pytest.approx(30)
+
+
+# IngestionCache
+def test_ingestion_cache_hit_and_miss(tmp_path) -> None:
+    """Values are returned for known keys only and the lookups are counted."""
+    cache = utils.IngestionCache(str(tmp_path))
+    key = cache.make_key("text_embedding", b"text", model="m", dimension=128)
+
+    assert cache.get(key) is None
+    cache.put(key, [0.5, 1.5])
+
+    assert cache.get(key) == [0.5, 1.5]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    cache.close()
+
+
+def test_ingestion_cache_keys_depend_on_parameters() -> None:
+    """The same content with other model parameters has another key."""
+    key = utils.IngestionCache.make_key("text_embedding", b"text", dimension=128)
+
+    assert key == utils.IngestionCache.make_key(
+        "text_embedding", b"text", dimension=128
+    )
+    assert key != utils.IngestionCache.make_key(
+        "text_embedding", b"text", dimension=256
+    )
+    assert key != utils.IngestionCache.make_key(
+        "text_embedding", b"other", dimension=128
+    )
+
+
+def test_ingestion_cache_persists(tmp_path) -> None:
+    """Entries survive reopening the cache directory."""
+    cache = utils.IngestionCache(str(tmp_path))
+    cache.put("key", {"description": "A chart."})
+    cache.close()
+
+    reopened = utils.IngestionCache(str(tmp_path))
+
+    assert reopened.get("key") == {"description": "A chart."}
+    reopened.close()
+
+
+def test_ingestion_cache_evicts_least_recently_used(tmp_path) -> None:
+    """Once full, the least recently used entries are evicted first."""
+    cache = utils.IngestionCache(str(tmp_path), max_size_bytes=20)
+    cache.put("old", "aaaaaaaa")
+    cache.put("used", "bbbbbbbb")
+    cache.get("old")
+
+    cache.put("new", "cccccccc")
+
+    assert cache.get("used") is None
+    assert cache.get("old") == "aaaaaaaa"
+    assert cache.get("new") == "cccccccc"
+    cache.close()
+
+
+# ImageTriage
+def test_image_triage_never_merges_distinct_images() -> None:
+    """Distinct images must never reuse each other's description."""
+    triage = utils.ImageTriage(min_bytes=0)
+    fingerprints = [
+        utils.get_image_fingerprint(get_image_bytes(get_random_gradient(seed)))
+        for seed in range(200)
+    ]
+
+    for fingerprint, other_fingerprint in itertools.combinations(fingerprints, 2):
+        assert not triage.is_duplicate(fingerprint, other_fingerprint)
+
+    for number, fingerprint in enumerate(fingerprints):
+        assert triage.find_duplicate(fingerprint) is None
+        triage.add(fingerprint, number)
+
+    assert triage.stats()["reused_duplicates"] == 0
+
+
+def test_image_triage_reuses_identical_pixels() -> None:
+    """The same pixels encoded differently are a duplicate."""
+    triage = utils.ImageTriage(min_bytes=0)
+    pixels = get_random_gradient(0)
+    triage.add(
+        utils.get_image_fingerprint(get_image_bytes(pixels, compress_level=9)), "logo"
+    )
+
+    reencoded = utils.get_image_fingerprint(get_image_bytes(pixels, compress_level=1))
+
+    assert triage.find_duplicate(reencoded) == "logo"
+
+
+def test_image_triage_ignores_lossy_copies_by_default() -> None:
+    """Lossy copies only match with an explicit pixel difference threshold."""
+    pixels = get_random_gradient(0)
+    original = utils.get_image_fingerprint(get_image_bytes(pixels))
+    lossy_copy = utils.get_image_fingerprint(
+        get_image_bytes(pixels, "JPEG", quality=95)
+    )
+
+    assert not utils.ImageTriage().is_duplicate(original, lossy_copy)
+    assert utils.ImageTriage(
+        max_hash_distance=64, max_pixel_difference=2.0
+    ).is_duplicate(original, lossy_copy)
+
+
+def test_image_triage_requires_same_dimensions() -> None:
+    """A resized copy of an image is not a duplicate."""
+    triage = utils.ImageTriage(min_bytes=0)
+    pixels = get_random_gradient(0)
+    triage.add(utils.get_image_fingerprint(get_image_bytes(pixels)), "large")
+
+    resized = np.asarray(
+        PIL.Image.fromarray(pixels.astype(np.uint8)).resize((128, 128))
+    )
+
+    assert (
+        triage.find_duplicate(utils.get_image_fingerprint(get_image_bytes(resized)))
+        is None
+    )
+
+
+@pytest.mark.parametrize(
+    "size,num_bytes,expected",
+    [((16, 256), 10000, True), ((256, 256), 100, True), ((256, 256), 10000, False)],
+)
+def test_image_triage_is_too_small(size, num_bytes, expected) -> None:
+    """Images below any threshold are skipped."""
+    triage = utils.ImageTriage()
+    fingerprint = {"width": size[0], "height": size[1], "num_bytes": num_bytes}
+
+    assert triage.is_too_small(fingerprint) is expected
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"images_per_description_request": 4},
+        {"pipelined": True, "max_parse_processes": 1},
+        {
+            "pipelined": True,
+            "max_parse_processes": 1,
+            "images_per_description_request": 4,
+        },
+    ],
+)
+def test_get_document_metadata_describes_page_duplicates_once(tmp_path, kwargs) -> None:
+    """A logo repeated on one page is described once and shared by its copies."""
+    logo = get_image_bytes(get_random_gradient(0, 128))
+    chart = get_image_bytes(get_random_gradient(1, 128))
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    write_pdf(str(pdf_dir / "a.pdf"), [logo, chart, logo])
+
+    triage = utils.ImageTriage(min_bytes=0)
+    generative_model, _, image_metadata_df = get_document_metadata(
+        str(pdf_dir), str(tmp_path / "images"), image_triage=triage, **kwargs
+    )
+
+    images_per_request = kwargs.get("images_per_description_request", 1)
+    assert generative_model.calls == (2 if images_per_request == 1 else 1)
+    assert triage.stats()["reused_duplicates"] == 1
+    assert len(image_metadata_df) == 2
+
+
+@pytest.mark.parametrize("first_pipelined", [False, True])
+def test_image_triage_is_shared_by_both_modes(tmp_path, first_pipelined) -> None:
+    """A triage filled in one mode is reused by the other one."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    logo = get_image_bytes(get_random_gradient(0, 128))
+    for file_no in range(2):
+        chart = get_image_bytes(get_random_gradient(file_no + 1, 128))
+        write_pdf(str(pdf_dir / f"{file_no}.pdf"), [logo, chart])
+    pdf_paths = sorted(str(path) for path in pdf_dir.iterdir())
+    triage = utils.ImageTriage(min_bytes=0)
+
+    results = []
+    for pipelined in [first_pipelined, not first_pipelined]:
+        generative_model, _, image_metadata_df = get_document_metadata(
+            str(pdf_dir),
+            str(tmp_path / "images"),
+            pdf_paths=pdf_paths,
+            image_triage=triage,
+            pipelined=pipelined,
+            max_parse_processes=1,
+        )
+        results.append((generative_model.calls, image_metadata_df))
+
+    assert results[0][0] == 3
+    assert results[1][0] == 0
+    assert results[0][1].equals(results[1][1])
+    assert triage.stats()["described"] == 3
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_image_triage_does_not_reuse_failed_descriptions(tmp_path, pipelined) -> None:
+    """A duplicate of an image whose description was blocked is described again."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    logo = get_image_bytes(get_random_gradient(0, 128))
+    write_pdf(str(pdf_dir / "a.pdf"), [logo], num_pages=2)
+    triage = utils.ImageTriage(min_bytes=0)
+
+    generative_model, _, image_metadata_df = get_document_metadata(
+        str(pdf_dir),
+        str(tmp_path / "images"),
+        BlockingGenerativeModel(blocked=1),
+        image_triage=triage,
+        pipelined=pipelined,
+        max_parse_processes=1,
+        max_model_workers=1,
+    )
+
+    assert generative_model.calls == 2
+    assert image_metadata_df["img_desc"].str.contains(
+        "Exception occurred"
+    ).tolist() == [
+        True,
+        False,
+    ]
+    assert triage.stats()["described"] == 1
+
+
+def test_get_similar_image_from_query_without_saved_images(tmp_path) -> None:
+    """Image search works on metadata built with save_images=False."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    write_pdf(
+        str(pdf_dir / "a.pdf"),
+        [get_image_bytes(get_random_gradient(seed, 128)) for seed in range(2)],
+    )
+    _, text_metadata_df, image_metadata_df = get_document_metadata(
+        str(pdf_dir), str(tmp_path / "images"), save_images=False
+    )
+
+    results = utils.get_similar_image_from_query(
+        text_metadata_df,
+        image_metadata_df,
+        query="a gradient",
+        column_name="text_embedding_from_image_description",
+        image_emb=False,
+        top_n=2,
+    )
+
+    assert len(results) == 2
+    assert all(result["image_object"] is None for result in results.values())
+
+
+@pytest.mark.parametrize("max_files_in_flight", [1, 2, 10])
+def test_get_document_metadata_pipelined_matches_sequential(
+    tmp_path, max_files_in_flight
+) -> None:
+    """The pipelined mode returns the sequential DataFrames for any window of files."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    for file_no in range(4):
+        write_pdf(
+            str(pdf_dir / f"{file_no}.pdf"),
+            [get_image_bytes(get_random_gradient(file_no, 128))],
+        )
+    pdf_paths = sorted(str(path) for path in pdf_dir.iterdir())
+
+    _, text_metadata_df, image_metadata_df = get_document_metadata(
+        str(pdf_dir), str(tmp_path / "images"), pdf_paths=pdf_paths
+    )
+    _, pipelined_text_metadata_df, pipelined_image_metadata_df = get_document_metadata(
+        str(pdf_dir),
+        str(tmp_path / "images"),
+        pdf_paths=pdf_paths,
+        pipelined=True,
+        max_parse_processes=1,
+        max_files_in_flight=max_files_in_flight,
+    )
+
+    assert text_metadata_df.equals(pipelined_text_metadata_df)
+    assert image_metadata_df.equals(pipelined_image_metadata_df)
+
+
+def test_iter_document_metadata_rejects_empty_window(tmp_path) -> None:
+    """The pipelined mode needs at least one file in flight."""
+    records = utils.iter_document_metadata(
+        FakeGenerativeModel(),
+        str(tmp_path),
+        str(tmp_path),
+        "Describe the image.",
+        pdf_paths=[],
+        pipelined=True,
+        max_files_in_flight=0,
+    )
+
+    with pytest.raises(ValueError):
+        next(records)
+
+
+# Normalized text metadata
+def get_chunks_df(text: str) -> pd.DataFrame:
+    """Create the denormalized text metadata of a one-page document."""
+    return pd.DataFrame(
+        [
+            {
+                "file_name": "a.pdf",
+                "page_num": 1,
+                "text": text,
+                "text_embedding_page": [1.0],
+                "chunk_number": chunk_number,
+                "chunk_text": chunk_text,
+                "text_embedding_chunk": [float(chunk_number)],
+            }
+            for chunk_number, chunk_text in utils.get_text_overlapping_chunk(
+                text
+            ).items()
+        ]
+    )
+
+
+def test_normalize_text_metadata_uses_chunk_offsets() -> None:
+    """Chunks of repetitive text get the offsets of the chunker."""
+    text = "abcd" * 500
+    chunks_df = get_chunks_df(text)
+
+    page_metadata_df, chunk_metadata_df = utils.normalize_text_metadata(chunks_df)
+
+    assert len(page_metadata_df) == 1
+    assert chunk_metadata_df["chunk_start"].tolist() == [0, 900, 1800]
+    assert [
+        text[start:end]
+        for start, end in zip(
+            chunk_metadata_df["chunk_start"], chunk_metadata_df["chunk_end"]
+        )
+    ] == chunks_df["chunk_text"].tolist()
+
+
+def test_normalize_text_metadata_rejects_other_chunks() -> None:
+    """Chunks not made by the chunker cannot be normalized."""
+    chunks_df = get_chunks_df("abcd" * 500)
+    chunks_df.loc[1, "chunk_text"] = chunks_df.loc[1, "chunk_text"][1:]
+
+    with pytest.raises(ValueError):
+        utils.normalize_text_metadata(chunks_df)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_get_document_metadata_normalized_text(tmp_path, pipelined) -> None:
+    """The page and chunk tables are extracted directly, like the normalized text metadata."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    for file_no in range(2):
+        write_pdf(
+            str(pdf_dir / f"{file_no}.pdf"),
+            [get_image_bytes(get_random_gradient(file_no, 128))],
+            num_pages=2,
+        )
+    pdf_paths = sorted(str(path) for path in pdf_dir.iterdir())
+
+    _, text_metadata_df, _ = get_document_metadata(
+        str(pdf_dir), str(tmp_path / "images"), pdf_paths=pdf_paths
+    )
+    _, page_metadata_df, chunk_metadata_df, _ = get_document_metadata(
+        str(pdf_dir),
+        str(tmp_path / "images"),
+        pdf_paths=pdf_paths,
+        pipelined=pipelined,
+        max_parse_processes=1,
+        normalized_text=True,
+    )
+
+    expected_page_df, expected_chunk_df = utils.normalize_text_metadata(
+        text_metadata_df
+    )
+    pd.testing.assert_frame_equal(page_metadata_df, expected_page_df)
+    pd.testing.assert_frame_equal(chunk_metadata_df, expected_chunk_df)
+    assert chunk_metadata_df["page_index"].tolist() == [0, 1, 2, 3]
+
+
+# Embedding matrix cache
+def get_embeddings_df(embeddings: np.ndarray) -> pd.DataFrame:
+    """Create a metadata DataFrame with one embedding per row."""
+    return pd.DataFrame(
+        {
+            "text": [str(row) for row in range(len(embeddings))],
+            "embedding": list(embeddings),
+        }
+    )
+
+
+def test_get_embedding_matrix_is_reused() -> None:
+    """The packed matrix is built once per DataFrame and column."""
+    df = get_embeddings_df(np.eye(3))
+
+    assert utils.get_embedding_matrix(df, "embedding") is utils.get_embedding_matrix(
+        df, "embedding"
+    )
+
+
+@pytest.mark.parametrize(
+    "modify",
+    [
+        lambda df: df.__setitem__("embedding", list(np.eye(3)[::-1])),
+        lambda df: df.sort_values("text", ascending=False, inplace=True),
+        lambda df: df.set_index(pd.Index([5, 6, 7]), inplace=True),
+    ],
+    ids=["replaced_column", "reordered_rows", "new_index"],
+)
+def test_get_embedding_matrix_detects_same_size_changes(modify) -> None:
+    """Changes that keep the number of rows still rebuild the matrix."""
+    df = get_embeddings_df(np.eye(3))
+    utils.get_embedding_matrix(df, "embedding")
+
+    modify(df)
+
+    np.testing.assert_array_equal(
+        utils.get_embedding_matrix(df, "embedding"),
+        np.asarray(df["embedding"].tolist(), dtype=np.float32),
+    )
+
+
+# Quantized embeddings
+def get_clustered_embeddings(num_rows: int = 2000, dimension: int = 64) -> np.ndarray:
+    """Create normalized embeddings around a few clusters, like real text embeddings."""
+    rng = np.random.default_rng(0)
+    centroids = rng.normal(size=(20, dimension))
+    embeddings = centroids[rng.integers(0, 20, num_rows)] + 0.7 * rng.normal(
+        size=(num_rows, dimension)
+    )
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+def get_recall(exact_scores: np.ndarray, scores: np.ndarray, top_n: int) -> float:
+    """Return the fraction of the exact top rows found in the top rows of other scores."""
+    recalls = []
+    for exact_row, row in zip(exact_scores, np.nan_to_num(scores, nan=-np.inf)):
+        exact_top = utils._get_top_n_indices(exact_row, top_n)
+        top = utils._get_top_n_indices(row, top_n)
+        recalls.append(np.intersect1d(exact_top, top).shape[0] / top_n)
+    return float(np.mean(recalls))
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+@pytest.mark.parametrize("num_queries", [1, 16])
+def test_quantized_search_recall(dtype, num_queries) -> None:
+    """Quantized search with rescoring finds the exact top rows."""
+    embeddings = get_clustered_embeddings()
+    queries = embeddings[:num_queries] + 0.01
+    df = get_embeddings_df(embeddings)
+    exact_scores = utils.get_cosine_scores(df, "embedding", queries)
+
+    utils.quantize_embedding_column(df, "embedding", dtype, rescore_size=50)
+    scores = utils._get_search_scores(df, "embedding", queries, 10)
+
+    assert get_recall(exact_scores, scores, 10) >= 0.95
+
+
+def test_quantized_scores_match_dequantized_scores() -> None:
+    """Integer scoring of int8 codes approximates the dequantized dot products."""
+    embeddings = get_clustered_embeddings()
+    quantized = utils.QuantizedEmbeddings.quantize(embeddings, "int8")
+    query = embeddings[0]
+
+    np.testing.assert_allclose(
+        quantized.get_scores(query),
+        quantized[np.arange(len(quantized))] @ query,
+        atol=0.02,
+    )
+    np.testing.assert_allclose(
+        quantized.get_scores(query, rows=[3, 1]), quantized.get_scores(query)[[3, 1]]
+    )
+
+
+def test_quantize_embedding_column_keeps_no_float32_matrix() -> None:
+    """Quantized columns are searched without a packed float32 copy of the column."""
+    df = get_embeddings_df(get_clustered_embeddings())
+    utils.get_embedding_matrix(df, "embedding")
+
+    utils.quantize_embedding_column(df, "embedding")
+    utils._get_search_scores(df, "embedding", get_clustered_embeddings()[0], 5)
+
+    assert utils._get_derived(df, "matrices", "embedding") is None
+
+
+# IVF index
+def test_ivf_recall_against_exact_search() -> None:
+    """The IVF index finds most exact top rows, and all of them when every list is scanned."""
+    embeddings = get_clustered_embeddings()
+    df = get_embeddings_df(embeddings)
+    index = utils.build_ivf_index(df, "embedding", nprobe=8)
+    queries = embeddings[:50] + 0.01
+
+    assert utils.evaluate_ivf_recall(df, "embedding", queries, 10) >= 0.9
+    assert (
+        utils.evaluate_ivf_recall(df, "embedding", queries, 10, nprobe=index.num_lists)
+        == 1.0
+    )
+
+
+def test_ivf_index_is_dropped_when_rows_change() -> None:
+    """An IVF index built on other rows is not used."""
+    df = get_embeddings_df(get_clustered_embeddings())
+    utils.build_ivf_index(df, "embedding")
+
+    df["embedding"] = list(get_clustered_embeddings()[::-1])
+
+    assert utils.get_ivf_index(df, "embedding") is None
+
+
+# Metadata index
+@pytest.mark.parametrize("mmap", [True, False])
+def test_metadata_index_round_trip(tmp_path, mmap) -> None:
+    """Saved metadata loads back with the same rows, embeddings and search structures."""
+    embeddings = get_clustered_embeddings(200)
+    text_metadata_df = get_embeddings_df(embeddings)
+    text_metadata_df["page_num"] = np.arange(len(text_metadata_df)) // 4
+    image_metadata_df = pd.DataFrame(
+        {"img_path": ["a.png", "b.png"], "mm_embedding_from_img_only": list(np.eye(2))}
+    )
+    utils.build_ivf_index(text_metadata_df, "embedding", num_lists=4)
+    utils.quantize_embedding_column(text_metadata_df, "embedding", rescore_size=20)
+
+    utils.save_metadata_index(text_metadata_df, image_metadata_df, str(tmp_path))
+    loaded_text_df, loaded_image_df = utils.load_metadata_index(str(tmp_path), mmap)
+
+    pd.testing.assert_frame_equal(
+        loaded_text_df.drop(columns="embedding"),
+        text_metadata_df.drop(columns="embedding"),
+        check_dtype=False,
+    )
+    np.testing.assert_array_equal(
+        np.stack(loaded_text_df["embedding"].tolist()), embeddings
+    )
+    np.testing.assert_array_equal(
+        np.stack(loaded_image_df["mm_embedding_from_img_only"].tolist()), np.eye(2)
+    )
+    assert utils.get_ivf_index(loaded_text_df, "embedding").num_lists == 4
+    assert utils.get_quantized_embeddings(loaded_text_df, "embedding").dtype == "int8"
+    np.testing.assert_array_equal(
+        utils._get_search_scores(loaded_text_df, "embedding", embeddings[0], 5),
+        utils._get_search_scores(text_metadata_df, "embedding", embeddings[0], 5),
+    )
+
+
+def test_load_metadata_index_rejects_other_versions(tmp_path) -> None:
+    """Indexes written in another format version are not loaded."""
+    utils.save_metadata_index(pd.DataFrame(), pd.DataFrame(), str(tmp_path))
+    index_path = tmp_path / utils.INDEX_FILE_NAME
+    index_info = json.loads(index_path.read_text())
+    index_info["format_version"] += 1
+    index_path.write_text(json.dumps(index_info))
+
+    with pytest.raises(ValueError):
+        utils.load_metadata_index(str(tmp_path))
@@ -2,25 +2,257 @@
 
 from __future__ import annotations
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
-from typing import Any, Iterable, List, Optional, Type
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+import urllib.parse
 import uuid
 
+from google.api_core.exceptions import NotFound
 import google.auth
 import google.auth.transport.requests
 from google.cloud import aiplatform_v1, storage
 from google.cloud.aiplatform import MatchingEngineIndex, MatchingEngineIndexEndpoint
+from google.cloud.aiplatform.matching_engine._protos import (
+    match_service_pb2,
+    match_service_pb2_grpc,
+)
 from google.oauth2.service_account import Credentials
+import grpc
 from langchain.docstore.document import Document
 from langchain.embeddings import TensorflowHubEmbeddings
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.base import VectorStore
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger()
 
 
+class DocumentCache:
+    """Two-tier read-through cache for the documents stored in GCS.
+
+    The first tier is an in-process LRU bounded by the total size of the
+    cached documents. The optional second tier stores one file per
+    datapoint id in a local directory, so documents survive restarts and
+    evictions from memory. It is an LRU bounded by the total size of its
+    files. Sizes are measured in bytes, with str documents encoded as UTF-8.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024**2,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 1024**3,
+    ):
+        """Creates an empty document cache.
+
+        Args:
+            max_memory_bytes: The maximum total size of the documents kept in
+            memory.
+            cache_dir: (Optional) The directory of the on-disk tier. The
+            on-disk tier is disabled if not set. Documents already in the
+            directory are kept, oldest first in the eviction order.
+            max_disk_bytes: The maximum total size of the files of the
+            on-disk tier.
+        """
+        if max_memory_bytes < 0:
+            raise ValueError(
+                f"max_memory_bytes must not be negative. Received {max_memory_bytes}"
+            )
+        if max_disk_bytes < 0:
+            raise ValueError(
+                f"max_disk_bytes must not be negative. Received {max_disk_bytes}"
+            )
+
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries: OrderedDict[str, Tuple[Union[str, bytes], int]] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_entries: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_entries()
+
+    def get(self, datapoint_id: str) -> Optional[Union[str, bytes]]:
+        """Gets a cached document.
+
+        Args:
+            datapoint_id: The datapoint id of the document.
+
+        Returns:
+            The document, or None if it is not cached.
+        """
+        with self._lock:
+            if datapoint_id in self._disk_entries:
+                self._disk_entries.move_to_end(datapoint_id)
+            if datapoint_id in self._entries:
+                self._entries.move_to_end(datapoint_id)
+                self.memory_hits += 1
+                return self._entries[datapoint_id][0]
+
+        if self.cache_dir:
+            try:
+                with open(self._get_path(datapoint_id), "rb") as cache_file:
+                    document = cache_file.read()
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put_in_memory(datapoint_id, document)
+                return document
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, datapoint_id: str, document: Union[str, bytes]) -> None:
+        """Caches a document in both tiers.
+
+        Args:
+            datapoint_id: The datapoint id of the document.
+            document: The document contents.
+        """
+        with self._lock:
+            self._put_in_memory(datapoint_id, document)
+
+        if not self.cache_dir:
+            return
+
+        data = document.encode("utf-8") if isinstance(document, str) else document
+        if len(data) > self.max_disk_bytes:
+            # Do not leave a stale copy of a previous version on disk
+            with self._lock:
+                self._disk_bytes -= self._disk_entries.pop(datapoint_id, 0)
+            self._remove_file(datapoint_id)
+            return
+
+        # Write to a temporary file first so readers never see partial files
+        file_descriptor, temp_path = tempfile.mkstemp(prefix=".", dir=self.cache_dir)
+        with os.fdopen(file_descriptor, "wb") as cache_file:
+            cache_file.write(data)
+        os.replace(temp_path, self._get_path(datapoint_id))
+
+        with self._lock:
+            self._disk_bytes -= self._disk_entries.pop(datapoint_id, 0)
+            self._disk_entries[datapoint_id] = len(data)
+            self._disk_bytes += len(data)
+            evicted_ids = []
+            while self._disk_bytes > self.max_disk_bytes:
+                evicted_id, size = self._disk_entries.popitem(last=False)
+                self._disk_bytes -= size
+                self.disk_evictions += 1
+                evicted_ids.append(evicted_id)
+
+        for evicted_id in evicted_ids:
+            self._remove_file(evicted_id)
+
+    def invalidate(self, datapoint_id: str) -> None:
+        """Removes a document from both tiers.
+
+        Args:
+            datapoint_id: The datapoint id of the document.
+        """
+        with self._lock:
+            entry = self._entries.pop(datapoint_id, None)
+            if entry is not None:
+                self._memory_bytes -= entry[1]
+            self._disk_bytes -= self._disk_entries.pop(datapoint_id, 0)
+
+        if self.cache_dir:
+            self._remove_file(datapoint_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counts and the usage of both
+        tiers."""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _put_in_memory(self, datapoint_id: str, document: Union[str, bytes]) -> None:
+        """Adds a document to the LRU, evicting the least recently used ones."""
+        size = self._get_size(document)
+        if size > self.max_memory_bytes:
+            return
+
+        previous = self._entries.pop(datapoint_id, None)
+        if previous is not None:
+            self._memory_bytes -= previous[1]
+
+        self._entries[datapoint_id] = (document, size)
+        self._memory_bytes += size
+
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self.evictions += 1
+
+    def _load_disk_entries(self) -> None:
+        """Indexes the documents already in the cache directory, least
+        recently modified first, and evicts them down to max_disk_bytes."""
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                # Skip the temporary files of interrupted writes
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self._disk_entries[urllib.parse.unquote(name)] = size
+            self._disk_bytes += size
+
+        while self._disk_bytes > self.max_disk_bytes:
+            evicted_id, size = self._disk_entries.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            self._remove_file(evicted_id)
+
+    def _remove_file(self, datapoint_id: str) -> None:
+        """Removes the on-disk copy of a document, if any."""
+        try:
+            os.remove(self._get_path(datapoint_id))
+        except FileNotFoundError:
+            pass
+
+    def _get_path(self, datapoint_id: str) -> str:
+        """Gets the on-disk location of a document."""
+        return os.path.join(self.cache_dir, urllib.parse.quote(datapoint_id, safe=""))
+
+    @staticmethod
+    def _get_size(document: Union[str, bytes]) -> int:
+        """Gets the size of a document in bytes."""
+        if isinstance(document, str):
+            return len(document.encode("utf-8"))
+        return len(document)
+
+
 class MatchingEngine(VectorStore):
     """Vertex AI Matching Engine implementation of the vector store.
 
@@ -48,6 +280,12 @@ class MatchingEngine(VectorStore):
         index_endpoint_client: aiplatform_v1.IndexEndpointServiceClient,
         gcs_bucket_name: str,
         credentials: Credentials = None,
+        max_download_workers: int = 8,
+        document_cache: Optional[DocumentCache] = None,
+        http_pool_size: int = 10,
+        request_timeout: Optional[float] = None,
+        transport: str = "rest",
+        grpc_api_endpoint: Optional[str] = None,
     ):
         """Vertex AI Matching Engine implementation of the vector store.
 
@@ -75,6 +313,24 @@ class MatchingEngine(VectorStore):
             multilingual TensorFlow Universal Sentence Encoder will be used.
             gcs_client: The Google Cloud Storage client.
             credentials (Optional): Created Google Cloud credentials.
+            max_download_workers: The maximum number of documents downloaded
+            concurrently from GCS for one query.
+            document_cache: (Optional) A :class:`DocumentCache` answering
+            repeated document reads without GCS.
+            http_pool_size: The maximum number of kept-alive connections to
+            the index endpoint.
+            request_timeout: (Optional) The timeout in seconds of the
+            findNeighbors requests.
+            transport: How queries are sent to a public index endpoint:
+            "rest" for JSON requests to the findNeighbors REST method, or
+            "grpc" for the MatchServiceClient over a long-lived gRPC channel.
+            Private (VPC peering or Private Service Connect) index endpoints
+            are always queried with their MatchService over gRPC.
+            grpc_api_endpoint: (Optional) The address of the gRPC endpoint.
+            Defaults to the public endpoint domain name for public index
+            endpoints and, for private index endpoints, to port 10000 of the
+            private_service_connect_ip_address of the endpoint or of the
+            match_grpc_address of the deployed index.
         """
         super().__init__()
         self._validate_google_libraries_installation()
@@ -90,6 +346,26 @@ class MatchingEngine(VectorStore):
         self.gcs_client = gcs_client
         self.credentials = credentials
         self.gcs_bucket_name = gcs_bucket_name
+        self.max_download_workers = max_download_workers
+        self.document_cache = document_cache
+        self.http_pool_size = http_pool_size
+        self.request_timeout = request_timeout
+        self._session: Optional[requests.Session] = None
+
+        if transport not in ("rest", "grpc"):
+            raise ValueError(
+                f"The argument transport should be 'rest' or 'grpc'. "
+                f"Received {transport}"
+            )
+        self.transport = transport
+        self.grpc_api_endpoint = grpc_api_endpoint
+        self._match_client: Optional[aiplatform_v1.MatchServiceClient] = None
+        self._private_channel: Optional[grpc.Channel] = None
+        self._private_match_stub: Optional[
+            match_service_pb2_grpc.MatchServiceStub
+        ] = None
+        self._bucket: Optional[storage.Bucket] = None
+        self._download_pool: Optional[ThreadPoolExecutor] = None
 
     def _validate_google_libraries_installation(self) -> None:
         """Validates that Google libraries that are needed are installed."""
@@ -131,6 +407,10 @@ class MatchingEngine(VectorStore):
             id = uuid.uuid4()
             ids.append(str(id))
             self._upload_to_gcs(text, f"documents/{id}")
+            if self.document_cache is not None:
+                # Cached as downloaded from GCS, so new documents are read
+                # without a download
+                self.document_cache.put(str(id), text.encode("utf-8"))
 
             insert_datapoints_payload.append(
                 aiplatform_v1.IndexDatapoint(
@@ -163,10 +443,19 @@ class MatchingEngine(VectorStore):
             data: The data that will be stored.
             gcs_location: The location where the data will be stored.
         """
-        bucket = self.gcs_client.get_bucket(self.gcs_bucket_name)
-        blob = bucket.blob(gcs_location)
+        blob = self._get_bucket().blob(gcs_location)
         blob.upload_from_string(data)
 
+    def _get_bucket(self) -> storage.Bucket:
+        """Gets the GCS bucket, looking it up only on first use.
+
+        Returns:
+            The bucket where the documents are stored.
+        """
+        if self._bucket is None:
+            self._bucket = self.gcs_client.get_bucket(self.gcs_bucket_name)
+        return self._bucket
+
     def get_matches(
         self,
         embeddings: List[str],
@@ -201,11 +490,316 @@ class MatchingEngine(VectorStore):
 
         logger.debug(f"Querying Matching Engine Index Endpoint {rpc_address}")
 
-        request = google.auth.transport.requests.Request()
-        self.credentials.refresh(request)
-        header = {"Authorization": "Bearer " + self.credentials.token}
+        return self._get_session().post(
+            rpc_address,
+            data=endpoint_json_data,
+            headers={"Content-Type": "application/json"},
+            timeout=self.request_timeout,
+        )
+
+    def get_matches_grpc(
+        self,
+        embeddings: List[List[float]],
+        n_matches: int,
+        index_endpoint: MatchingEngineIndexEndpoint,
+        filters: Any,
+    ) -> aiplatform_v1.FindNeighborsResponse:
+        """Gets matches from Matching Engine given vector queries, using the
+        MatchServiceClient over gRPC.
+
+        Args:
+            embeddings: The query vectors.
+            n_matches: The number of neighbors of each query.
+            index_endpoint: The index endpoint to query.
+            filters: The restricts of the queries, e.g.
+            [{"namespace": "source", "allow_list": ["a.pdf"]}].
+
+        Returns:
+            The FindNeighborsResponse.
+        """
+        restricts = [
+            aiplatform_v1.IndexDatapoint.Restriction(
+                namespace=restrict["namespace"],
+                allow_list=restrict.get("allow_list", restrict.get("allowList", [])),
+                deny_list=restrict.get("deny_list", restrict.get("denyList", [])),
+            )
+            for restrict in filters or []
+        ]
+        request = aiplatform_v1.FindNeighborsRequest(
+            index_endpoint=index_endpoint.resource_name,
+            deployed_index_id=index_endpoint.deployed_indexes[0].id,
+            return_full_datapoint=True,
+            queries=[
+                aiplatform_v1.FindNeighborsRequest.Query(
+                    datapoint=aiplatform_v1.IndexDatapoint(
+                        datapoint_id=f"{i}",
+                        feature_vector=emb,
+                        restricts=restricts,
+                    ),
+                    neighbor_count=n_matches,
+                )
+                for i, emb in enumerate(embeddings)
+            ],
+        )
+
+        logger.debug(
+            f"Querying Matching Engine Index Endpoint {index_endpoint.resource_name} over gRPC"
+        )
+
+        return self._get_match_client().find_neighbors(
+            request=request, timeout=self.request_timeout
+        )
+
+    def get_matches_private(
+        self,
+        embeddings: List[List[float]],
+        n_matches: int,
+        index_endpoint: MatchingEngineIndexEndpoint,
+        filters: Any,
+    ) -> match_service_pb2.BatchMatchResponse:
+        """Gets matches from a private (VPC peering or Private Service
+        Connect) index endpoint given vector queries, using its MatchService
+        over gRPC.
+
+        Args:
+            embeddings: The query vectors.
+            n_matches: The number of neighbors of each query.
+            index_endpoint: The index endpoint to query.
+            filters: The restricts of the queries, e.g.
+            [{"namespace": "source", "allow_list": ["a.pdf"]}].
+
+        Returns:
+            The BatchMatchResponse, with one MatchResponse per query in the
+            order of embeddings.
+        """
+        deployed_index_id = index_endpoint.deployed_indexes[0].id
+        restricts = [
+            match_service_pb2.Namespace(
+                name=restrict["namespace"],
+                allow_tokens=restrict.get("allow_list", restrict.get("allowList", [])),
+                deny_tokens=restrict.get("deny_list", restrict.get("denyList", [])),
+            )
+            for restrict in filters or []
+        ]
+        request = match_service_pb2.BatchMatchRequest(
+            requests=[
+                match_service_pb2.BatchMatchRequest.BatchMatchRequestPerIndex(
+                    deployed_index_id=deployed_index_id,
+                    requests=[
+                        match_service_pb2.MatchRequest(
+                            deployed_index_id=deployed_index_id,
+                            float_val=emb,
+                            num_neighbors=n_matches,
+                            restricts=restricts,
+                            embedding_enabled=True,
+                        )
+                        for emb in embeddings
+                    ],
+                )
+            ]
+        )
+
+        logger.debug(
+            f"Querying Matching Engine Index Endpoint {index_endpoint.resource_name} over private gRPC"
+        )
+
+        return self._get_private_match_stub().BatchMatch(
+            request, timeout=self.request_timeout
+        )
+
+    def _find_neighbors(
+        self, embeddings: List[List[float]], n_matches: int, filters: Any
+    ) -> List[dict]:
+        """Queries the index endpoint with the configured transport.
+
+        Args:
+            embeddings: The query vectors.
+            n_matches: The number of neighbors of each query.
+            filters: The restricts of the queries.
+
+        Returns:
+            The neighbors of the queries, in the format of the findNeighbors
+            REST response: {"id": <query datapoint id>, "neighbors":
+            [{"datapoint": {"datapointId": ..., "restricts": [...]},
+            "distance": ...}]}. The query datapoint id is the position of the
+            query in embeddings.
+        """
+        if not self.endpoint.public_endpoint_domain_name:
+            response = self.get_matches_private(
+                embeddings, n_matches, self.endpoint, filters
+            )
+            return [
+                self._match_response_to_dict(str(i), match_response)
+                for i, match_response in enumerate(response.responses[0].responses)
+            ]
+
+        if self.transport == "grpc":
+            response = self.get_matches_grpc(
+                embeddings, n_matches, self.endpoint, filters
+            )
+            return [
+                {
+                    "id": nearest_neighbors.id,
+                    "neighbors": [
+                        self._neighbor_to_dict(neighbor)
+                        for neighbor in nearest_neighbors.neighbors
+                    ],
+                }
+                for nearest_neighbors in response.nearest_neighbors
+            ]
+
+        response = self.get_matches(embeddings, n_matches, self.endpoint, filters)
+
+        if response.status_code == 200:
+            return response.json().get("nearestNeighbors", [])
+        else:
+            raise Exception(f"Failed to query index {str(response)}")
+
+    @staticmethod
+    def _neighbor_to_dict(
+        neighbor: aiplatform_v1.FindNeighborsResponse.Neighbor,
+    ) -> dict:
+        """Converts a gRPC neighbor to the REST response format, without the
+        feature vector. Like in the REST response, empty allow and deny lists
+        are omitted."""
+        restricts = []
+        for restrict in neighbor.datapoint.restricts:
+            item = {"namespace": restrict.namespace}
+            if restrict.allow_list:
+                item["allowList"] = list(restrict.allow_list)
+            if restrict.deny_list:
+                item["denyList"] = list(restrict.deny_list)
+            restricts.append(item)
+
+        return {
+            "datapoint": {
+                "datapointId": neighbor.datapoint.datapoint_id,
+                "restricts": restricts,
+            },
+            "distance": neighbor.distance,
+        }
+
+    @staticmethod
+    def _match_response_to_dict(
+        query_id: str, match_response: match_service_pb2.MatchResponse
+    ) -> dict:
+        """Converts the MatchResponse of a private index endpoint to the
+        findNeighbors REST response format. The restricts of the neighbors
+        are read from the returned embeddings."""
+        restricts_by_id = {}
+        for embedding in match_response.embeddings:
+            restricts = []
+            for namespace in embedding.restricts:
+                item = {"namespace": namespace.name}
+                if namespace.allow_tokens:
+                    item["allowList"] = list(namespace.allow_tokens)
+                if namespace.deny_tokens:
+                    item["denyList"] = list(namespace.deny_tokens)
+                restricts.append(item)
+            restricts_by_id[embedding.id] = restricts
+
+        return {
+            "id": query_id,
+            "neighbors": [
+                {
+                    "datapoint": {
+                        "datapointId": neighbor.id,
+                        "restricts": restricts_by_id.get(neighbor.id, []),
+                    },
+                    "distance": neighbor.distance,
+                }
+                for neighbor in match_response.neighbor
+            ],
+        }
+
+    def _get_match_client(self) -> aiplatform_v1.MatchServiceClient:
+        """Gets the gRPC match client of a public index endpoint, creating it
+        on first use so that its channel is reused across queries.
+
+        Returns:
+            A configured MatchServiceClient.
+        """
+        if self._match_client is None:
+            api_endpoint = (
+                self.grpc_api_endpoint or self.endpoint.public_endpoint_domain_name
+            )
+            self._match_client = aiplatform_v1.MatchServiceClient(
+                client_options=dict(api_endpoint=api_endpoint),
+                credentials=self.credentials,
+            )
+        return self._match_client
+
+    def _get_private_match_stub(self) -> match_service_pb2_grpc.MatchServiceStub:
+        """Gets the MatchService stub of a private index endpoint, creating
+        it on first use so that its channel is reused across queries.
+
+        The channel connects to grpc_api_endpoint if set, otherwise to port
+        10000 of the Private Service Connect IP address of the endpoint or,
+        for VPC peering, of the match gRPC address of the deployed index. It
+        is not encrypted, like the private endpoint itself, so it must be
+        opened from the peered or connected VPC network.
+
+        Returns:
+            A MatchServiceStub.
+        """
+        if self._private_match_stub is None:
+            address = self.grpc_api_endpoint
+            if not address:
+                ip_address = getattr(
+                    self.endpoint, "private_service_connect_ip_address", None
+                ) or getattr(
+                    self.endpoint.deployed_indexes[0].private_endpoints,
+                    "match_grpc_address",
+                    None,
+                )
+                if not ip_address:
+                    raise ValueError(
+                        f"The index endpoint {self.endpoint.display_name} has "
+                        f"no public endpoint domain name and no private "
+                        f"address. Set its private_service_connect_ip_address "
+                        f"or pass grpc_api_endpoint."
+                    )
+                address = f"{ip_address}:10000"
+
+            self._private_channel = grpc.insecure_channel(address)
+            self._private_match_stub = match_service_pb2_grpc.MatchServiceStub(
+                self._private_channel
+            )
+        return self._private_match_stub
+
+    def _get_session(self) -> requests.Session:
+        """Gets the HTTP session used for queries, creating it on first use.
+
+        The session keeps connections to the endpoint alive across queries
+        and reuses the access token of the credentials, refreshing it only
+        when it is about to expire.
 
-        return requests.post(rpc_address, data=endpoint_json_data, headers=header)
+        Returns:
+            An authorized requests session.
+        """
+        if self._session is None:
+            session = google.auth.transport.requests.AuthorizedSession(self.credentials)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.http_pool_size)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def close(self) -> None:
+        """Closes the HTTP session and the gRPC channel, and stops the
+        document download threads."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._match_client is not None:
+            self._match_client.transport.close()
+            self._match_client = None
+        if self._private_channel is not None:
+            self._private_channel.close()
+            self._private_channel = None
+            self._private_match_stub = None
+        if self._download_pool is not None:
+            self._download_pool.shutdown(wait=False)
+            self._download_pool = None
 
     def similarity_search(
         self,
@@ -213,71 +807,190 @@ class MatchingEngine(VectorStore):
         k: int = 4,
         search_distance: float = 0.65,
         filters={},
+        neighbor_count: Optional[int] = None,
         **kwargs: Any,
     ) -> List[Document]:
         """Return docs most similar to query.
 
+        Neighbors are filtered by distance and restricts before any document
+        is downloaded, and at most k documents are downloaded from GCS.
+
         Args:
             query: The string that will be used to search for similar documents.
             k: The amount of neighbors that will be retrieved.
             search_distance: filter search results by search distance by adding a threshold value
+            filters: The restricts sent with the query, e.g.
+            [{"namespace": "source", "allow_list": ["a.pdf"]}].
+            neighbor_count: (Optional) The number of neighbors requested from
+            the index before filtering. Defaults to k.
 
         Returns:
             A list of k matching documents.
         """
 
         logger.debug(f"Embedding query {query}.")
-        embedding_query = self.embedding.embed_documents([query])
-        deployed_index_id = self._get_index_id()
-        logger.debug(f"Deployed Index ID = {deployed_index_id}")
 
-        # TO-DO: Pending query sdk integration
-        # response = self.endpoint.match(
-        #     deployed_index_id=self._get_index_id(),
-        #     queries=embedding_query,
-        #     num_neighbors=k,
-        # )
+        return self.similarity_search_batch(
+            [query], k, search_distance, filters, neighbor_count
+        )[0]
 
-        response = self.get_matches(embedding_query, k, self.endpoint, filters)
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        search_distance: float = 0.65,
+        filters={},
+        neighbor_count: Optional[int] = None,
+    ) -> List[List[Document]]:
+        """Return docs most similar to each of several queries.
 
-        if response.status_code == 200:
-            response = response.json()["nearestNeighbors"]
-        else:
-            raise Exception(f"Failed to query index {str(response)}")
+        All queries are embedded in one embed_documents call and sent in one
+        findNeighbors request. The documents of all queries are fetched
+        together, once per distinct datapoint.
 
-        if len(response) == 0:
+        Args:
+            queries: The strings that will be used to search for similar
+            documents.
+            k: The amount of neighbors that will be retrieved per query.
+            search_distance: filter search results by search distance by adding a threshold value
+            filters: The restricts sent with every query, e.g.
+            [{"namespace": "source", "allow_list": ["a.pdf"]}].
+            neighbor_count: (Optional) The number of neighbors requested from
+            the index per query before filtering. Defaults to k.
+
+        Returns:
+            A list of up to k matching documents for each query, in the
+            order of queries.
+        """
+        if not queries:
             return []
 
-        logger.debug(f"Found {len(response)} matches for the query {query}.")
+        logger.debug(f"Embedding {len(queries)} queries.")
+        embedding_queries = self.embedding.embed_documents(list(queries))
+        deployed_index_id = self._get_index_id()
+        logger.debug(f"Deployed Index ID = {deployed_index_id}")
+
+        # Sent over REST or gRPC depending on self.transport
+        response = self._find_neighbors(embedding_queries, neighbor_count or k, filters)
 
-        results = []
+        logger.debug(f"Found matches for {len(response)} of {len(queries)} queries.")
 
-        # I'm only getting the first one because queries receives an array
-        # and the similarity_search method only receives one query. This
-        # means that the match method will always return an array with only
-        # one element.
-        for doc in response[0]["neighbors"]:
-            page_content = self._download_from_gcs(
-                f"documents/{doc['datapoint']['datapointId']}"
+        # Each entry of the response carries the datapoint id of its query,
+        # which is the position of the query. Queries without matches may be
+        # missing from the response.
+        neighbors_by_query = {
+            str(nearest_neighbors.get("id")): nearest_neighbors.get("neighbors", [])
+            for nearest_neighbors in response
+        }
+        query_neighbors = [
+            self._select_neighbors(
+                neighbors_by_query.get(str(i), []), k, search_distance, filters
             )
-            metadata = {}
-            if "restricts" in doc["datapoint"]:
-                metadata = {
-                    item["namespace"]: item["allowList"][0]
-                    for item in doc["datapoint"]["restricts"]
-                }
+            for i in range(len(queries))
+        ]
+
+        datapoint_ids = list(
+            dict.fromkeys(
+                datapoint_id
+                for neighbors in query_neighbors
+                for datapoint_id, _ in neighbors
+            )
+        )
+        page_contents = dict(zip(datapoint_ids, self._get_documents(datapoint_ids)))
+
+        results = [
+            [
+                Document(page_content=page_contents[datapoint_id], metadata=metadata)
+                for datapoint_id, metadata in neighbors
+            ]
+            for neighbors in query_neighbors
+        ]
+
+        logger.debug(f"Downloaded {len(datapoint_ids)} documents for the queries.")
+
+        return results
+
+    def _select_neighbors(
+        self,
+        neighbors: List[dict],
+        k: int,
+        search_distance: float,
+        filters: Any,
+    ) -> List[Tuple[str, dict]]:
+        """Selects the neighbors whose documents should be downloaded.
+
+        Args:
+            neighbors: The neighbors of one query in the findNeighbors response.
+            k: The maximum number of neighbors to select.
+            search_distance: Neighbors with a distance below this threshold
+            are dropped.
+            filters: The restricts sent with the query.
+
+        Returns:
+            The datapoint id and the document metadata of up to k neighbors,
+            in the order of the response.
+        """
+        selected = []
+        for doc in neighbors:
+            if len(selected) >= k:
+                break
+
+            if "distance" in doc and doc["distance"] < search_distance:
+                continue
+
+            restricts = doc["datapoint"].get("restricts", [])
+            if not self._matches_filters(restricts, filters):
+                continue
+
+            # Deny-only restricts have no value to report
+            metadata = {
+                item["namespace"]: item["allowList"][0]
+                for item in restricts
+                if item.get("allowList")
+            }
             if "distance" in doc:
                 metadata["score"] = doc["distance"]
-                if doc["distance"] >= search_distance:
-                    results.append(
-                        Document(page_content=page_content, metadata=metadata)
-                    )
-            else:
-                results.append(Document(page_content=page_content, metadata=metadata))
 
-        logger.debug("Downloaded documents for query.")
+            selected.append((doc["datapoint"]["datapointId"], metadata))
 
-        return results
+        return selected
+
+    @staticmethod
+    def _matches_filters(restricts: List[dict], filters: Any) -> bool:
+        """Checks the restricts of a returned datapoint against the query filters.
+
+        The index already applies the filters, so this only drops neighbors
+        whose returned restricts contradict them, e.g. when the index was
+        updated after the query was served.
+
+        Args:
+            restricts: The restricts of the returned datapoint.
+            filters: The restricts sent with the query.
+
+        Returns:
+            False if a namespace of the datapoint is outside an allow list or
+            inside a deny list of the filters, True otherwise.
+        """
+        if not filters or not isinstance(filters, list):
+            return True
+
+        values = {
+            item["namespace"]: set(item.get("allowList", [])) for item in restricts
+        }
+        for restrict in filters:
+            namespace_values = values.get(restrict.get("namespace"))
+            if namespace_values is None:
+                continue
+
+            allow_list = restrict.get("allow_list", restrict.get("allowList"))
+            if allow_list and not namespace_values & set(allow_list):
+                return False
+
+            deny_list = restrict.get("deny_list", restrict.get("denyList"))
+            if deny_list and namespace_values & set(deny_list):
+                return False
+
+        return True
 
     def _get_index_id(self) -> str:
         """Gets the correct index id for the endpoint.
@@ -303,15 +1016,81 @@ class MatchingEngine(VectorStore):
             gcs_location: The location where the file is located.
 
         Returns:
-            The string contents of the file.
+            The string contents of the file, or an empty string if the file
+            does not exist.
         """
-        bucket = self.gcs_client.get_bucket(self.gcs_bucket_name)
+        bucket = self._get_bucket()
         try:
             blob = bucket.blob(gcs_location)
             return blob.download_as_string()
-        except Exception:
+        except NotFound:
             return ""
 
+    def _get_documents(self, datapoint_ids: List[str]) -> List[str]:
+        """Gets documents from the document cache, downloading the missing
+        ones from GCS.
+
+        Args:
+            datapoint_ids: The datapoint ids of the documents.
+
+        Returns:
+            The contents of the documents, in the order of datapoint_ids.
+        """
+        if self.document_cache is None:
+            return self._download_documents_from_gcs(
+                [f"documents/{datapoint_id}" for datapoint_id in datapoint_ids]
+            )
+
+        documents = [
+            self.document_cache.get(datapoint_id) for datapoint_id in datapoint_ids
+        ]
+        missing_ids = list(
+            dict.fromkeys(
+                datapoint_id
+                for datapoint_id, document in zip(datapoint_ids, documents)
+                if document is None
+            )
+        )
+        downloaded = dict(
+            zip(
+                missing_ids,
+                self._download_documents_from_gcs(
+                    [f"documents/{datapoint_id}" for datapoint_id in missing_ids]
+                ),
+            )
+        )
+
+        # Failed downloads come back empty and are not cached
+        for datapoint_id, document in downloaded.items():
+            if document:
+                self.document_cache.put(datapoint_id, document)
+
+        return [
+            document if document is not None else downloaded[datapoint_id]
+            for datapoint_id, document in zip(datapoint_ids, documents)
+        ]
+
+    def _download_documents_from_gcs(self, gcs_locations: List[str]) -> List[str]:
+        """Downloads several files from GCS concurrently.
+
+        Args:
+            gcs_locations: The locations where the files are located.
+
+        Returns:
+            The string contents of the files, in the order of gcs_locations.
+        """
+        if len(gcs_locations) <= 1 or self.max_download_workers <= 1:
+            return [self._download_from_gcs(location) for location in gcs_locations]
+
+        # Resolve the bucket before the workers share it
+        self._get_bucket()
+        if self._download_pool is None:
+            self._download_pool = ThreadPoolExecutor(
+                max_workers=self.max_download_workers
+            )
+
+        return list(self._download_pool.map(self._download_from_gcs, gcs_locations))
+
     @classmethod
     def from_texts(
         cls: Type["MatchingEngine"],
@@ -352,6 +1131,12 @@ class MatchingEngine(VectorStore):
         endpoint_id: str,
         credentials_path: Optional[str] = None,
         embedding: Optional[Embeddings] = None,
+        max_download_workers: int = 8,
+        document_cache: Optional[DocumentCache] = None,
+        http_pool_size: int = 10,
+        request_timeout: Optional[float] = None,
+        transport: str = "rest",
+        grpc_api_endpoint: Optional[str] = None,
     ) -> "MatchingEngine":
         """Takes the object creation out of the constructor.
 
@@ -367,6 +1152,17 @@ class MatchingEngine(VectorStore):
             the local file system.
             embedding: The :class:`Embeddings` that will be used for
             embedding the texts.
+            max_download_workers: The maximum number of documents downloaded
+            concurrently from GCS for one query.
+            document_cache: (Optional) A :class:`DocumentCache` answering
+            repeated document reads without GCS.
+            http_pool_size: The maximum number of kept-alive connections to
+            the index endpoint.
+            request_timeout: (Optional) The timeout in seconds of the
+            findNeighbors requests.
+            transport: "rest" or "grpc", see :class:`MatchingEngine`.
+            grpc_api_endpoint: (Optional) The address of the gRPC endpoint,
+            see :class:`MatchingEngine`.
 
         Returns:
             A configured MatchingEngine with the texts added to the index.
@@ -404,6 +1200,12 @@ class MatchingEngine(VectorStore):
             index_endpoint_client=index_endpoint_client,
             credentials=credentials,
             gcs_bucket_name=gcs_bucket_name,
+            max_download_workers=max_download_workers,
+            document_cache=document_cache,
+            http_pool_size=http_pool_size,
+            request_timeout=request_timeout,
+            transport=transport,
+            grpc_api_endpoint=grpc_api_endpoint,
         )
 
     @classmethod
@@ -0,0 +1,467 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=redefined-outer-name,protected-access
+
+"""
+Unit tests for the MatchingEngine vector store and its DocumentCache.
+
+The index endpoint and GCS are replaced by mocks, so the tests run without
+any Google Cloud project.
+"""
+
+from types import SimpleNamespace
+from typing import List, Optional
+from unittest.mock import MagicMock
+
+from google.api_core.exceptions import NotFound
+import matching_engine
+from matching_engine import DocumentCache, MatchingEngine
+import pytest
+
+
+# Test helper functions
+def create_neighbor(
+    datapoint_id: str, distance: float, restricts: Optional[List[dict]] = None
+) -> dict:
+    """Create a neighbor in the format of the findNeighbors REST response."""
+    return {
+        "datapoint": {"datapointId": datapoint_id, "restricts": restricts or []},
+        "distance": distance,
+    }
+
+
+def create_response(nearest_neighbors: list) -> MagicMock:
+    """Create a successful findNeighbors REST response."""
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"nearestNeighbors": nearest_neighbors}
+    return response
+
+
+def create_blob(name: str) -> MagicMock:
+    """Create a GCS blob whose content is derived from its name."""
+    return MagicMock(download_as_string=MagicMock(return_value=f"<{name}>".encode()))
+
+
+def create_private_response(neighbors: List[tuple]) -> SimpleNamespace:
+    """Create a BatchMatchResponse of a private endpoint with one query."""
+    return SimpleNamespace(
+        responses=[
+            SimpleNamespace(
+                responses=[
+                    SimpleNamespace(
+                        neighbor=[
+                            SimpleNamespace(id=datapoint_id, distance=distance)
+                            for datapoint_id, distance, _ in neighbors
+                        ],
+                        embeddings=[
+                            SimpleNamespace(
+                                id=datapoint_id,
+                                restricts=[
+                                    SimpleNamespace(
+                                        name="source",
+                                        allow_tokens=[source],
+                                        deny_tokens=[],
+                                    )
+                                ],
+                            )
+                            for datapoint_id, _, source in neighbors
+                        ],
+                    )
+                ]
+            )
+        ]
+    )
+
+
+# Fixtures
+@pytest.fixture
+def engine() -> MatchingEngine:
+    """Create a MatchingEngine backed by mocks."""
+    index = MagicMock()
+    index.name = "index"
+    endpoint = MagicMock(
+        deployed_indexes=[SimpleNamespace(id="deployed", index="index")]
+    )
+    embedding = MagicMock()
+    embedding.embed_documents.side_effect = lambda texts: [
+        [float(len(text))] for text in texts
+    ]
+    gcs_client = MagicMock()
+    gcs_client.get_bucket.return_value.blob.side_effect = create_blob
+
+    return MatchingEngine(
+        project_id="project",
+        region="us-central1",
+        index=index,
+        endpoint=endpoint,
+        embedding=embedding,
+        gcs_client=gcs_client,
+        index_client=MagicMock(),
+        index_endpoint_client=MagicMock(),
+        gcs_bucket_name="bucket",
+        credentials=MagicMock(),
+        max_download_workers=1,
+    )
+
+
+# Neighbor selection
+def test_select_neighbors_filters_by_distance_and_k(engine) -> None:
+    """Neighbors below the distance threshold are dropped and at most k are kept."""
+    neighbors = [
+        create_neighbor("a", 0.9),
+        create_neighbor("b", 0.5),
+        create_neighbor("c", 0.8),
+        create_neighbor("d", 0.7),
+    ]
+
+    selected = engine._select_neighbors(neighbors, 2, 0.65, {})
+
+    assert [datapoint_id for datapoint_id, _ in selected] == ["a", "c"]
+    assert selected[0][1] == {"score": 0.9}
+
+
+def test_select_neighbors_applies_filters(engine) -> None:
+    """Neighbors outside an allow list or inside a deny list are dropped."""
+    neighbors = [
+        create_neighbor("a", 0.9, [{"namespace": "source", "allowList": ["a.pdf"]}]),
+        create_neighbor("b", 0.9, [{"namespace": "source", "allowList": ["b.pdf"]}]),
+        create_neighbor("c", 0.9, [{"namespace": "source", "allowList": ["c.pdf"]}]),
+    ]
+    filters = [
+        {"namespace": "source", "allow_list": ["a.pdf", "b.pdf"]},
+        {"namespace": "source", "deny_list": ["b.pdf"]},
+    ]
+
+    selected = engine._select_neighbors(neighbors, 4, 0.0, filters)
+
+    assert selected == [("a", {"source": "a.pdf", "score": 0.9})]
+
+
+def test_select_neighbors_ignores_deny_only_restricts(engine) -> None:
+    """Restricts without an allow list add no metadata."""
+    neighbors = [
+        create_neighbor(
+            "a",
+            0.9,
+            [
+                {"namespace": "source", "denyList": ["b.pdf"]},
+                {"namespace": "lang", "allowList": ["en"]},
+            ],
+        )
+    ]
+
+    selected = engine._select_neighbors(neighbors, 4, 0.0, {})
+
+    assert selected == [("a", {"lang": "en", "score": 0.9})]
+
+
+def test_neighbor_to_dict_omits_empty_lists() -> None:
+    """gRPC neighbors are converted like REST neighbors, without empty lists."""
+    neighbor = SimpleNamespace(
+        datapoint=SimpleNamespace(
+            datapoint_id="a",
+            restricts=[
+                SimpleNamespace(namespace="source", allow_list=[], deny_list=["b"])
+            ],
+        ),
+        distance=0.5,
+    )
+
+    assert MatchingEngine._neighbor_to_dict(neighbor) == create_neighbor(
+        "a", 0.5, [{"namespace": "source", "denyList": ["b"]}]
+    )
+
+
+# Batched search
+def test_similarity_search_batch_maps_results_by_query_id(engine) -> None:
+    """Results are matched to queries by the id of each response entry."""
+    engine.get_matches = MagicMock(
+        return_value=create_response(
+            [
+                {"id": "2", "neighbors": [create_neighbor("c", 0.9)]},
+                {"id": "0", "neighbors": [create_neighbor("a", 0.9)]},
+            ]
+        )
+    )
+
+    results = engine.similarity_search_batch(["q0", "q1", "q2"], k=2)
+
+    assert [[document.page_content for document in docs] for docs in results] == [
+        [b"<documents/a>"],
+        [],
+        [b"<documents/c>"],
+    ]
+    assert engine.embedding.embed_documents.call_count == 1
+    assert engine.get_matches.call_count == 1
+
+
+def test_similarity_search_batch_downloads_shared_documents_once(engine) -> None:
+    """A document matched by several queries is downloaded once."""
+    engine.get_matches = MagicMock(
+        return_value=create_response(
+            [
+                {"id": "0", "neighbors": [create_neighbor("a", 0.9)]},
+                {"id": "1", "neighbors": [create_neighbor("a", 0.8)]},
+            ]
+        )
+    )
+
+    results = engine.similarity_search_batch(["q0", "q1"])
+
+    assert results[1][0].metadata == {"score": 0.8}
+    assert engine.gcs_client.get_bucket.return_value.blob.call_count == 1
+
+
+def test_similarity_search_batch_without_queries(engine) -> None:
+    """No request is sent for an empty batch."""
+    engine.get_matches = MagicMock()
+
+    assert engine.similarity_search_batch([]) == []
+    engine.get_matches.assert_not_called()
+
+
+# HTTP session
+def test_get_matches_reuses_one_session(engine, monkeypatch) -> None:
+    """REST queries share one pooled session and its credentials until closed."""
+    sessions = []
+
+    def create_session(credentials) -> MagicMock:
+        session = MagicMock(credentials=credentials)
+        session.post.return_value = create_response([])
+        sessions.append(session)
+        return session
+
+    http_adapter = MagicMock()
+    monkeypatch.setattr(
+        matching_engine.google.auth.transport.requests,
+        "AuthorizedSession",
+        create_session,
+    )
+    monkeypatch.setattr(matching_engine, "HTTPAdapter", http_adapter)
+    engine.http_pool_size = 4
+    engine.request_timeout = 2.5
+
+    engine.similarity_search("q0")
+    engine.similarity_search("q1")
+
+    assert len(sessions) == 1
+    session = sessions[0]
+    assert session.credentials is engine.credentials
+    http_adapter.assert_called_once_with(pool_connections=1, pool_maxsize=4)
+    session.mount.assert_called_once_with("https://", http_adapter.return_value)
+    assert [call.kwargs["timeout"] for call in session.post.call_args_list] == [
+        2.5,
+        2.5,
+    ]
+    engine.credentials.refresh.assert_not_called()
+
+    engine.close()
+
+    session.close.assert_called_once()
+    engine.similarity_search("q2")
+    assert len(sessions) == 2
+
+
+# gRPC transport
+def test_get_matches_grpc_round_trip(engine, monkeypatch) -> None:
+    """gRPC neighbors of public endpoints are filtered like REST ones."""
+    match_service_client = MagicMock()
+    monkeypatch.setattr(
+        matching_engine.aiplatform_v1, "MatchServiceClient", match_service_client
+    )
+    match_service_client.return_value.find_neighbors.return_value = SimpleNamespace(
+        nearest_neighbors=[
+            SimpleNamespace(
+                id="0",
+                neighbors=[
+                    SimpleNamespace(
+                        datapoint=SimpleNamespace(
+                            datapoint_id=datapoint_id,
+                            restricts=[
+                                SimpleNamespace(
+                                    namespace="source",
+                                    allow_list=[source],
+                                    deny_list=[],
+                                )
+                            ],
+                        ),
+                        distance=0.9,
+                    )
+                    for datapoint_id, source in [("a", "a.pdf"), ("b", "b.pdf")]
+                ],
+            )
+        ]
+    )
+    engine.transport = "grpc"
+    engine.endpoint.public_endpoint_domain_name = "public.vdb"
+    filters = [{"namespace": "source", "deny_list": ["b.pdf"]}]
+
+    engine.similarity_search("q0", k=2, filters=filters)
+    documents = engine.similarity_search("q0", k=2, filters=filters)
+
+    assert [document.metadata for document in documents] == [
+        {"source": "a.pdf", "score": 0.9}
+    ]
+    match_service_client.assert_called_once()
+    assert match_service_client.call_args.kwargs["client_options"] == {
+        "api_endpoint": "public.vdb"
+    }
+    request = match_service_client.return_value.find_neighbors.call_args.kwargs[
+        "request"
+    ]
+    assert request.deployed_index_id == "deployed"
+    assert request.queries[0].neighbor_count == 2
+    assert list(request.queries[0].datapoint.restricts[0].deny_list) == ["b.pdf"]
+
+
+@pytest.mark.parametrize(
+    "psc_ip_address, match_grpc_address, expected_address",
+    [("10.0.0.5", "", "10.0.0.5:10000"), (None, "10.0.0.6", "10.0.0.6:10000")],
+)
+def test_private_endpoints_use_the_private_match_service(
+    engine, monkeypatch, psc_ip_address, match_grpc_address, expected_address
+) -> None:
+    """Private endpoints are queried over one private gRPC channel."""
+    insecure_channel = MagicMock()
+    match_service_stub = MagicMock()
+    monkeypatch.setattr(matching_engine.grpc, "insecure_channel", insecure_channel)
+    monkeypatch.setattr(
+        matching_engine.match_service_pb2_grpc, "MatchServiceStub", match_service_stub
+    )
+    match_service_stub.return_value.BatchMatch.return_value = create_private_response(
+        [("a", 0.9, "a.pdf"), ("b", 0.8, "b.pdf")]
+    )
+    engine.endpoint.public_endpoint_domain_name = ""
+    engine.endpoint.private_service_connect_ip_address = psc_ip_address
+    engine.endpoint.deployed_indexes = [
+        SimpleNamespace(
+            id="deployed",
+            index="index",
+            private_endpoints=SimpleNamespace(match_grpc_address=match_grpc_address),
+        )
+    ]
+    filters = [{"namespace": "source", "allow_list": ["a.pdf"]}]
+
+    engine.similarity_search("q0", k=2, filters=filters)
+    documents = engine.similarity_search("q0", k=2, filters=filters)
+
+    assert [document.metadata for document in documents] == [
+        {"source": "a.pdf", "score": 0.9}
+    ]
+    insecure_channel.assert_called_once_with(expected_address)
+    request = match_service_stub.return_value.BatchMatch.call_args.args[0]
+    assert request.requests[0].deployed_index_id == "deployed"
+    assert request.requests[0].requests[0].num_neighbors == 2
+    assert list(request.requests[0].requests[0].restricts[0].allow_tokens) == ["a.pdf"]
+
+    engine.close()
+
+    insecure_channel.return_value.close.assert_called_once()
+
+
+def test_private_endpoints_need_an_address(engine) -> None:
+    """A private endpoint without any address cannot be queried."""
+    engine.endpoint.public_endpoint_domain_name = ""
+    engine.endpoint.private_service_connect_ip_address = None
+    engine.endpoint.deployed_indexes = [
+        SimpleNamespace(
+            id="deployed",
+            index="index",
+            private_endpoints=SimpleNamespace(match_grpc_address=""),
+        )
+    ]
+
+    with pytest.raises(ValueError):
+        engine.similarity_search("q0")
+
+
+# GCS downloads
+def test_download_from_gcs_returns_empty_for_missing_documents(engine) -> None:
+    """A missing document is downloaded as an empty string."""
+    blob = engine.gcs_client.get_bucket.return_value.blob
+    blob.side_effect = None
+    blob.return_value.download_as_string.side_effect = NotFound("missing")
+
+    assert engine._download_from_gcs("documents/missing") == ""
+
+
+def test_download_from_gcs_raises_other_errors(engine) -> None:
+    """Errors other than a missing document are not hidden."""
+    engine.gcs_client.get_bucket.side_effect = PermissionError("denied")
+
+    with pytest.raises(PermissionError):
+        engine._download_from_gcs("documents/a")
+
+
+# DocumentCache
+def test_get_documents_uses_the_document_cache(engine) -> None:
+    """Cached documents are not downloaded again."""
+    engine.document_cache = DocumentCache()
+
+    assert engine._get_documents(["a", "a"]) == [b"<documents/a>"] * 2
+    assert engine._get_documents(["a"]) == [b"<documents/a>"]
+
+    assert engine.gcs_client.get_bucket.return_value.blob.call_count == 1
+
+
+def test_document_cache_measures_bytes() -> None:
+    """The memory tier is bounded by the UTF-8 size of the documents."""
+    cache = DocumentCache(max_memory_bytes=10)
+
+    cache.put("a", "é" * 3)
+    cache.put("b", "é" * 3)
+
+    assert cache.stats()["memory_bytes"] == 6
+    assert cache.stats()["evictions"] == 1
+
+
+def test_document_cache_disk_tier_is_bounded(tmp_path) -> None:
+    """The least recently used files are removed once the disk tier is full."""
+    cache = DocumentCache(
+        max_memory_bytes=0, cache_dir=str(tmp_path), max_disk_bytes=10
+    )
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    cache.get("a")
+
+    cache.put("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.stats()["disk_bytes"] == 8
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c"]
+
+
+def test_document_cache_reloads_disk_tier(tmp_path) -> None:
+    """Documents on disk are found, and bounded, by a new cache."""
+    cache = DocumentCache(cache_dir=str(tmp_path))
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+
+    reloaded = DocumentCache(cache_dir=str(tmp_path), max_disk_bytes=4)
+
+    assert reloaded.stats()["disk_entries"] == 1
+    assert reloaded.get("b") == b"bbbb"
+
+
+def test_document_cache_invalidate(tmp_path) -> None:
+    """Invalidated documents are removed from both tiers."""
+    cache = DocumentCache(cache_dir=str(tmp_path))
+    cache.put("a", b"aaaa")
+
+    cache.invalidate("a")
+
+    assert cache.get("a") is None
+    assert cache.stats()["disk_bytes"] == 0